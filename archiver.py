@@ -0,0 +1,185 @@
+#!/usr/bin/python
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import os
+import shutil
+
+from metrics import metrics
+
+
+class Archiver:
+    """This class moves processed pdfs into the archive directory in batches. Each target directory is created
+    once per batch, and pdfs are renamed in place when the archive is on the same filesystem. Moves to another
+    filesystem copy the file, so they are run on several threads at once.
+
+    Before a batch is moved, every planned move is written to a journal. If the program stops part way through,
+    the next Archiver finds the journal and finishes the moves (rolls forward), or puts the pdfs back where they
+    were (rolls back)."""
+
+    # Moves to another filesystem that are run at once.
+    MAX_THREADS = 4
+
+    def __init__(self, input_directory, archived_directory, archive_by_month, journal_filename=""):
+        """
+        :param input_directory: The input directory where the processed pdf files are located
+        :param archived_directory: The name of the archive directory, inside the input directory
+        :param archive_by_month: Put archived pdfs in a subdirectory for each month, ie: 2022-08
+        :param journal_filename: (Optional) The filename of the journal. If blank, moves aren't journaled.
+        """
+        if not input_directory.endswith('/'):
+            input_directory += '/'
+        self.input_directory = input_directory
+        self.archived_directory = archived_directory.strip('/')
+        self.archive_by_month = archive_by_month
+        self.journal_filename = journal_filename
+
+        # Directories already created, and whether moves between two directories stay on the same filesystem.
+        self._created = set()
+        self._same_device = {}
+
+    def target(self, filename, month=None):
+        """
+        Gets where a pdf is archived to. Pdfs in subdirectories keep their subdirectory, ie: Archived/acme/label.pdf
+        :param filename: The absolute filename of the pdf
+        :param month: (Optional) The month subdirectory, ie: 2022-08. Defaults to the current month.
+        :return: The absolute filename of the archived pdf
+        """
+        archive_path = self.input_directory + self.archived_directory + '/'
+        if self.archive_by_month:
+            if month is None:
+                month = datetime.datetime.now().strftime("%Y-%m")
+            archive_path += month + '/'
+
+        if filename.startswith(self.input_directory):
+            return archive_path + filename[len(self.input_directory):]
+        return archive_path + os.path.basename(filename)
+
+    def archive(self, filenames):
+        """
+        Move pdfs into the archive directory as a batch.
+        :param filenames: A list of absolute pdf filenames
+        :return: A dictionary of the archived filename, or the error if it couldn't be moved, keyed by filename
+        """
+        if not filenames:
+            return {}
+
+        month = datetime.datetime.now().strftime("%Y-%m")
+        moves = [(filename, self.target(filename, month)) for filename in filenames]
+        results = {}
+
+        with metrics.time("archive"):
+            self._write_journal(moves)
+
+            for directory in sorted({os.path.dirname(target) for _, target in moves}):
+                if directory not in self._created:
+                    os.makedirs(directory, exist_ok=True)
+                    self._created.add(directory)
+
+            # Renames on the same filesystem are instant. Anything else is copied on its own thread.
+            copies = []
+            for source, target in moves:
+                if self._is_same_device(source, target):
+                    results[source] = self._move(source, target, os.replace)
+                else:
+                    copies.append((source, target))
+
+            if copies:
+                with ThreadPoolExecutor(max_workers=min(self.MAX_THREADS, len(copies))) as executor:
+                    for (source, _), result in zip(copies, executor.map(
+                            lambda move: self._move(move[0], move[1], shutil.move), copies)):
+                        results[source] = result
+                metrics.count("files_archived_across_filesystems", len(copies))
+
+            self._remove_journal()
+
+        metrics.count("files_archived", sum(1 for result in results.values() if not isinstance(result, Exception)))
+        return results
+
+    @staticmethod
+    def _move(source, target, move):
+        """
+        Move a pdf, returning the error instead of raising it, so one pdf can't stop the rest of the batch.
+        :param source: The filename of the pdf
+        :param target: The archived filename
+        :param move: os.replace or shutil.move
+        :return: The archived filename, or the error
+        """
+        try:
+            move(source, target)
+        except OSError as ex:
+            return ex
+        return target
+
+    def _is_same_device(self, source, target):
+        """
+        Checks if a pdf can be renamed into the archive, instead of copied.
+        :param source: The filename of the pdf
+        :param target: The archived filename, whose directory exists
+        :return: True if both are on the same filesystem
+        """
+        key = (os.path.dirname(source), os.path.dirname(target))
+        if key not in self._same_device:
+            try:
+                self._same_device[key] = os.stat(key[0]).st_dev == os.stat(key[1]).st_dev
+            except OSError:
+                self._same_device[key] = False
+        return self._same_device[key]
+
+    def _write_journal(self, moves):
+        """
+        Record the moves of a batch before any of them are made, and make sure the record is on disk.
+        :param moves: A list of (source, target) filenames
+        """
+        if not self.journal_filename:
+            return
+        with open(self.journal_filename, "w", encoding="utf-8") as journal:
+            for source, target in moves:
+                journal.write(json.dumps({"source": source, "target": target}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _remove_journal(self):
+        """
+        Remove the journal once every move of a batch has been made.
+        """
+        if self.journal_filename and os.path.exists(self.journal_filename):
+            os.remove(self.journal_filename)
+
+    def recover(self, roll_forward=True):
+        """
+        Finish, or undo, a batch of moves that was interrupted. Nothing is done if there is no journal.
+        A pdf that is in both places was being copied to another filesystem, so the copy is made again, or removed.
+        :param roll_forward: Finish the moves if True, or put every pdf of the batch back where it was if False
+        :return: The number of pdfs that were moved
+        """
+        if not self.journal_filename or not os.path.exists(self.journal_filename):
+            return 0
+
+        moves = []
+        with open(self.journal_filename, "r", encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash while writing the journal means no moves were made after it
+                    continue
+                moves.append((entry["source"], entry["target"]))
+
+        moved = 0
+        for source, target in moves:
+            if roll_forward and os.path.exists(source):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(source, target)
+                moved += 1
+            elif not roll_forward and os.path.exists(target):
+                if os.path.exists(source):
+                    os.remove(target)
+                else:
+                    os.makedirs(os.path.dirname(source), exist_ok=True)
+                    shutil.move(target, source)
+                    moved += 1
+
+        self._remove_journal()
+        metrics.count("files_archive_recovered", moved)
+        return moved
@@ -0,0 +1,443 @@
+#!/usr/bin/python
+
+# concurrent.futures only imports the process pool, and multiprocessing, the first time ProcessPoolExecutor is used
+import concurrent.futures
+import collections
+import functools
+import itertools
+import os
+import time
+
+from duplicate_index import DuplicateIndex
+from metrics import metrics
+from pdf import Pdf, ReaderPool
+from pipeline import Pipeline
+from text_cache import TextCache
+
+
+class PdfResult:
+    """This class represents the outcome of processing a single PDF file."""
+    def __init__(self, filename, new_filename=None, pages=0, new_pages=0, error=None, data=None, seconds=0.0,
+                 metrics=None, archived_filename=None, outputs=None, duplicate_pages=0):
+        self.filename = filename
+        self.new_filename = new_filename
+        self.pages = pages
+        self.new_pages = new_pages
+        self.error = error
+        self.data = data
+        self.seconds = seconds
+        self.metrics = metrics
+        self.archived_filename = archived_filename
+        # The filenames of the extra outputs, keyed by output name
+        self.outputs = outputs or {}
+        # Pages left in, or left out, that were already processed from another pdf
+        self.duplicate_pages = duplicate_pages
+
+    def __str__(self):
+        return self.filename
+
+    @property
+    def ok(self):
+        """
+        Gets whether the pdf was processed without errors
+        :return: True if the pdf was processed, False if it failed
+        """
+        return self.error is None
+
+
+def process_pdf(filename, filter_text, bounding_box, rotate, file_suffix, write_file=True, merged_pdf=None,
+                return_bytes=False, text_cache="", verdicts=None, input_mode="auto", rules=None, outputs=None,
+                hard_crop=False, duplicate_index="", skip_duplicates=False):
+    """
+    Crop, rotate and text filter a single pdf. This is run inside worker processes, so any error is
+    returned in the result instead of being raised, and a single corrupt pdf cannot stop the batch.
+    :param filename: The filename of the pdf
+    :param filter_text: Pages containing this text are not cropped
+    :param bounding_box: The bounding box used for cropping
+    :param rotate: Rotate Portrait to Landscape
+    :param file_suffix: The suffix added to the end of the new file.
+    :param write_file: Write the processed pdf to a new file
+    :param merged_pdf: (Optional) A MergedPdf the processed pages are added to
+    :param return_bytes: Return the processed pdf as bytes in the result, for merging in another process
+    :param text_cache: (Optional) The filename of the page filter cache
+    :param verdicts: (Optional) Whether the filter text appears in each page, from filter_pages
+    :param input_mode: (Optional) How the pdf is opened: auto, buffered, mmap or read
+    :param rules: (Optional) A RuleEngine that chooses the crop profile of each page
+    :param outputs: (Optional) A list of extra Output written for the pdf, which are always written to files
+    :param hard_crop: (Optional) Remove everything drawn outside the bounding box from the cropped pages
+    :param duplicate_index: (Optional) The filename of the duplicate index, to find pages already processed
+    :param skip_duplicates: (Optional) Leave out pages already processed from another pdf
+    :return: A PdfResult
+    """
+    start_time = time.perf_counter()
+    try:
+        cache = TextCache.open(text_cache) if text_cache and filter_text else None
+        duplicates = DuplicateIndex.open(duplicate_index) if duplicate_index else None
+        with Pdf(filename, filter_text, bounding_box, rotate, cache, input_mode, rules=rules, outputs=outputs,
+                 hard_crop=hard_crop, duplicates=duplicates, skip_duplicates=skip_duplicates) as pdf:
+            pages = pdf.processed_pages(verdicts)
+            new_filename = pdf.processed_file(file_suffix, pages) if write_file else None
+            output_filenames = pdf.output_files()
+            data = pdf.processed_bytes(pages) if return_bytes else None
+            if merged_pdf is not None:
+                # The size of the processed pdf, if it was written, saves estimating it
+                merged_pdf.add_pages(pages, os.path.getsize(new_filename) if new_filename else None)
+    except Exception as ex:
+        return PdfResult(filename, error=str(ex) or type(ex).__name__, seconds=time.perf_counter() - start_time)
+
+    return PdfResult(filename, new_filename, pdf.pages, pdf.new_pages, data=data,
+                     seconds=time.perf_counter() - start_time, outputs=output_filenames,
+                     duplicate_pages=pdf.duplicate_pages)
+
+
+# Names for pdfs held in memory, which have no filename
+_memory_names = itertools.count(1)
+
+
+def process_bytes(data, filter_text, bounding_box, rotate, text_cache="", name=None, rules=None, hard_crop=False):
+    """
+    Crop, rotate and text filter a pdf held in memory, ie: one sent to the crop server. Nothing is written to disk.
+    :param data: The bytes of the pdf
+    :param filter_text: Pages containing this text are not cropped
+    :param bounding_box: The bounding box used for cropping
+    :param rotate: Rotate Portrait to Landscape
+    :param text_cache: (Optional) The filename of the page filter cache
+    :param name: (Optional) A name for the pdf in the result, ie: the filename it was uploaded as
+    :param rules: (Optional) A RuleEngine that chooses the crop profile of each page
+    :param hard_crop: (Optional) Remove everything drawn outside the bounding box from the cropped pages
+    :return: A PdfResult with the processed pdf as its data
+    """
+    name = name or f"<memory {next(_memory_names)}>"
+    start_time = time.perf_counter()
+    try:
+        cache = TextCache.open(text_cache) if text_cache and filter_text else None
+        with Pdf(name, filter_text, bounding_box, rotate, cache, data=data, rules=rules, hard_crop=hard_crop) as pdf:
+            new_data = pdf.processed_bytes()
+    except Exception as ex:
+        return PdfResult(name, error=str(ex) or type(ex).__name__, seconds=time.perf_counter() - start_time)
+
+    return PdfResult(name, None, pdf.pages, pdf.new_pages, data=new_data, seconds=time.perf_counter() - start_time)
+
+
+def _read_pdf(filename):
+    """
+    Load a pdf with a single read. This is the read stage of the pipeline.
+    :param filename: The filename of the pdf
+    :return: The filename, the bytes of the pdf, and why it couldn't be read or None
+    """
+    try:
+        with metrics.time("read"):
+            stream, _ = ReaderPool.open(filename, "read")
+    except OSError:
+        return filename, None, f"Cannot find file: {filename}"
+    return filename, stream.getvalue(), None
+
+
+def _process_read_pdf(read_pdf, filter_text, bounding_box, rotate, file_suffix, write_file, merged_pdf, text_cache,
+                      rules, outputs, hard_crop, duplicate_index, skip_duplicates):
+    """
+    Crop, rotate and text filter a pdf that has been read, leaving the processed pdf to be written. This is the
+    process stage of the pipeline. The arguments are the same as process_pdf.
+    :param read_pdf: The filename, bytes and error from _read_pdf
+    :return: A PdfResult, and the bytes to write to its new filename or None
+    """
+    filename, data, error = read_pdf
+    start_time = time.perf_counter()
+    if error is not None:
+        return PdfResult(filename, error=error), None
+    try:
+        cache = TextCache.open(text_cache) if text_cache and filter_text else None
+        duplicates = DuplicateIndex.open(duplicate_index) if duplicate_index else None
+        with Pdf(filename, filter_text, bounding_box, rotate, cache, data=data, rules=rules, outputs=outputs,
+                 hard_crop=hard_crop, duplicates=duplicates, skip_duplicates=skip_duplicates) as pdf:
+            pages = pdf.processed_pages()
+            new_data = pdf.processed_bytes(pages) if write_file else None
+            output_filenames = pdf.output_files()
+            if merged_pdf is not None:
+                merged_pdf.add_pages(pages, len(new_data) if new_data is not None else None)
+    except Exception as ex:
+        return PdfResult(filename, error=str(ex) or type(ex).__name__, seconds=time.perf_counter() - start_time), None
+
+    new_filename = pdf.new_filename(file_suffix) if write_file else None
+    return PdfResult(filename, new_filename, pdf.pages, pdf.new_pages, seconds=time.perf_counter() - start_time,
+                     outputs=output_filenames, duplicate_pages=pdf.duplicate_pages), new_data
+
+
+def _write_processed_pdf(processed_pdf):
+    """
+    Write a processed pdf to its new file. This is the write stage of the pipeline.
+    :param processed_pdf: The PdfResult and bytes from _process_read_pdf
+    :return: The PdfResult
+    """
+    result, data = processed_pdf
+    if data is None:
+        return result
+    start_time = time.perf_counter()
+    try:
+        with metrics.time("write_file"):
+            with open(result.new_filename, "wb") as output_stream:
+                output_stream.write(data)
+    except Exception as ex:
+        result.error = str(ex) or type(ex).__name__
+        result.new_filename = None
+    result.seconds += time.perf_counter() - start_time
+    return result
+
+
+def _process_pdf_in_worker(filename, **keywords):
+    """
+    Process a single pdf in a worker process, and send back the metrics collected while processing it.
+    :param filename: The filename of the pdf
+    :param keywords: The remaining process_pdf arguments, by name
+    :return: A PdfResult
+    """
+    metrics.reset()
+    result = process_pdf(filename, **keywords)
+    TextCache.flush_all()
+    result.metrics = metrics.snapshot()
+    return result
+
+
+def filter_pages(filename, filter_text, text_cache, page_range, input_mode="auto"):
+    """
+    Check a shard of a pdf's pages for the filter text. This is run inside worker processes.
+    :param filename: The filename of the pdf
+    :param filter_text: Pages containing this text are not cropped
+    :param text_cache: (Optional) The filename of the page filter cache
+    :param page_range: The (start, end) page numbers of the shard, from 0, end not included
+    :param input_mode: (Optional) How the pdf is opened: auto, buffered, mmap or read
+    :return: A dictionary of whether the filter text appears in each page keyed by object number, and the metrics
+    collected
+    """
+    metrics.reset()
+    cache = TextCache.open(text_cache) if text_cache else None
+    with Pdf(filename, filter_text, None, False, cache, input_mode) as pdf:
+        verdicts = pdf.filter_verdicts(page_range)
+    TextCache.flush_all()
+    return verdicts, metrics.snapshot()
+
+
+def process_all(filenames, filter_text, bounding_box, rotate, file_suffix, workers=1, merged_pdf=None,
+                write_files=True, text_cache="", shard_pages=0, input_mode="auto", rules=None, outputs=None,
+                hard_crop=False, pipeline_depth=0, duplicate_index="", skip_duplicates=False):
+    """
+    Process pdfs, using a pool of worker processes if more than one worker is requested.
+    Results are always yielded in the same order as the filenames, so merging and archiving stay deterministic.
+    Filenames can be a generator, ie: from a directory scan, and each pdf is started as soon as it is found.
+    :param filenames: A list or generator of pdf filenames
+    :param filter_text: Pages containing this text are not cropped
+    :param bounding_box: The bounding box used for cropping
+    :param rotate: Rotate Portrait to Landscape
+    :param file_suffix: The suffix added to the end of the new files.
+    :param workers: The number of worker processes
+    :param merged_pdf: (Optional) A MergedPdf the processed pages of every pdf are added to, in order
+    :param write_files: Write each processed pdf to a new file
+    :param text_cache: (Optional) The filename of the page filter cache
+    :param shard_pages: (Optional) When there are fewer pdfs than workers, the pages of pdfs with at least twice
+    this many pages are checked for the filter text in shards, spread across the workers
+    :param input_mode: (Optional) How the pdfs are opened: auto, buffered, mmap or read
+    :param rules: (Optional) A RuleEngine that chooses the crop profile of each page
+    :param outputs: (Optional) A list of extra Output written for each pdf
+    :param hard_crop: (Optional) Remove everything drawn outside the bounding box from the cropped pages
+    :param pipeline_depth: (Optional) With one worker, read pdfs on one thread and write them on another while
+    each pdf is processed, with at most this many pdfs waiting between the stages. Pdfs are read whole, whatever
+    the input mode. If 0, each pdf is read, processed and written in turn.
+    :param duplicate_index: (Optional) The filename of the duplicate index, to find pages already processed
+    :param skip_duplicates: (Optional) Leave out pages already processed from another pdf
+    :return: A generator of PdfResult, one per filename
+    """
+    # Only a batch with fewer pdfs than workers can be sharded, so the whole batch is known if it is that small
+    filenames = iter(filenames)
+    first_filenames = list(itertools.islice(filenames, max(workers, 1)))
+    if len(first_filenames) < workers:
+        filenames = first_filenames
+    else:
+        filenames = itertools.chain(first_filenames, filenames)
+
+    shards = shard_ranges(filenames, workers, shard_pages, input_mode) \
+        if filter_text and isinstance(filenames, list) else {}
+
+    if workers <= 1 and pipeline_depth > 0:
+        process = functools.partial(_process_read_pdf, filter_text=filter_text, bounding_box=bounding_box,
+                                    rotate=rotate, file_suffix=file_suffix, write_file=write_files,
+                                    merged_pdf=merged_pdf, text_cache=text_cache, rules=rules, outputs=outputs,
+                                    hard_crop=hard_crop, duplicate_index=duplicate_index,
+                                    skip_duplicates=skip_duplicates)
+        yield from Pipeline(_read_pdf, process, _write_processed_pdf, pipeline_depth).run(filenames)
+        return
+
+    if workers <= 1 or (len(first_filenames) <= 1 and not shards):
+        for filename in filenames:
+            yield process_pdf(filename, filter_text, bounding_box, rotate, file_suffix, write_files, merged_pdf,
+                              text_cache=text_cache, input_mode=input_mode, rules=rules,
+                              outputs=outputs, hard_crop=hard_crop, duplicate_index=duplicate_index,
+                              skip_duplicates=skip_duplicates)
+        return
+
+    if isinstance(filenames, list):
+        workers = min(workers, len(filenames))
+
+    # Pages can't be shared between processes, so workers send back the processed pdf in memory instead.
+    keywords = dict(filter_text=filter_text, bounding_box=bounding_box, rotate=rotate, file_suffix=file_suffix,
+                    write_file=write_files, return_bytes=merged_pdf is not None, text_cache=text_cache,
+                    input_mode=input_mode, rules=rules, outputs=outputs, hard_crop=hard_crop,
+                    duplicate_index=duplicate_index, skip_duplicates=skip_duplicates)
+    if shards:
+        results = _process_sharded(filenames, shards, keywords, workers)
+    else:
+        results = _process_pool(filenames, keywords, workers)
+    for result in results:
+        if result.metrics is not None:
+            metrics.merge(result.metrics)
+            result.metrics = None
+        if result.data is not None:
+            merged_pdf.add_bytes(result.data)
+            result.data = None
+        yield result
+
+
+def shard_ranges(filenames, workers, shard_pages, input_mode="auto"):
+    """
+    Split the pages of pdfs into shards, one per worker, when there are fewer pdfs than workers.
+    :param filenames: A list of pdf filenames
+    :param workers: The number of worker processes
+    :param shard_pages: The fewest pages in a shard, or 0 to never split pdfs
+    :param input_mode: (Optional) How the pdfs are opened: auto, buffered, mmap or read
+    :return: A dictionary of lists of (start, end) page ranges, keyed by the filenames of the pdfs that are split
+    """
+    if workers <= 1 or not shard_pages or len(filenames) >= workers:
+        return {}
+
+    shards = {}
+    for filename in filenames:
+        # The pdf is closed again, so forked worker processes never share its open file with this process
+        try:
+            with Pdf(filename, None, None, False, input_mode=input_mode) as pdf:
+                pages = pdf.page_count()
+        except Exception:
+            # The pdf is processed as a whole, which reports why it can't be read
+            continue
+
+        count = min(workers, pages // shard_pages)
+        if count > 1:
+            shards[filename] = [(pages * shard // count, pages * (shard + 1) // count) for shard in range(count)]
+    return shards
+
+
+def _process_sharded(filenames, shards, keywords, workers):
+    """
+    Process a few pdfs in a pool of worker processes, checking the pages of the pdfs that are split into shards for
+    the filter text across the workers. Each of the other pdfs is processed in a worker at the same time as usual,
+    and each split pdf is processed in a worker once all of its shards are checked.
+    :param filenames: A list of pdf filenames, fewer than the workers
+    :param shards: A dictionary of lists of (start, end) page ranges, keyed by the filenames of the split pdfs
+    :param keywords: The remaining process_pdf arguments, by name
+    :param workers: The number of worker processes
+    :return: A generator of PdfResult, one per filename, in the same order as the filenames
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = []
+        for filename in filenames:
+            if filename in shards:
+                jobs.append((filename, [executor.submit(filter_pages, filename, keywords["filter_text"],
+                                                        keywords["text_cache"], page_range, keywords["input_mode"])
+                                        for page_range in shards[filename]]))
+            else:
+                jobs.append((filename, executor.submit(_process_pdf_in_worker, filename, **keywords)))
+
+        broken = False
+        for filename, job in jobs:
+            pdf_keywords = keywords
+            if isinstance(job, list):
+                verdicts = None
+                try:
+                    verdicts = {}
+                    for future in job:
+                        shard_verdicts, snapshot = future.result()
+                        metrics.merge(snapshot)
+                        verdicts.update(shard_verdicts)
+                except concurrent.futures.process.BrokenProcessPool:
+                    broken = True
+                    verdicts = None
+                except Exception:
+                    # The pdf checks its own pages while it is processed, and fails there if they can't be read
+                    verdicts = None
+                pdf_keywords = dict(keywords, verdicts=verdicts)
+                if not broken:
+                    job = executor.submit(_process_pdf_in_worker, filename, **pdf_keywords)
+
+            if not broken:
+                try:
+                    yield job.result()
+                    continue
+                except concurrent.futures.process.BrokenProcessPool:
+                    broken = True
+
+            # A worker process died, which takes down every unfinished job in the pool. The rest of the pdfs are
+            # each processed on their own, so only the pdf that crashed it fails.
+            yield _process_isolated(filename, pdf_keywords)
+
+
+def _process_pool(filenames, keywords, workers):
+    """
+    Process pdfs in a pool of worker processes. Only a few pdfs per worker are queued at a time, so a generator of
+    filenames is read as the pool needs more work.
+    :param filenames: A list or generator of pdf filenames
+    :param keywords: The remaining process_pdf arguments, by name
+    :param workers: The number of worker processes
+    :return: A generator of PdfResult, one per filename, in the same order as the filenames
+    """
+    filenames = iter(filenames)
+    retry = collections.deque()
+    while True:
+        broken = None
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            jobs = collections.deque()
+            submitting = True
+            while True:
+                while submitting and len(jobs) < workers * 2:
+                    filename = retry.popleft() if retry else next(filenames, None)
+                    if filename is None:
+                        break
+                    try:
+                        jobs.append((filename, executor.submit(_process_pdf_in_worker, filename, **keywords)))
+                    except concurrent.futures.process.BrokenProcessPool:
+                        # The pool broke since the last result. The pdf waits for a fresh pool, and the jobs that
+                        # finished before it broke are still read.
+                        retry.appendleft(filename)
+                        submitting = False
+                if not jobs:
+                    break
+
+                filename, future = jobs.popleft()
+                try:
+                    result = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    broken = [filename] + [job[0] for job in jobs]
+                    break
+                yield result
+
+        if broken is None:
+            if submitting:
+                break
+            continue
+
+        # A worker process died (ie: the pdf parser crashed the interpreter), which takes down every
+        # unfinished job in the pool. Retry the first unfinished pdf on its own to find out if it is the
+        # culprit, then start a fresh pool for the rest of the batch.
+        yield _process_isolated(broken[0], keywords)
+        retry.extendleft(reversed(broken[1:]))
+
+
+def _process_isolated(filename, keywords):
+    """
+    Process a single pdf in its own worker process.
+    :param filename: The filename of the pdf
+    :param keywords: The remaining process_pdf arguments, by name
+    :return: A PdfResult
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(_process_pdf_in_worker, filename, **keywords).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            return PdfResult(filename, error="Worker process crashed while processing this file.")
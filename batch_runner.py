@@ -0,0 +1,332 @@
+#!/usr/bin/python
+import os
+import time
+
+import batch
+import functions
+import text_cache
+from archiver import Archiver
+from duplicate_index import DuplicateIndex
+from leases import Leases
+from manifest import Manifest
+from merged_pdf import MergedPdf
+from metrics import metrics
+
+
+class BatchRunner:
+    """This class runs batches of pdfs through every stage: cropping, merging, archiving and recording them in
+    the manifest. It is what pdf_batch_crop.py runs, and other programs can use it the same way, ie:
+
+        runner = BatchRunner(Config(["-d", "/labels/", "-m"]))
+        for result in runner.run():
+            print(result.filename, result.new_pages, result.error)
+
+    Nothing is printed. Results are yielded in filename order as each pdf is finished, and the totals of the
+    last batch are kept in processed, failed, skipped and input_pages.
+
+    Pdfs are archived in batches once they are processed. When merging, they are only archived once the merged
+    pdf is written, so a crash never leaves an archived pdf out of the merged pdf. The archived filename of each
+    result is set once its batch is moved, and pdfs that couldn't be moved are kept in archive_errors.
+
+    In coordinated mode, several stations share the input directory. Each pdf is claimed with a lease before it is
+    processed, and released once it is archived, so pdfs being processed by another station are left to it and
+    kept in busy. The manifest, archive journal and merged pdf are kept for each station, named after it.
+
+    Pdfs and pages already processed under another filename, ie: the same label exported again, are found with
+    the duplicate index. Duplicate pdfs are kept in duplicates with the filename they were first processed from,
+    and duplicate pages are counted in duplicate_pages. If duplicates is skip, they are left out."""
+
+    # Pdfs archived at once when not merging.
+    ARCHIVE_BATCH = 100
+
+    def __init__(self, config):
+        self.config = config
+
+        # Stations sharing the input directory claim each pdf before processing it.
+        self.leases = Leases(config.directory, config.station, config.lease_seconds) if config.coordinate else None
+        self.busy = []
+
+        # Pdfs and pages processed before are kept in the input directory, like the page filter cache.
+        self.duplicate_index = text_cache.cache_filename(config.directory, config.duplicate_index)
+        self.duplicates = []
+        self.duplicate_pages = 0
+        # The hash of each pdf checked for duplicates, recorded in the index once the pdf is processed
+        self.file_hashes = {}
+
+        # The manifest in the input directory records which pdfs have been processed with which settings.
+        self.manifest = None
+        if config.manifest:
+            self.manifest = Manifest(config.directory + self.station_filename(config.manifest),
+                                     Manifest.config_fingerprint(config.bounding_box, config.filter, config.rotate,
+                                                                 config.suffix, config.rules, config.outputs,
+                                                                 config.hard_crop))
+
+        # A batch of moves interrupted by a crash is finished when the next batch is run.
+        self.archiver = Archiver(config.directory, config.archived_directory, config.archive_by_month,
+                                 config.directory + self.station_filename(config.archive_journal)
+                                 if config.archive_journal else "")
+        self.archive_errors = {}
+
+        self.merged_pdf = None
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.input_pages = 0
+        self.seconds = 0.0
+
+    @property
+    def merge_filepath(self):
+        """
+        Gets the filename of the merged pdf
+        :return: The filename of the merged pdf, in the input directory
+        """
+        return self.config.directory + self.station_filename(self.config.output_filename)
+
+    def station_filename(self, filename):
+        """
+        Gets the filename of a file each station keeps for itself in coordinated mode.
+        :param filename: The filename, ie: pdf_crop_merge.pdf
+        :return: The filename with the station's name added in coordinated mode, ie: pdf_crop_merge-packing1.pdf
+        """
+        if not self.config.coordinate:
+            return filename
+        base, extension = os.path.splitext(filename)
+        return f"{base}-{self.config.station}{extension}"
+
+    @property
+    def suffixes(self):
+        """
+        Gets the suffixes of every file written for a pdf
+        :return: A list of the suffix of the cropped pdf, followed by the suffix of each extra output
+        """
+        return [self.config.suffix] + [output.suffix for output in self.config.outputs]
+
+    def input_pdfs(self):
+        """
+        Finds the pdfs to process: the pdfs in the input directory, followed by the single input pdf if there is one.
+        :return: A generator of pdf filenames, which yields each pdf as soon as it is found
+        """
+        yield from self.scan_pdfs()
+        if self.config.input_filename:
+            yield self.config.input_filename
+
+    def scan_pdfs(self):
+        """
+        Finds the pdfs in the input directory, and its subdirectories if recursive, that match the include and
+        exclude globs. Processed pdfs, the merged pdf and the archive are left out.
+        :return: A generator of pdf filenames, which yields each pdf as soon as it is found
+        """
+        config = self.config
+        exclude = config.exclude
+        if config.coordinate:
+            # The merged pdfs of every station, and their volumes
+            base, extension = os.path.splitext(config.output_filename)
+            exclude = exclude + [f"{base}-*{extension}"]
+        return functions.scan_pdfs(config.directory, config.output_filename, self.suffixes, config.recursive,
+                                   config.include, exclude, [config.directory + config.archived_directory])
+
+    def new_pdfs(self, pdfs):
+        """
+        Leave out pdfs that haven't changed since they were processed with the same settings.
+        The number left out is counted in skipped. In coordinated mode, each pdf is claimed as it is handed to the
+        processing stage, and pdfs held by other stations are left out and kept in busy.
+        :param pdfs: A list or generator of pdf filenames
+        :return: A generator of the pdf filenames that still need to be processed
+        """
+        self.skipped = 0
+        self.busy = []
+        self.duplicates = []
+        self.file_hashes = {}
+        duplicates = DuplicateIndex.open(self.duplicate_index) if self.duplicate_index else None
+        for pdf in pdfs:
+            if self.manifest is not None and self.manifest.is_done(pdf):
+                self.skipped += 1
+                continue
+            if self.leases is not None:
+                if not self.leases.claim(pdf):
+                    self.busy.append(pdf)
+                    continue
+                # Another station may have archived it since the directory was scanned
+                if not os.path.exists(pdf):
+                    self.leases.release(pdf)
+                    continue
+            if duplicates is not None and self._is_skipped_duplicate(duplicates, pdf):
+                continue
+            yield pdf
+
+    def _is_skipped_duplicate(self, duplicates, pdf):
+        """
+        Checks if a pdf was already processed under another filename, keeping it in duplicates if it was.
+        :param duplicates: The DuplicateIndex
+        :param pdf: The filename of the pdf
+        :return: True if the pdf is a duplicate and duplicates are skipped
+        """
+        try:
+            with metrics.time("duplicates"):
+                file_hash = Manifest.file_hash(pdf)
+                original = duplicates.file_original(file_hash, pdf, record=False)
+        except OSError:
+            # A pdf that can't be read fails when it is processed
+            return False
+        if original is None:
+            self.file_hashes[pdf] = file_hash
+            return False
+
+        self.duplicates.append((pdf, original))
+        metrics.count("files_duplicate")
+        if self.config.duplicates != "skip":
+            self.file_hashes[pdf] = file_hash
+            return False
+        if self.leases is not None:
+            self.leases.release(pdf)
+        return True
+
+    def _record_original(self, pdf):
+        """
+        Record a pdf that has been processed in the duplicate index, so later copies of it are found.
+        :param pdf: The filename of the pdf
+        """
+        file_hash = self.file_hashes.pop(pdf, None)
+        if file_hash is not None:
+            with metrics.time("duplicates"):
+                DuplicateIndex.open(self.duplicate_index).file_original(file_hash, pdf)
+
+    def _started(self, pdfs):
+        """
+        Record each pdf as started in the manifest as it is handed to the processing stage.
+        :param pdfs: A generator of pdf filenames
+        :return: A generator of the same pdf filenames
+        """
+        for pdf in pdfs:
+            if self.manifest is not None:
+                self.manifest.started(pdf)
+            yield pdf
+
+    def run(self, pdfs=None, merge=True):
+        """
+        Process pdfs (in parallel if more than one worker), then merge (if option enabled) and archive.
+        Pdfs are processed as they are found, so the first results arrive while the directory is still being
+        scanned. Pdfs that are unchanged since they were processed are skipped.
+        :param pdfs: (Optional) A list or generator of pdf filenames. Defaults to the pdfs in the input directory.
+        :param merge: Merge the pdfs, if the merge option is enabled
+        :return: A generator of PdfResult, one per pdf, in the same order as the pdfs
+        """
+        config = self.config
+        manifest = self.manifest
+        start_time = time.time()
+
+        if pdfs is None:
+            pdfs = self.input_pdfs()
+
+        self.processed = 0
+        self.failed = 0
+        self.input_pages = 0
+        self.duplicate_pages = 0
+        self.archive_errors = {}
+        if config.archive:
+            self.archiver.recover()
+
+        # create merged PDF that will contain the processed PDFs, split into volumes if there is a page or size limit
+        merge = merge and config.merge
+        self.merged_pdf = MergedPdf(self.merge_filepath, config.merge_max_pages,
+                                    int(config.merge_max_mb * 1024 * 1024)) if merge else None
+
+        # When merging, individual cropped PDFs are only written if they are to be kept.
+        write_files = not merge or config.keep_cropped
+
+        # Page filter verdicts are cached in the input directory, so pages are only text extracted once.
+        cache_filename = text_cache.cache_filename(config.directory, config.text_cache) if config.filter else ""
+
+        # Results arrive in the same order as the pdfs, so the merged file and archive are deterministic.
+        # Processed pdfs wait here, with their snapshot and output, until they are archived and recorded as done.
+        finished = []
+        pdfs = self._started(self.new_pdfs(pdfs))
+        for pdf in batch.process_all(pdfs, config.filter, config.bounding_box, config.rotate, config.suffix,
+                                     config.workers, self.merged_pdf, write_files, cache_filename,
+                                     config.shard_pages, config.input_mode, config.rules, config.outputs,
+                                     config.hard_crop, config.pipeline_depth, self.duplicate_index,
+                                     config.duplicates == "skip"):
+            metrics.add_file(pdf.filename, pdf.pages, pdf.new_pages, pdf.seconds, pdf.error)
+
+            # A pdf that can't be processed is left in place, so it can be fixed and retried.
+            if not pdf.ok:
+                self.failed += 1
+                self.file_hashes.pop(pdf.filename, None)
+                metrics.count("files_failed")
+                if manifest is not None:
+                    manifest.failed(pdf.filename)
+                if self.leases is not None:
+                    self.leases.release(pdf.filename)
+                yield pdf
+                continue
+
+            self.processed += 1
+            self.input_pages += pdf.pages
+            self.duplicate_pages += pdf.duplicate_pages
+            self._record_original(pdf.filename)
+
+            # The pdf is only recorded as done once it is archived, or once the merged pdf is written.
+            snapshot = manifest.snapshot(pdf.filename) if manifest is not None else None
+            finished.append((pdf, snapshot, self.merged_pdf.current_filename if merge else pdf.new_filename))
+            if not merge and len(finished) >= self.ARCHIVE_BATCH:
+                self._finish(finished)
+                finished = []
+
+            yield pdf
+
+        metrics.count("files_processed", self.processed)
+
+        # Keep the page filter cache within its size and age limits.
+        if cache_filename and (self.processed or self.failed):
+            text_cache.TextCache.open(cache_filename, config.text_cache_max_entries,
+                                      config.text_cache_max_days).evict()
+        # Keep the duplicate index within its size limit.
+        if self.duplicate_index and (self.processed or self.failed):
+            DuplicateIndex.open(self.duplicate_index, config.duplicate_index_max_entries).evict()
+
+        # Write the pdf merger to a new PDF file, unless there was nothing new to merge.
+        if not self.processed and not self.failed:
+            self.merged_pdf = None
+        if self.merged_pdf is not None:
+            self.merged_pdf.write()
+        self._finish(finished)
+
+        self.seconds = time.time() - start_time
+        self.write_metrics()
+
+    def _finish(self, finished):
+        """
+        Archive a batch of processed pdfs, if the archive option is enabled, then record them as done, or as failed
+        if they couldn't be archived.
+        :param finished: A list of (PdfResult, manifest snapshot, output filename)
+        """
+        if self.config.archive:
+            archived = self.archiver.archive([pdf.filename for pdf, _, _ in finished])
+            for pdf, _, _ in finished:
+                if isinstance(archived[pdf.filename], Exception):
+                    self.archive_errors[pdf.filename] = archived[pdf.filename]
+                else:
+                    pdf.archived_filename = archived[pdf.filename]
+
+        # Pdfs that couldn't be archived are recorded as failed, so the next run archives them
+        if self.manifest is not None:
+            for pdf, snapshot, output in finished:
+                if pdf.filename in self.archive_errors:
+                    self.manifest.failed(pdf.filename)
+                else:
+                    self.manifest.done(pdf.filename, snapshot, output)
+
+        # Pdfs that couldn't be archived are released too, for whichever station runs next
+        if self.leases is not None:
+            for pdf, _, _ in finished:
+                self.leases.release(pdf.filename)
+
+    def write_metrics(self):
+        """
+        Write the metrics collected so far, if the metrics options are enabled.
+        In watch and serve mode the metrics keep adding up from when the runner started.
+        """
+        if self.config.metrics_json:
+            metrics.write_json(self.config.metrics_json)
+        if self.config.metrics_prometheus:
+            metrics.write_prometheus(self.config.metrics_prometheus)
@@ -0,0 +1,473 @@
+#!/usr/bin/python
+"""Benchmarks the stages of cropping label pdfs at several batch sizes, using generated label-like pdfs.
+
+Reports pages per second, peak memory, read syscalls and bytes written of each benchmark. Save a baseline with --save, and later runs
+are compared against it, failing if a benchmark is slower or uses more memory than the tolerance allows, or if there is
+no baseline to compare against.
+
+The startup benchmark crops a single pdf with pdf_batch_crop.py -i, the way shipping software runs it for each label,
+and also reports the time spent importing modules (python -X importtime), which is held to the baseline too."""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # Peak memory can't be measured on Windows
+    resource = None
+
+from PyPDF2 import PdfReader
+
+import batch
+import sample_pdfs
+from archiver import Archiver
+from merged_pdf import MergedPdf
+from metrics import metrics
+from page_filter import PageFilter
+from pdf import Pdf, ReaderPool
+
+
+BASELINE_FILENAME = "benchmark_baseline.json"
+DEFAULT_SIZES = [10, 100, 500]
+DEFAULT_TOLERANCE = 0.25
+
+# The config.ini defaults for cropping 8.5" x 11" labels to 4" x 6"
+BOUNDING_BOX = [470.0, 748.0, 542.0, 140.0]
+SUFFIX = "crop"
+
+# Benchmarks run on full label sheets, with instructions and an advertisement below the label
+SHEET_BENCHMARKS = ("crop_sheets", "hard_crop_sheets")
+
+# Benchmarks that run pdf_batch_crop.py in a child process
+SCRIPT_BENCHMARKS = ("end_to_end", "startup")
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_ms(importtime_output):
+    """
+    Gets the total time spent importing modules, from the output of python -X importtime.
+    :param importtime_output: The standard error of a python -X importtime process
+    :return: The time in milliseconds
+    """
+    total = 0
+    for line in importtime_output.splitlines():
+        # Modules imported by other modules are indented, and already included in their cumulative time
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\S.*)$', line)
+        if match:
+            total += int(match.group(1))
+    return round(total / 1000, 1)
+
+
+def peak_rss_mb(children=False):
+    """
+    Gets the peak memory used by this process, or by its finished child processes.
+    :param children: Get the peak memory of finished child processes instead
+    :return: The peak resident set size in MB, or None if it can't be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return round(peak / 1024 / 1024, 1)
+    return round(peak / 1024, 1)
+
+
+def read_syscalls():
+    """
+    Gets the number of read syscalls made by this process so far.
+    :return: The number of read syscalls, or None if it can't be measured (only Linux reports it)
+    """
+    try:
+        with open("/proc/self/io") as io_file:
+            for line in io_file:
+                if line.startswith("syscr:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def crop_files(filenames):
+    """
+    Crop pdfs without timing it, for benchmarks of the later stages.
+    :param filenames: A list of pdf filenames
+    :return: A list of the cropped pdf filenames
+    """
+    cropped_filenames = []
+    for filename in filenames:
+        with Pdf(filename, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False) as pdf:
+            cropped_filenames.append(pdf.processed_file(SUFFIX))
+    return cropped_filenames
+
+
+def bench_processed_file(directory, filenames):
+    """ Crop, filter and write every pdf with Pdf.processed_file """
+    pages = 0
+    start_time = time.perf_counter()
+    for filename in filenames:
+        with Pdf(filename, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False) as pdf:
+            pdf.processed_file(SUFFIX)
+            pages += pdf.pages
+    return pages, time.perf_counter() - start_time
+
+
+def bench_pipeline(directory, filenames):
+    """ Crop, filter and write every pdf with one worker, reading and writing on their own threads """
+    pages = 0
+    start_time = time.perf_counter()
+    for result in batch.process_all(filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False, SUFFIX,
+                                    pipeline_depth=4):
+        pages += result.pages
+    return pages, time.perf_counter() - start_time
+
+
+def parse_files(filenames, input_mode):
+    """
+    Parse every pdf and read all of its pages, the way cropping does.
+    :param filenames: A list of pdf filenames
+    :param input_mode: How the pdfs are opened: buffered, mmap or read
+    :return: The number of pages, and the time taken
+    """
+    pages = 0
+    start_time = time.perf_counter()
+    for filename in filenames:
+        stream, _ = ReaderPool.open(filename, input_mode)
+        with stream:
+            for page in PdfReader(stream).pages:
+                page.mediabox
+                pages += 1
+    return pages, time.perf_counter() - start_time
+
+
+def bench_parse_buffered(directory, filenames):
+    """ Parse every pdf from a buffered file, reading it as it is parsed """
+    return parse_files(filenames, "buffered")
+
+
+def bench_parse_mmap(directory, filenames):
+    """ Parse every pdf from a memory mapped file """
+    return parse_files(filenames, "mmap")
+
+
+def bench_parse_read(directory, filenames):
+    """ Parse every pdf after loading it with a single read """
+    return parse_files(filenames, "read")
+
+
+def bench_filter(directory, filenames):
+    """ Check every page for the filter text with PageFilter """
+    page_filter = PageFilter(sample_pdfs.FILTER_TEXT)
+    pages = [page for filename in filenames for page in PdfReader(filename).pages]
+    start_time = time.perf_counter()
+    for page in pages:
+        page_filter.matches(page)
+    return len(pages), time.perf_counter() - start_time
+
+
+def bench_filter_extract_text(directory, filenames):
+    """ Check every page for the filter text by extracting all of its text """
+    pattern = re.compile(sample_pdfs.FILTER_TEXT)
+    pages = [page for filename in filenames for page in PdfReader(filename).pages]
+    start_time = time.perf_counter()
+    for page in pages:
+        pattern.search(page.extract_text())
+    return len(pages), time.perf_counter() - start_time
+
+
+def crop_sheets(filenames, hard_crop):
+    """
+    Crop full label sheets to their label, and write them.
+    :param filenames: A list of pdf filenames
+    :param hard_crop: Remove the content outside the label too
+    :return: The number of pages, and the time taken
+    """
+    pages = 0
+    start_time = time.perf_counter()
+    for filename in filenames:
+        with Pdf(filename, sample_pdfs.FILTER_TEXT, sample_pdfs.LABEL_BOUNDING_BOX, False,
+                 hard_crop=hard_crop) as pdf:
+            pdf.processed_file(SUFFIX)
+            pages += pdf.pages
+    return pages, time.perf_counter() - start_time
+
+
+def bench_crop_sheets(directory, filenames):
+    """ Crop full label sheets to their label with the crop box """
+    return crop_sheets(filenames, False)
+
+
+def bench_hard_crop_sheets(directory, filenames):
+    """ Crop full label sheets to their label, also removing the content outside it """
+    return crop_sheets(filenames, True)
+
+
+def bench_merge(directory, filenames):
+    """ Merge cropped pdfs from disk into a MergedPdf, the way pdfs cropped by worker processes are merged """
+    cropped_filenames = crop_files(filenames)
+    start_time = time.perf_counter()
+    merged_pdf = MergedPdf(os.path.join(directory, "merged.pdf"))
+    for filename in cropped_filenames:
+        with open(filename, "rb") as input_stream:
+            merged_pdf.add_bytes(input_stream.read())
+    merged_pdf.write()
+    return None, time.perf_counter() - start_time
+
+
+def bench_merged_pdf(directory, filenames):
+    """ Crop pdfs straight into a MergedPdf in memory, then write it """
+    pages = 0
+    start_time = time.perf_counter()
+    merged_pdf = MergedPdf()
+    for filename in filenames:
+        with Pdf(filename, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False) as pdf:
+            merged_pdf.add_pages(pdf.processed_pages())
+            pages += pdf.pages
+    merged_pdf.write(os.path.join(directory, "merged.pdf"))
+    return pages, time.perf_counter() - start_time
+
+
+def bench_merged_pdf_volumes(directory, filenames):
+    """ Crop pdfs into a MergedPdf split into volumes of 100 pages, which are written as they fill up """
+    pages = 0
+    start_time = time.perf_counter()
+    merged_pdf = MergedPdf(os.path.join(directory, "merged.pdf"), max_pages=100)
+    for filename in filenames:
+        with Pdf(filename, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False) as pdf:
+            merged_pdf.add_pages(pdf.processed_pages())
+            pages += pdf.pages
+    merged_pdf.write()
+    return pages, time.perf_counter() - start_time
+
+
+def bench_archive(directory, filenames):
+    """ Move every pdf into the archive directory as one batch with Archiver, without a journal """
+    pages = len(filenames)
+    start_time = time.perf_counter()
+    Archiver(directory, "Archived", False).archive(filenames)
+    return pages, time.perf_counter() - start_time
+
+
+def bench_archive_batch(directory, filenames):
+    """ Move every pdf into the archive directory as one journaled batch with Archiver """
+    pages = len(filenames)
+    start_time = time.perf_counter()
+    Archiver(directory, "Archived", False, os.path.join(directory, ".archive.jsonl")).archive(filenames)
+    return pages, time.perf_counter() - start_time
+
+
+def bench_end_to_end(directory, filenames):
+    """ Run pdf_batch_crop.py to crop, merge and archive the whole directory """
+    command = [sys.executable, os.path.join(SCRIPT_DIRECTORY, "pdf_batch_crop.py"), "-d", directory, "-m", "-a",
+               "-f", sample_pdfs.FILTER_TEXT]
+    start_time = time.perf_counter()
+    subprocess.run(command, cwd=SCRIPT_DIRECTORY, check=True, stdout=subprocess.DEVNULL)
+    return None, time.perf_counter() - start_time
+
+
+def bench_startup(directory, filenames):
+    """ Run pdf_batch_crop.py -i to crop a single pdf, timing its imports """
+    # The input directory is empty, so only the single pdf is cropped
+    input_directory = os.path.join(directory, "empty")
+    os.mkdir(input_directory)
+    pages = len(PdfReader(filenames[0]).pages)
+    command = [sys.executable, "-X", "importtime", os.path.join(SCRIPT_DIRECTORY, "pdf_batch_crop.py"),
+               "-d", input_directory, "-i", filenames[0], "-w", "1", "-f", sample_pdfs.FILTER_TEXT]
+    start_time = time.perf_counter()
+    process = subprocess.run(command, cwd=SCRIPT_DIRECTORY, check=True, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - start_time
+    metrics.count("import_us", int(import_ms(process.stderr) * 1000))
+    return pages, seconds
+
+
+BENCHMARKS = {
+    "processed_file": bench_processed_file,
+    "pipeline": bench_pipeline,
+    "parse_buffered": bench_parse_buffered,
+    "parse_mmap": bench_parse_mmap,
+    "parse_read": bench_parse_read,
+    "filter": bench_filter,
+    "filter_extract_text": bench_filter_extract_text,
+    "crop_sheets": bench_crop_sheets,
+    "hard_crop_sheets": bench_hard_crop_sheets,
+    "merge": bench_merge,
+    "merged_pdf": bench_merged_pdf,
+    "merged_pdf_volumes": bench_merged_pdf_volumes,
+    "archive": bench_archive,
+    "archive_batch": bench_archive_batch,
+    "end_to_end": bench_end_to_end,
+    "startup": bench_startup,
+}
+
+
+def run_benchmark(name, directory, filenames, total_pages):
+    """
+    Run a benchmark. This is run in a new process for each benchmark, so the peak memory is its own.
+    :param name: The name of the benchmark
+    :param directory: A directory containing only the generated pdfs
+    :param filenames: A list of the generated pdf filenames
+    :param total_pages: The total pages of the generated pdfs
+    :return: A dictionary of the results
+    """
+    metrics.reset()
+    syscalls = read_syscalls()
+    pages, seconds = BENCHMARKS[name](directory, filenames)
+    pages = total_pages if pages is None else pages
+    # The script benchmarks run in a child process
+    rss = peak_rss_mb(children=name in SCRIPT_BENCHMARKS)
+    if syscalls is not None and name not in SCRIPT_BENCHMARKS:
+        syscalls = read_syscalls() - syscalls
+    else:
+        syscalls = None
+    return {
+        "files": len(filenames),
+        "pages": pages,
+        "seconds": round(seconds, 4),
+        "pages_per_sec": round(pages / seconds, 1) if seconds else None,
+        "peak_rss_mb": rss,
+        "read_syscalls": syscalls,
+        "bytes_written": metrics.counters.get("bytes_written"),
+        "import_ms": metrics.counters["import_us"] / 1000 if "import_us" in metrics.counters else None,
+    }
+
+
+def run_all(names, sizes, repeat=1):
+    """
+    Run benchmarks at several batch sizes.
+    :param names: A list of benchmark names
+    :param sizes: A list of batch sizes, in pdfs
+    :param repeat: Run each benchmark this many times, and keep the fastest result
+    :return: A dictionary of results by benchmark name, then batch size
+    """
+    results = {name: {} for name in names}
+    spawn = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        for size in sizes:
+            sources = {}
+            for sheets in sorted({name in SHEET_BENCHMARKS for name in names}):
+                source = os.path.join(temporary_directory, f"{'sheets' if sheets else 'source'}-{size}")
+                sources[sheets] = (source, sample_pdfs.make_batch(source, size, sheets=sheets)[1])
+
+            for name in names:
+                source, total_pages = sources[name in SHEET_BENCHMARKS]
+                best = None
+                for _ in range(repeat):
+                    # Every run gets its own copy of the pdfs, since cropping and archiving change the directory
+                    directory = os.path.join(temporary_directory, f"{name}-{size}") + "/"
+                    shutil.copytree(source, directory)
+                    filenames = sorted(os.path.join(directory, filename) for filename in os.listdir(directory))
+
+                    with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                        result = executor.submit(run_benchmark, name, directory, filenames, total_pages).result()
+                    shutil.rmtree(directory)
+
+                    if best is None or result["seconds"] < best["seconds"]:
+                        best = result
+
+                results[name][str(size)] = best
+                print(f"{name:<22} {size:>6} files {best['pages']:>7} pages {best['seconds']:>9.3f} s "
+                      f"{best['pages_per_sec'] or 0:>10.1f} pages/s {best['peak_rss_mb'] or 0:>8.1f} MB "
+                      f"{best['read_syscalls'] if best['read_syscalls'] is not None else '-':>8} reads "
+                      f"{(best['bytes_written'] or 0) / 1024:>9.1f} KB written"
+                      + (f" {best['import_ms']:>7.1f} ms importing" if best.get("import_ms") else ""))
+
+            if all(str(size) in results.get(name, {}) for name in SHEET_BENCHMARKS):
+                cropped, hard_cropped = (results[name][str(size)]["bytes_written"] for name in SHEET_BENCHMARKS)
+                print(f"{'hard crop':<22} {size:>6} files {1 - hard_cropped / cropped:>8.1%} smaller")
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a baseline.
+    :param results: A dictionary of results by benchmark name, then batch size
+    :param baseline: A baseline in the same format
+    :param tolerance: The fraction a result may be worse than the baseline, ie: 0.25 for 25%
+    :return: A list of regression descriptions
+    """
+    regressions = []
+    for name, sizes in results.items():
+        for size, result in sizes.items():
+            expected = baseline.get(name, {}).get(size)
+            if not expected:
+                continue
+            if expected.get("pages_per_sec") and result["pages_per_sec"] and \
+                    result["pages_per_sec"] < expected["pages_per_sec"] * (1 - tolerance):
+                regressions.append(f"{name} ({size} files): {result['pages_per_sec']} pages/s, "
+                                   f"baseline {expected['pages_per_sec']} pages/s")
+            if expected.get("peak_rss_mb") and result["peak_rss_mb"] and \
+                    result["peak_rss_mb"] > expected["peak_rss_mb"] * (1 + tolerance):
+                regressions.append(f"{name} ({size} files): {result['peak_rss_mb']} MB peak memory, "
+                                   f"baseline {expected['peak_rss_mb']} MB")
+            if expected.get("bytes_written") and result.get("bytes_written") and \
+                    result["bytes_written"] > expected["bytes_written"] * (1 + tolerance):
+                regressions.append(f"{name} ({size} files): {result['bytes_written']} bytes written, "
+                                   f"baseline {expected['bytes_written']} bytes")
+            if expected.get("import_ms") and result.get("import_ms") and \
+                    result["import_ms"] > expected["import_ms"] * (1 + tolerance):
+                regressions.append(f"{name} ({size} files): {result['import_ms']} ms importing, "
+                                   f"baseline {expected['import_ms']} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="PDF Batch Crop Benchmark", description=__doc__)
+    parser.add_argument("-n", "--sizes", type=int, nargs="*", default=DEFAULT_SIZES,
+                        help="Batch sizes, in pdfs")
+    parser.add_argument("-k", "--benchmarks", nargs="*", choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help="Benchmarks to run")
+    parser.add_argument("-b", "--baseline", default=os.path.join(SCRIPT_DIRECTORY, BASELINE_FILENAME),
+                        help="Baseline results file")
+    parser.add_argument("-s", "--save", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Fraction a result may be worse than the baseline before it is a regression")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Run each benchmark this many times, and keep the fastest result")
+    parser.add_argument("-o", "--output", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = run_all(args.benchmarks, args.sizes, args.repeat)
+    report = {"python": platform.python_version(), "platform": platform.platform(), "results": results}
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.save:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    # Without a baseline nothing would be checked, so a missing baseline fails instead of passing quietly
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline} to compare against. Save one with --save on this machine first.")
+        return 2
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if regressions:
+        return 1
+    print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
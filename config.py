@@ -5,6 +5,10 @@ import configparser
 import os
 from pathlib import Path
 import re
+import socket
+
+from output import Output
+from rules import Profile, RuleEngine
 
 
 class Config:
@@ -12,54 +16,148 @@ class Config:
     they are tested first and will be used if valid. If no command line argument is entered for a
     parameter, the config.ini value will be used instead.
 
-    If an invalid command line argument is given, an error will be raised even if there is valid data in config.ini"""
+    If an invalid command line argument is given, an error will be raised even if there is valid data in config.ini
+
+    Other programs can create a Config with their own arguments and config.ini, ie:
+    Config(["-d", "/labels/", "-m"], "/etc/pdf_batch_crop.ini")
+
+    Crop profiles and extra outputs are only read from config.ini, from sections named PROFILE or OUTPUT and
+    the name, ie: [PROFILE ups] or [OUTPUT invoices]
+
+    A program that creates many Configs, ie: one per label, only parses each config.ini again once it has changed,
+    and only builds the command line parser once."""
 
     # An overly cautious and restrictive filename cleaner that is valid for Windows filenames.
     CLEAN_FILENAME_REGEX = r'[\\/:"*?<>|]+'
 
+    # How pdfs can be read, see ReaderPool
+    INPUT_MODES = ("auto", "buffered", "mmap", "read")
+
+    # What is done with pdfs and pages already processed under another filename, see DuplicateIndex
+    DUPLICATE_MODES = ("off", "report", "skip")
+
+    # The start of the names of config.ini sections holding crop profiles, ie: [PROFILE ups]
+    PROFILE_SECTION = "PROFILE "
+    PROFILE_NAME_REGEX = r'[A-Za-z0-9_]+'
+
+    # The start of the names of config.ini sections holding extra outputs, ie: [OUTPUT invoices]
+    OUTPUT_SECTION = "OUTPUT "
+
+    # Characters that can't be in a station name, which is used in filenames
+    STATION_NAME_REGEX = r'[^A-Za-z0-9_.-]+'
+
+    # The parsed config.ini files, keyed by filename, with the modified time and size they were parsed at
+    _config_files = {}
+    # The command line parsers, keyed by program name and description
+    _parsers = {}
+
+    TRUE_STRINGS = ['true', 'yes', 'on', '1']
+    FALSE_STRINGS = ['false', 'no', 'off', '0']
+
     # Command Line arguments
     ARGUMENTS = [["i", "input_filename", "Filename of single input PDF"],
                         ["o", "output_filename", "Filename of merged output PDF"],
                         ["f", "filter", "Do not crop pages containing this text"],
                         ["s", "suffix", "Cropped PDF filename suffix"],
                         ["d", "directory", "Directory to batch crop"],
-                        ["x", "archived_directory", "Relative subdirectory for archive"]]
+                        ["x", "archived_directory", "Relative subdirectory for archive"],
+                        ["", "include", "Only process PDFs matching these comma separated globs, ie: acme/*.pdf"],
+                        ["", "exclude", "Do not process PDFs or subdirectories matching these comma separated globs"],
+                        ["w", "workers", "Number of worker processes (default: number of CPU cores)"],
+                        ["", "shard_pages", "Check a large PDF for the filter text on all workers, in shards of this many pages or more (0 to disable)"],
+                        ["", "input_mode", "How PDFs are read: auto, buffered, mmap or read (default: auto)"],
+                        ["", "text_cache", "Filename of the page filter cache, relative to directory (blank to disable)"],
+                        ["", "text_cache_max_entries", "Most page filter verdicts kept in the cache"],
+                        ["", "text_cache_max_days", "Remove cached page filter verdicts unused for this many days"],
+                        ["", "duplicates", "PDFs and pages already processed under another filename: off, report or skip (default: off)"],
+                        ["", "duplicate_index", "Filename of the index of processed PDFs and pages, relative to directory"],
+                        ["", "duplicate_index_max_entries", "Most PDFs, and most pages, kept in the duplicate index"],
+                        ["", "watch_interval", "Seconds between checks for new PDFs in watch mode"],
+                        ["", "manifest", "Filename of the processed PDF manifest, relative to directory (blank to disable)"],
+                        ["", "archive_journal", "Filename of the archive journal, relative to directory (blank to disable)"],
+                        ["", "merge_max_pages", "Split the merged PDF into volumes of at most this many pages (0 for no limit)"],
+                        ["", "merge_max_mb", "Split the merged PDF into volumes of at most this many MB (0 for no limit)"],
+                        ["", "metrics_json", "Filename of the JSON metrics report (blank to disable)"],
+                        ["", "metrics_prometheus", "Filename of the Prometheus textfile collector metrics (blank to disable)"],
+                        ["", "serve_port", "Port of the crop server on localhost in serve mode"],
+                        ["", "pipeline_depth", "With one worker, PDFs read ahead and waiting to be written while another is cropped (0 to disable)"],
+                        ["", "station", "Name of this station in coordinated mode (default: the host name)"],
+                        ["", "lease_seconds", "Seconds before a PDF claimed by a stopped station can be taken over"]]
 
     ARGUMENTS_BOOL = [["v", "verbose", "Verbose Mode"],
                       ["m", "merge", "Create merged file of all cropped PDFs"],
                       ["r", "rotate", "Rotate all Portrait to Landscape"],
                       ["c", "archive_by_month", "Put archived PDFs in sub folders archived by month"],
-                      ["a", "archive", "Move processed PDFs into a sub-directory"]]
-
-    def __init__(self):
+                      ["a", "archive", "Move processed PDFs into a sub-directory"],
+                      ["k", "keep_cropped", "Keep individual cropped PDFs when merging"],
+                      ["", "recursive", "Also process PDFs in subdirectories of the directory"],
+                      ["", "watch", "Keep running and process new PDFs as they are added to the directory"],
+                      ["", "serve", "Keep running as a server on localhost that crops PDFs sent to it"],
+                      ["", "hard_crop", "Remove content outside the bounding box, so cropped PDFs are smaller"],
+                      ["", "coordinate", "Share the directory with other stations, which each claim PDFs with lease files"]]
+
+    def __init__(self, argv=None, config_filename="config.ini"):
+        """
+        :param argv: (Optional) A list of command line arguments. Defaults to the arguments of this program.
+        :param config_filename: (Optional) The filename of the config.ini file
+        """
         self.input_filename = ""
         self.output_filename = ""
         self.filter = ""
         self.suffix = ""
         self.directory = ""
         self.archived_directory = ""
+        self.include = ""
+        self.exclude = ""
         self.bounding_box = []
+        self.profiles = []
+        self.outputs = []
+        self.workers = ""
+        self.shard_pages = 200
+        self.input_mode = "auto"
+        self.text_cache = ""
+        self.text_cache_max_entries = 100000
+        self.text_cache_max_days = 30
+        self.duplicates = "off"
+        self.duplicate_index = ""
+        self.duplicate_index_max_entries = 100000
+        self.watch_interval = 2
+        self.manifest = ""
+        self.archive_journal = ""
+        self.merge_max_pages = 0
+        self.merge_max_mb = 0
+        self.metrics_json = ""
+        self.metrics_prometheus = ""
+        self.serve_port = 8765
+        self.pipeline_depth = 4
+        self.station = ""
+        self.lease_seconds = 60
         self.args = self.parser_arguments(self.ARGUMENTS,
                                           self.ARGUMENTS_BOOL,
                                           'PDF Batch Crop',
-                                          '"%(prog)s" leave args blank to use config.ini instead.')
+                                          '"%(prog)s" leave args blank to use config.ini instead.',
+                                          argv)
 
         self.verbose = False
         self.merge = False
         self.rotate = False
         self.archive_by_month = False
         self.archive = False
-
-        # Create a self dictionary of config.ini data
-        config = configparser.ConfigParser()
-        found = config.read('config.ini')
-        sections = 'DEFAULTS', 'COORDINATES', 'TOGGLES'
-
-        if not found:
-            raise ValueError('Config.ini file is missing.')
+        self.keep_cropped = False
+        self.recursive = False
+        self.watch = False
+        self.serve = False
+        self.hard_crop = False
+        self.coordinate = False
+
+        # Create a self dictionary of config.ini data. Sections and keys added since a config.ini was written can be
+        # left out of it, and the values above are used instead.
+        config = self.read_config_file(config_filename)
+        sections = 'DEFAULTS', 'COORDINATES', 'TOGGLES', 'PERFORMANCE'
 
         for name in sections:
-            self.__dict__.update(config.items(name))
+            if config.has_section(name):
+                self.__dict__.update(config.items(name))
 
         # Use command line argument if provided, otherwise use config.ini
         for argument_name in self.ARGUMENTS + self.ARGUMENTS_BOOL:
@@ -70,20 +168,52 @@ class Config:
                                                          self.__dict__.get('lower_left_y'),
                                                          self.__dict__.get('upper_right_y')])
 
+        # Pdfs only leave a shared directory once they are archived, so other stations don't process them again
+        if self.coordinate and not self.archive:
+            raise ValueError("Coordinated mode needs archive on, so processed PDFs leave the shared directory.")
+
+        # Crop profiles, in the order they appear in config.ini
+        self.profiles = [self.read_profile(name[len(self.PROFILE_SECTION):].strip(), config[name])
+                         for name in config.sections() if name.startswith(self.PROFILE_SECTION)]
+        self.outputs = [self.read_output(name[len(self.OUTPUT_SECTION):].strip(), config[name])
+                        for name in config.sections() if name.startswith(self.OUTPUT_SECTION)]
+
     def __str__(self):
         state = ["%s=%r" % (attribute, value)
                  for (attribute, value)
                  in self.__dict__.items()]
         return '\n'.join(state)
 
+    @classmethod
+    def read_config_file(cls, config_filename):
+        """
+        Parses a config.ini file, or gets it from the last time it was parsed if it hasn't changed since.
+        :param config_filename: The filename of the config.ini file
+        :return: A ConfigParser, which must not be changed since it is shared. A missing file will raise an exception.
+        """
+        try:
+            stat = os.stat(config_filename)
+        except OSError:
+            raise ValueError('Config.ini file is missing.')
+
+        key = os.path.abspath(config_filename)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = cls._config_files.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        config = configparser.ConfigParser()
+        if not config.read(config_filename):
+            raise ValueError('Config.ini file is missing.')
+        cls._config_files[key] = (signature, config)
+        return config
+
     def set_argument(self, argument_key, argument_list=None):
         """Sets the config arguments. Uses command line arguments if provided, otherwise uses config.ini values.
         True and False strings are set to booleans for Toggles in the config.ini files.
         :param argument_key: The config key name must match in both self.__dict__ and self.args
         :param argument_list: (Optional) A list of values instead of a single value matching the argument_key
         """
-        true_strings = ['true', 'yes', 'on', '1']
-        false_strings = ['false', 'no', 'off', '0']
         if vars(self.args).get(argument_key):
             argument_value = vars(self.args).get(argument_key)
         else:
@@ -91,10 +221,14 @@ class Config:
                 argument_value = argument_list
             else:
                 argument_value = self.__dict__.get(argument_key)
-                if argument_value.lower() in true_strings:
-                    argument_value = True
-                elif argument_value.lower() in false_strings:
-                    argument_value = False
+                if argument_value is None:
+                    # Not in config.ini, so the value set in __init__ is kept
+                    return
+                if isinstance(argument_value, str):
+                    if argument_value.lower() in self.TRUE_STRINGS:
+                        argument_value = True
+                    elif argument_value.lower() in self.FALSE_STRINGS:
+                        argument_value = False
 
         setattr(self, argument_key, argument_value)
 
@@ -243,34 +377,602 @@ class Config:
         bounding_box = new_bounding_box_list
         self._bounding_box = [float(i) for i in bounding_box]
 
-    def parser_arguments(self, arguments_str, arguments_bool, prog, description):
+    @property
+    def profiles(self):
+        """
+        Gets the crop profiles.
+        :return: A list of Profile, in the order they are tried
+        """
+        return self._profiles
+
+    @profiles.setter
+    def profiles(self, new_profiles):
+        """
+        Sets the crop profiles. Their texts and regular expressions are compiled once, into the rules.
+        :param new_profiles: A list of Profile. If empty, every page is cropped with the bounding box.
+        """
+        names = [profile.name for profile in new_profiles]
+        if len(set(names)) < len(names):
+            raise ValueError("Invalid crop profiles. Each profile must have a different name.")
+        self._profiles = list(new_profiles)
+        self._rules = RuleEngine(self._profiles) if self._profiles else None
+
+    @property
+    def rules(self):
+        """
+        Gets the rules engine that chooses the crop profile of each page.
+        :return: A RuleEngine, or None if there are no crop profiles.
+        """
+        return self._rules
+
+    def read_profile(self, name, section):
+        """
+        Reads a crop profile from a config.ini section. Every setting can be left out:
+        text is a list of texts, one per line, regex is a regular expression, page_size is the width and height
+        in points, ie: 288x432, filename is a comma separated list of globs, bounding_box is 4 numbers in the same
+        order as the bounding box argument, and rotate and skip are True or False.
+        :param name: The name of the profile
+        :param section: The config.ini section
+        :return: A Profile. Invalid settings will raise an exception.
+        """
+        if not re.fullmatch(self.PROFILE_NAME_REGEX, name):
+            raise ValueError(f"Invalid crop profile name: {name}. Must be letters, numbers and underscores.")
+
+        texts = [line.strip() for line in section.get("text", "", raw=True).splitlines() if line.strip()]
+
+        page_size = None
+        if section.get("page_size", "").strip():
+            try:
+                page_size = tuple(float(size) for size in section["page_size"].lower().split("x"))
+            except ValueError:
+                page_size = ()
+            if len(page_size) != 2:
+                raise ValueError(f"Invalid page size in crop profile {name}. Must be width x height, ie: 288x432.")
+
+        try:
+            return Profile(name, texts, section.get("regex", "", raw=True).strip(), page_size,
+                           self.glob_list(section.get("filename", "")),
+                           self.section_bounding_box(section, f"crop profile {name}"),
+                           self.section_toggle(section, "rotate", f"crop profile {name}"),
+                           self.section_toggle(section, "skip", f"crop profile {name}") or False)
+        except re.error as ex:
+            raise ValueError(f"Invalid regex in crop profile {name}: {ex}")
+
+    @property
+    def outputs(self):
+        """
+        Gets the extra outputs written for every pdf.
+        :return: A list of Output
+        """
+        return self._outputs
+
+    @outputs.setter
+    def outputs(self, new_outputs):
+        """
+        Sets the extra outputs written for every pdf.
+        :param new_outputs: A list of Output. Each must have a different suffix to the cropped pdfs and each other.
+        """
+        suffixes = [output.suffix for output in new_outputs]
+        if len(set(suffixes)) < len(suffixes) or self.suffix in suffixes:
+            raise ValueError("Invalid outputs. Each output must have a different suffix to the cropped PDFs.")
+        self._outputs = list(new_outputs)
+
+    def read_output(self, name, section):
+        """
+        Reads an extra output from a config.ini section. Every setting can be left out:
+        suffix is the suffix of the new files (the name if blank), pages is kept, filtered or all, bounding_box is
+        4 numbers in the same order as the bounding box argument (pages aren't cropped if blank), and rotate is
+        True or False.
+        :param name: The name of the output
+        :param section: The config.ini section
+        :return: An Output. Invalid settings will raise an exception.
+        """
+        if not re.fullmatch(self.PROFILE_NAME_REGEX, name):
+            raise ValueError(f"Invalid output name: {name}. Must be letters, numbers and underscores.")
+
+        return Output(name, re.sub(self.CLEAN_FILENAME_REGEX, '', section.get("suffix", "")),
+                      section.get("pages", "").strip().lower() or "kept",
+                      self.section_bounding_box(section, f"output {name}"),
+                      self.section_toggle(section, "rotate", f"output {name}") or False)
+
+    @staticmethod
+    def section_bounding_box(section, description):
+        """
+        Reads a bounding box from a config.ini section.
+        :param section: The config.ini section
+        :param description: What the section is, used in error messages, ie: crop profile ups
+        :return: A list of 4 floats, or None if there is no bounding box. Anything else will raise an exception.
+        """
+        if not section.get("bounding_box", "").strip():
+            return None
+        try:
+            bounding_box = [float(position) for position in section["bounding_box"].replace(",", " ").split()]
+        except ValueError:
+            bounding_box = []
+        if len(bounding_box) != 4:
+            raise ValueError(f"Invalid bounding box in {description}. Must be 4 numeric values.")
+        return bounding_box
+
+    def section_toggle(self, section, key, description):
+        """
+        Reads a True or False setting from a config.ini section.
+        :param section: The config.ini section
+        :param key: The name of the setting
+        :param description: What the section is, used in error messages, ie: crop profile ups
+        :return: True, False, or None if the setting is blank. Anything else will raise an exception.
+        """
+        value = section.get(key, "").strip().lower()
+        if value in self.TRUE_STRINGS:
+            return True
+        if value in self.FALSE_STRINGS:
+            return False
+        if value:
+            raise ValueError(f"Invalid {key} in {description}. Must be True or False.")
+        return None
+
+    @property
+    def workers(self):
+        """
+        Gets the number of worker processes used to process pdfs in parallel.
+        :return: The number of worker processes used to process pdfs in parallel.
+        """
+        return self._workers
+
+    @workers.setter
+    def workers(self, new_workers):
+        """
+        Sets the number of worker processes used to process pdfs in parallel.
+        :param new_workers: A positive whole number. If blank, the number of CPU cores is used.
+        """
+        if new_workers == "" or new_workers is None:
+            self._workers = os.cpu_count() or 1
+        else:
+            self._workers = self.whole_number(new_workers, "workers", 1)
+
+    @property
+    def shard_pages(self):
+        """
+        Gets the fewest pages in each shard when a pdf's pages are checked for the filter text across worker processes.
+        :return: The fewest pages in each shard, or 0 if pdfs are never split.
+        """
+        return self._shard_pages
+
+    @shard_pages.setter
+    def shard_pages(self, new_shard_pages):
+        """
+        Sets the fewest pages in each shard when a pdf's pages are checked for the filter text across worker processes.
+        Pdfs are only split when there are fewer pdfs than workers, ie: a single huge pdf.
+        :param new_shard_pages: A whole number. If blank or 0, pdfs are never split.
+        """
+        self._shard_pages = self.whole_number(new_shard_pages or 0, "shard pages", 0)
+
+    @property
+    def include(self):
+        """
+        Gets the globs of the pdfs to process.
+        :return: A list of globs, or an empty list to process every pdf
+        """
+        return self._include
+
+    @include.setter
+    def include(self, new_include):
+        """
+        Sets the globs of the pdfs to process. Globs are matched against the path relative to the input directory,
+        and against the filename.
+        :param new_include: A comma separated string, or a list, of globs. If blank, every pdf is processed.
+        """
+        self._include = self.glob_list(new_include)
+
+    @property
+    def exclude(self):
+        """
+        Gets the globs of the pdfs and subdirectories not to process.
+        :return: A list of globs
+        """
+        return self._exclude
+
+    @exclude.setter
+    def exclude(self, new_exclude):
+        """
+        Sets the globs of the pdfs and subdirectories not to process. Globs are matched against the path relative to
+        the input directory, and against the name.
+        :param new_exclude: A comma separated string, or a list, of globs. If blank, nothing is left out.
+        """
+        self._exclude = self.glob_list(new_exclude)
+
+    @staticmethod
+    def glob_list(value):
+        """
+        Gets a list of globs from a setting.
+        :param value: A comma separated string, or a list, of globs
+        :return: A list of globs, without blanks
+        """
+        if isinstance(value, str):
+            value = value.split(",")
+        return [glob_pattern.strip() for glob_pattern in value or [] if glob_pattern.strip()]
+
+    @property
+    def input_mode(self):
+        """
+        Gets how pdfs are read.
+        :return: auto, buffered, mmap or read
+        """
+        return self._input_mode
+
+    @input_mode.setter
+    def input_mode(self, new_input_mode):
+        """
+        Sets how pdfs are read. mmap maps each pdf into memory, read loads each pdf with a single read,
+        and auto uses mmap for local pdfs and read for pdfs on a network filesystem.
+        :param new_input_mode: auto, buffered, mmap or read. If blank, auto is used.
+        """
+        new_input_mode = (new_input_mode or "auto").strip().lower()
+        if new_input_mode not in self.INPUT_MODES:
+            raise ValueError(f"Invalid input mode. Must be one of: {', '.join(self.INPUT_MODES)}.")
+        self._input_mode = new_input_mode
+
+    @property
+    def text_cache(self):
+        """
+        Gets the filename of the page filter cache, relative to the input directory.
+        :return: The filename of the page filter cache, or "" if there is no cache.
+        """
+        return self._text_cache
+
+    @text_cache.setter
+    def text_cache(self, new_text_cache):
+        """
+        Sets the filename of the page filter cache, relative to the input directory.
+        :param new_text_cache: The filename of the page filter cache. If blank, filter verdicts are not cached.
+        """
+        self._text_cache = re.sub(self.CLEAN_FILENAME_REGEX, '', new_text_cache or "")
+
+    @property
+    def duplicates(self):
+        """
+        Gets what is done with pdfs and pages already processed under another filename.
+        :return: off, report or skip
+        """
+        return self._duplicates
+
+    @duplicates.setter
+    def duplicates(self, new_duplicates):
+        """
+        Sets what is done with pdfs and pages already processed under another filename, ie: the same label exported
+        again. report counts them, and skip also leaves them out.
+        :param new_duplicates: off, report or skip. If blank, off is used.
+        """
+        new_duplicates = (new_duplicates or "off").strip().lower()
+        if new_duplicates not in self.DUPLICATE_MODES:
+            raise ValueError(f"Invalid duplicates. Must be one of: {', '.join(self.DUPLICATE_MODES)}.")
+        self._duplicates = new_duplicates
+
+    @property
+    def duplicate_index(self):
+        """
+        Gets the filename of the index of processed pdfs and pages, relative to the input directory.
+        :return: The filename of the duplicate index, or "" if duplicates are off.
+        """
+        return self._duplicate_index if self.duplicates != "off" else ""
+
+    @duplicate_index.setter
+    def duplicate_index(self, new_duplicate_index):
+        """
+        Sets the filename of the index of processed pdfs and pages, relative to the input directory.
+        :param new_duplicate_index: The filename of the duplicate index. If blank, duplicates aren't found.
+        """
+        self._duplicate_index = re.sub(self.CLEAN_FILENAME_REGEX, '', new_duplicate_index or "")
+
+    @property
+    def duplicate_index_max_entries(self):
+        """
+        Gets the most pdfs, and the most pages, kept in the duplicate index.
+        :return: The most pdfs, and the most pages, kept in the duplicate index.
+        """
+        return self._duplicate_index_max_entries
+
+    @duplicate_index_max_entries.setter
+    def duplicate_index_max_entries(self, new_max_entries):
+        """
+        Sets the most pdfs, and the most pages, kept in the duplicate index. The least recently seen are removed.
+        :param new_max_entries: A positive whole number
+        """
+        self._duplicate_index_max_entries = self.whole_number(new_max_entries, "duplicate index entries", 1)
+
+    @property
+    def manifest(self):
+        """
+        Gets the filename of the processed pdf manifest, relative to the input directory.
+        :return: The filename of the processed pdf manifest, or "" if there is no manifest.
+        """
+        return self._manifest
+
+    @manifest.setter
+    def manifest(self, new_manifest):
+        """
+        Sets the filename of the processed pdf manifest, relative to the input directory.
+        :param new_manifest: The filename of the manifest. If blank, every pdf is processed on every run.
+        """
+        self._manifest = re.sub(self.CLEAN_FILENAME_REGEX, '', new_manifest or "")
+
+    @property
+    def archive_journal(self):
+        """
+        Gets the filename of the archive journal, relative to the input directory.
+        :return: The filename of the archive journal, or "" if moves aren't journaled.
+        """
+        return self._archive_journal
+
+    @archive_journal.setter
+    def archive_journal(self, new_archive_journal):
+        """
+        Sets the filename of the archive journal, relative to the input directory.
+        :param new_archive_journal: The filename of the journal. If blank, a crash while archiving isn't recovered.
+        """
+        self._archive_journal = re.sub(self.CLEAN_FILENAME_REGEX, '', new_archive_journal or "")
+
+    @property
+    def merge_max_pages(self):
+        """
+        Gets the most pages in each volume of the merged pdf.
+        :return: The most pages in each volume of the merged pdf, or 0 for no limit.
+        """
+        return self._merge_max_pages
+
+    @merge_max_pages.setter
+    def merge_max_pages(self, new_max_pages):
+        """
+        Sets the most pages in each volume of the merged pdf.
+        :param new_max_pages: A whole number. If blank or 0, the merged pdf isn't split by pages.
+        """
+        self._merge_max_pages = self.whole_number(new_max_pages or 0, "merged PDF volume pages", 0)
+
+    @property
+    def merge_max_mb(self):
+        """
+        Gets the largest size of each volume of the merged pdf, in MB.
+        :return: The largest size of each volume of the merged pdf, or 0 for no limit.
+        """
+        return self._merge_max_mb
+
+    @merge_max_mb.setter
+    def merge_max_mb(self, new_max_mb):
+        """
+        Sets the largest size of each volume of the merged pdf, in MB.
+        :param new_max_mb: A number of MB. If blank or 0, the merged pdf isn't split by size.
+        """
+        try:
+            max_mb = float(new_max_mb or 0)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid merged PDF volume size. Must be a number of MB.")
+        if max_mb < 0:
+            raise ValueError("Invalid merged PDF volume size. Must be at least 0 MB.")
+        self._merge_max_mb = max_mb
+
+    @property
+    def metrics_json(self):
+        """
+        Gets the filename of the JSON metrics report.
+        :return: The filename of the JSON metrics report, or "" if there is no report.
+        """
+        return self._metrics_json
+
+    @metrics_json.setter
+    def metrics_json(self, new_metrics_json):
+        """
+        Sets the filename of the JSON metrics report, which is rewritten after every batch.
+        :param new_metrics_json: The filename of the report. If blank, no report is written.
+        """
+        self._metrics_json = new_metrics_json or ""
+
+    @property
+    def metrics_prometheus(self):
+        """
+        Gets the filename of the Prometheus textfile collector metrics.
+        :return: The filename of the Prometheus metrics, or "" if there are none.
+        """
+        return self._metrics_prometheus
+
+    @metrics_prometheus.setter
+    def metrics_prometheus(self, new_metrics_prometheus):
+        """
+        Sets the filename of the Prometheus textfile collector metrics, which are rewritten after every batch.
+        :param new_metrics_prometheus: The filename of the metrics, ending in .prom. If blank, no metrics are written.
+        """
+        if new_metrics_prometheus and not new_metrics_prometheus.endswith(".prom"):
+            raise ValueError("Invalid Prometheus metrics filename. The textfile collector only reads .prom files.")
+        self._metrics_prometheus = new_metrics_prometheus or ""
+
+    @property
+    def pipeline_depth(self):
+        """
+        Gets the most pdfs waiting between the stages of the pipeline, when there is one worker.
+        :return: The most pdfs waiting between stages, or 0 if each pdf is read, processed and written in turn.
+        """
+        return self._pipeline_depth
+
+    @pipeline_depth.setter
+    def pipeline_depth(self, new_pipeline_depth):
+        """
+        Sets the most pdfs waiting between the stages of the pipeline, when there is one worker. Pdfs are read on
+        one thread and written on another while each pdf is cropped, so the cropping never waits for the disk.
+        :param new_pipeline_depth: A whole number of pdfs, or 0 to disable the pipeline
+        """
+        self._pipeline_depth = self.whole_number(new_pipeline_depth, "pipeline depth")
+
+    @property
+    def station(self):
+        """
+        Gets the name of this station in coordinated mode.
+        :return: The name of the station
+        """
+        return self._station
+
+    @station.setter
+    def station(self, new_station):
+        """
+        Sets the name of this station in coordinated mode. It is added to the filenames each station keeps for
+        itself in the shared directory, ie: the merged pdf.
+        :param new_station: The name of the station. If blank, the host name is used.
+        """
+        station = re.sub(self.STATION_NAME_REGEX, '_', (new_station or "").strip() or socket.gethostname())
+        self._station = station.strip("_") or "station"
+
+    @property
+    def lease_seconds(self):
+        """
+        Gets the seconds a lease lasts in coordinated mode, before another station can take it over.
+        :return: The seconds a lease lasts
+        """
+        return self._lease_seconds
+
+    @lease_seconds.setter
+    def lease_seconds(self, new_lease_seconds):
+        """
+        Sets the seconds a lease lasts in coordinated mode. Leases are renewed while a pdf is being processed, so this
+        is how long a pdf waits when the station processing it stops.
+        :param new_lease_seconds: A positive number of seconds
+        """
+        try:
+            lease_seconds = float(new_lease_seconds)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid lease seconds. Must be a number of seconds.")
+        if lease_seconds <= 0:
+            raise ValueError("Invalid lease seconds. Must be more than 0 seconds.")
+        self._lease_seconds = lease_seconds
+
+    @property
+    def serve_port(self):
+        """
+        Gets the port of the crop server in serve mode.
+        :return: The port of the crop server
+        """
+        return self._serve_port
+
+    @serve_port.setter
+    def serve_port(self, new_serve_port):
+        """
+        Sets the port of the crop server in serve mode. The server only listens on localhost.
+        :param new_serve_port: A port number from 1 to 65535
+        """
+        port = self.whole_number(new_serve_port, "serve port", 1)
+        if port > 65535:
+            raise ValueError("Invalid serve port. Must be at most 65535.")
+        self._serve_port = port
+
+    @property
+    def text_cache_max_entries(self):
+        """
+        Gets the most page filter verdicts kept in the cache.
+        :return: The most page filter verdicts kept in the cache.
+        """
+        return self._text_cache_max_entries
+
+    @text_cache_max_entries.setter
+    def text_cache_max_entries(self, new_max_entries):
+        """
+        Sets the most page filter verdicts kept in the cache.
+        :param new_max_entries: A positive whole number
+        """
+        self._text_cache_max_entries = self.whole_number(new_max_entries, "text cache entries", 1)
+
+    @property
+    def text_cache_max_days(self):
+        """
+        Gets the amount of days an unused page filter verdict is kept in the cache.
+        :return: The amount of days an unused page filter verdict is kept in the cache.
+        """
+        return self._text_cache_max_days
+
+    @text_cache_max_days.setter
+    def text_cache_max_days(self, new_max_days):
+        """
+        Sets the amount of days an unused page filter verdict is kept in the cache.
+        :param new_max_days: A positive whole number
+        """
+        self._text_cache_max_days = self.whole_number(new_max_days, "text cache days", 1)
+
+    @property
+    def watch_interval(self):
+        """
+        Gets the seconds between checks for new pdfs in watch mode.
+        :return: The seconds between checks for new pdfs in watch mode.
+        """
+        return self._watch_interval
+
+    @watch_interval.setter
+    def watch_interval(self, new_watch_interval):
+        """
+        Sets the seconds between checks for new pdfs in watch mode.
+        :param new_watch_interval: A positive number of seconds
+        """
+        try:
+            watch_interval = float(new_watch_interval)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid watch interval. Must be a number of seconds.")
+        if watch_interval <= 0:
+            raise ValueError("Invalid watch interval. Must be more than 0 seconds.")
+        self._watch_interval = watch_interval
+
+    @staticmethod
+    def whole_number(value, name, minimum=0):
+        """
+        Converts a config value to a whole number.
+        :param value: The config value
+        :param name: The name of the value, used in error messages
+        :param minimum: The smallest valid number
+        :return: The whole number. Anything that isn't a whole number of at least the minimum will raise an exception.
+        """
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid amount of {name}. Must be a whole number.")
+        if number < minimum:
+            raise ValueError(f"Invalid amount of {name}. Must be at least {minimum}.")
+        return number
+
+    @staticmethod
+    def option_strings(argument):
+        """
+        Gets the command line option strings of an argument.
+        :param argument: An argument setting in the format [char, key, description]
+        :return: A list of option strings, ie: ['-v', '--verbose']
+        """
+        if argument[0]:
+            return ['-' + argument[0], '--' + argument[1]]
+        return ['--' + argument[1]]
+
+    def parser_arguments(self, arguments_str, arguments_bool, prog, description, argv=None):
         """
         Create an Argument Parser from command line inputs supplied by a list of configuration strings and boolean toggles.
         :param arguments_str: A list of settings for argument strings.
-        The format of each list in the list is as follows: [char, key, description]
+        The format of each list in the list is as follows: [char, key, description]. The char can be blank.
         :param arguments_bool: A list of settings for argument booleans.
         The format of each list in the list is as follows: [char, key, description]
         :param prog: Name of the program
         :param description: Description of the program
+        :param argv: (Optional) A list of arguments to parse instead of the command line
         :return: A parser.parse_args
         """
-        parser = argparse.ArgumentParser(
-            prog=prog,
-            description=description
-        )
-
-        for i in arguments_str:
-            parser.add_argument('-' + i[0],
-                                '--' + i[1],
-                                type=str,
-                                help=i[2])
-
-        for i in arguments_bool:
-            parser.add_argument('-' + i[0],
-                                '--' + i[1],
-                                action="store_true",
-                                help=i[2])
-
-        parser.add_argument('-b', '--bounding_box', type=float, nargs='*', help='Bounding box [y0 y1 x0 x1]')
-
-        return parser.parse_args()
+        parser = self._parsers.get((prog, description))
+        if parser is None:
+            parser = argparse.ArgumentParser(
+                prog=prog,
+                description=description
+            )
+
+            # Arguments without a char only have a long option.
+            for i in arguments_str:
+                parser.add_argument(*self.option_strings(i),
+                                    type=str,
+                                    help=i[2])
+
+            for i in arguments_bool:
+                parser.add_argument(*self.option_strings(i),
+                                    action="store_true",
+                                    help=i[2])
+
+            parser.add_argument('-b', '--bounding_box', type=float, nargs='*', help='Bounding box [y0 y1 x0 x1]')
+            self._parsers[(prog, description)] = parser
+
+        return parser.parse_args(argv)
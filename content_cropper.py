@@ -0,0 +1,496 @@
+#!/usr/bin/python
+from PyPDF2.generic import ArrayObject, ContentStream, DictionaryObject, NameObject
+
+from metrics import metrics
+
+
+class ContentCropper:
+    """This class hard crops a page: it removes everything drawn entirely outside the bounding box from the page's
+    content stream, and the fonts and images that are no longer used from its resources. Setting the crop box only
+    hides content, so printers and spoolers still have to download and rasterize the whole page.
+
+    Only what is certain to be outside the box is removed, so the cropped page always looks the same:
+    - Images, forms and inline images are removed when their bounds are outside the box.
+    - Paths are removed when their points, widened by the line width, are outside the box. Clipping paths are kept,
+      and so are paths painted after a graphics state whose line width can't be read.
+    - Text is removed a line at a time, when a generous estimate of the line's extent is outside the box. Lines
+      shown with unknown widths, or used for clipping, are kept.
+    Graphics and text state operators are always kept, so removing content never changes how the rest is drawn."""
+
+    IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+    PATH_OPERATORS = (b'm', b'l', b'c', b'v', b'y', b'h', b're')
+    PAINT_OPERATORS = (b'S', b's', b'f', b'F', b'f*', b'B', b'B*', b'b', b'b*', b'n')
+    CLIP_OPERATORS = (b'W', b'W*')
+    SHOW_OPERATORS = (b'Tj', b'TJ', b"'", b'"')
+    LINE_OPERATORS = (b'Td', b'TD', b'Tm', b'T*', b"'", b'"')
+    # Operators that draw, or may, and so keep the graphics state saved around them. Marked content is kept too.
+    DRAWING_OPERATORS = PAINT_OPERATORS + SHOW_OPERATORS + \
+        (b'Do', b'sh', b'INLINE IMAGE', b'BMC', b'BDC', b'EMC', b'MP', b'DP', b'BX', b'EX')
+
+    # Lines are joined with miters up to 10 line widths long by default, so paths can reach 5 line widths out.
+    MITER_WIDTHS = 5.0
+    # Glyphs can reach above and below the baseline, and left of where they start, by up to this many font sizes.
+    GLYPH_PADDING = 2.0
+    # The widest glyph assumed, in font sizes, for fonts whose widths are not known from their /Widths.
+    UNKNOWN_GLYPH_WIDTH = 2.0
+
+    def __init__(self, bounding_box):
+        """
+        :param bounding_box: The bounding box used for cropping, in the order [x0, x1, y0, y1]
+        """
+        self.left = min(bounding_box[0], bounding_box[1])
+        self.right = max(bounding_box[0], bounding_box[1])
+        self.bottom = min(bounding_box[2], bounding_box[3])
+        self.top = max(bounding_box[2], bounding_box[3])
+
+        # The widest glyph of each font, keyed by (reader id, object number) or id of the font dictionary
+        self._glyph_widths = {}
+
+    def crop(self, page):
+        """
+        Remove everything drawn entirely outside the bounding box from a page. The page is only changed if
+        something is removed, and the resources it shares with other pages are never changed.
+        :param page: A page
+        :return: The number of drawing operations removed
+        """
+        contents = page.get('/Contents')
+        resources = page.get('/Resources')
+        if contents is None or resources is None:
+            return 0
+
+        with metrics.time("hard_crop"):
+            resources = resources.get_object()
+            try:
+                operations = ContentStream(contents, page.pdf).operations
+                kept = self._without_empty_groups(self._kept_operations(operations, resources))
+            except Exception:
+                # A content stream that can't be read is left as it is
+                return 0
+
+            removed = self._drawn(operations) - self._drawn(kept)
+            if not removed:
+                return 0
+
+            content = ContentStream(None, page.pdf)
+            content.operations = kept
+            page[NameObject('/Contents')] = content.flate_encode()
+            page[NameObject('/Resources')] = self._used_resources(resources, kept)
+
+        metrics.count("operations_hard_cropped", removed)
+        return removed
+
+    def _kept_operations(self, operations, resources):
+        """
+        Gets the operations of a content stream that draw something inside the bounding box, or change the
+        graphics state.
+        :param operations: A list of (operands, operator) from a ContentStream
+        :param resources: The resources of the content stream
+        :return: A list of (operands, operator)
+        """
+        fonts = resources.get('/Font')
+        fonts = fonts.get_object() if fonts is not None else {}
+        xobjects = resources.get('/XObject')
+        xobjects = xobjects.get_object() if xobjects is not None else {}
+        graphics_states = resources.get('/ExtGState')
+        graphics_states = graphics_states.get_object() if graphics_states is not None else {}
+
+        kept = []
+        state = {"ctm": self.IDENTITY, "line_width": 1.0, "font": None, "font_size": 0.0, "char_spacing": 0.0,
+                 "word_spacing": 0.0, "scale": 1.0, "leading": 0.0, "rise": 0.0, "render": 0}
+        stack = []
+
+        # The operations of the path being built, and its points in default user space.
+        path = []
+        points = []
+        clip = False
+
+        # The operations of the text object being built, split into lines, each starting at a line operator.
+        text = None
+
+        for operands, operator in operations:
+            if text is not None:
+                if operator == b'ET':
+                    kept.extend(self._kept_text(text, state["ctm"]))
+                    kept.append((operands, operator))
+                    text = None
+                    continue
+                self._text_operation(text, state, fonts, operands, operator)
+                continue
+
+            if path and operator not in self.PATH_OPERATORS:
+                if operator in self.CLIP_OPERATORS:
+                    clip = True
+                    path.append((operands, operator))
+                    continue
+                if operator in self.PAINT_OPERATORS:
+                    path.append((operands, operator))
+                    if clip or self._inside(self._padded(points, self._line_padding(state))):
+                        kept.extend(path)
+                    path, points, clip = [], [], False
+                    continue
+                # Anything else ends the path, so it is kept as it is
+                kept.extend(path)
+                path, points, clip = [], [], False
+
+            if operator in self.PATH_OPERATORS:
+                path.append((operands, operator))
+                points.extend(self._path_points(operands, operator, state["ctm"]))
+            elif operator == b'BT':
+                kept.append((operands, operator))
+                text = {"matrix": self.IDENTITY, "line_matrix": self.IDENTITY, "lines": [], "operations": []}
+            elif operator == b'Do':
+                xobject = xobjects.get(operands[0]) if operands else None
+                bounds = self._xobject_bounds(xobject.get_object(), state["ctm"]) if xobject is not None else None
+                if bounds is None or self._inside(bounds):
+                    kept.append((operands, operator))
+            elif operator == b'INLINE IMAGE':
+                if self._inside(self._transform_rectangle((0.0, 0.0, 1.0, 1.0), state["ctm"])):
+                    kept.append((operands, operator))
+            else:
+                self._state_operation(state, stack, operands, operator, graphics_states)
+                kept.append((operands, operator))
+
+        kept.extend(path)
+        if text is not None:
+            kept.extend(text["operations"])
+        return kept
+
+    def _drawn(self, operations):
+        """
+        Counts the operations that draw something, ie: paint a path, show text or draw an image.
+        :param operations: A list of (operands, operator)
+        :return: The number of drawing operations
+        """
+        return sum(1 for _, operator in operations if operator in self.DRAWING_OPERATORS)
+
+    def _without_empty_groups(self, operations):
+        """
+        Gets operations without the groups saved and restored with q and Q that no longer draw anything, ie: a group
+        that only positioned an image that was removed. Nothing outside such a group can depend on it.
+        :param operations: A list of (operands, operator)
+        :return: A list of (operands, operator)
+        """
+        kept = []
+        starts = []
+        for operands, operator in operations:
+            if operator == b'q':
+                starts.append(len(kept))
+            elif operator == b'Q' and starts:
+                start = starts.pop()
+                if not any(group_operator in self.DRAWING_OPERATORS for _, group_operator in kept[start + 1:]):
+                    del kept[start:]
+                    continue
+            kept.append((operands, operator))
+        return kept
+
+    def _state_operation(self, state, stack, operands, operator, graphics_states):
+        """
+        Update the graphics state with an operator outside a text object.
+        :param state: The graphics state
+        :param stack: The saved graphics states
+        :param operands: The operands
+        :param operator: The operator
+        :param graphics_states: The graphics state parameter dictionaries of the content stream, for gs
+        """
+        if operator == b'q':
+            stack.append(dict(state))
+        elif operator == b'Q':
+            if stack:
+                state.update(stack.pop())
+        elif operator == b'cm' and len(operands) == 6:
+            state["ctm"] = self._multiply(tuple(float(operand) for operand in operands), state["ctm"])
+        elif operator == b'w' and operands:
+            state["line_width"] = abs(float(operands[0]))
+        elif operator == b'gs':
+            state["line_width"] = self._graphics_state_line_width(graphics_states, operands, state["line_width"])
+        else:
+            self._text_state_operation(state, operands, operator)
+
+    @staticmethod
+    def _text_state_operation(state, operands, operator):
+        """
+        Update the text state, which is part of the graphics state, with an operator.
+        :param state: The graphics state
+        :param operands: The operands
+        :param operator: The operator
+        """
+        if operator == b'Tf' and len(operands) == 2:
+            state["font"] = operands[0]
+            state["font_size"] = float(operands[1])
+        elif operator == b'Tc' and operands:
+            state["char_spacing"] = float(operands[0])
+        elif operator == b'Tw' and operands:
+            state["word_spacing"] = float(operands[0])
+        elif operator == b'Tz' and operands:
+            state["scale"] = float(operands[0]) / 100
+        elif operator == b'TL' and operands:
+            state["leading"] = float(operands[0])
+        elif operator == b'Ts' and operands:
+            state["rise"] = float(operands[0])
+        elif operator == b'Tr' and operands:
+            state["render"] = int(operands[0])
+
+    def _text_operation(self, text, state, fonts, operands, operator):
+        """
+        Add an operator inside a text object, working out the extent of each line of text.
+        :param text: The text object being built
+        :param state: The graphics state
+        :param fonts: The fonts of the content stream
+        :param operands: The operands
+        :param operator: The operator
+        """
+        if operator in self.LINE_OPERATORS:
+            if operator == b'Tm' and len(operands) == 6:
+                text["line_matrix"] = tuple(float(operand) for operand in operands)
+            else:
+                if operator == b'"' and len(operands) == 3:
+                    state["word_spacing"] = float(operands[0])
+                    state["char_spacing"] = float(operands[1])
+                if operator in (b'Td', b'TD') and len(operands) == 2:
+                    offset = (float(operands[0]), float(operands[1]))
+                    if operator == b'TD':
+                        state["leading"] = -offset[1]
+                else:
+                    offset = (0.0, -state["leading"])
+                text["line_matrix"] = self._multiply((1.0, 0.0, 0.0, 1.0) + offset, text["line_matrix"])
+            text["matrix"] = text["line_matrix"]
+            # Each line starts where the text matrix is set, and isn't moved by the text shown before it
+            text["lines"].append({"matrix": text["matrix"], "start": len(text["operations"]), "extent": None,
+                                  "advance": 0.0, "known": True})
+        else:
+            self._text_state_operation(state, operands, operator)
+
+        text["operations"].append((operands, operator))
+        if operator not in self.SHOW_OPERATORS:
+            return
+
+        if not text["lines"]:
+            text["lines"].append({"matrix": text["matrix"], "start": len(text["operations"]) - 1, "extent": None,
+                                  "advance": 0.0, "known": True})
+        line = text["lines"][-1]
+
+        # Text used for clipping, or shown in a font without known widths, is never removed
+        glyph_width = self._glyph_width(fonts.get(state["font"])) if state["font"] is not None else None
+        if glyph_width is None or state["render"] >= 4:
+            line["known"] = False
+            return
+
+        strings = operands[-1] if operator == b'TJ' and operands else operands[-1:]
+        characters = 0
+        adjustment = 0.0
+        for item in (strings if isinstance(strings, (list, ArrayObject)) else [strings]):
+            if isinstance(item, bytes):
+                characters += len(item)
+            elif isinstance(item, str):
+                # Strings are decoded when the content stream is read, which can change their length
+                characters += len(item.original_bytes) if hasattr(item, "original_bytes") else len(item) * 2
+            else:
+                try:
+                    adjustment += abs(float(item))
+                except (TypeError, ValueError):
+                    line["known"] = False
+                    return
+
+        font_size = abs(state["font_size"])
+        scale = abs(state["scale"])
+        spacing = (abs(state["char_spacing"]) + abs(state["word_spacing"])) * scale
+        padding = self.GLYPH_PADDING * font_size
+        line["advance"] += characters * (glyph_width * font_size * scale + spacing) + \
+            adjustment / 1000 * font_size * scale
+        rise = state["rise"]
+        line["extent"] = (-padding - line["advance"], rise - padding, line["advance"] + padding, rise + padding)
+
+    def _kept_text(self, text, ctm):
+        """
+        Gets the operations of a text object, without the text shown by lines that are outside the bounding box.
+        Operators that set the text state or move to a line are always kept.
+        :param text: The text object
+        :param ctm: The current transformation matrix
+        :return: A list of (operands, operator)
+        """
+        removed = set()
+        for line in text["lines"]:
+            if not line["known"] or line["extent"] is None:
+                continue
+            if self._inside(self._transform_rectangle(line["extent"], self._multiply(line["matrix"], ctm))):
+                continue
+            removed.add(line["start"])
+
+        kept = []
+        line_starts = {line["start"]: line for line in text["lines"]}
+        removing = False
+        for index, (operands, operator) in enumerate(text["operations"]):
+            if index in line_starts:
+                removing = index in removed
+            if not removing or operator not in self.SHOW_OPERATORS:
+                kept.append((operands, operator))
+            elif operator == b"'":
+                kept.append(([], b'T*'))
+            elif operator == b'"':
+                kept.extend([(operands[:1], b'Tw'), (operands[1:2], b'Tc'), ([], b'T*')])
+        return kept
+
+    def _glyph_width(self, font):
+        """
+        Gets the widest glyph of a font, in font sizes, from its /Widths.
+        :param font: A font dictionary, or a reference to one
+        :return: The widest glyph, or None if glyph widths can't be known, ie: Type3 fonts
+        """
+        if font is None:
+            return None
+        key = (id(font.pdf), font.idnum) if hasattr(font, "idnum") else id(font)
+        if key not in self._glyph_widths:
+            font = font.get_object()
+            if font.get('/Subtype') == '/Type3':
+                width = None
+            elif '/Widths' in font:
+                widths = [abs(float(width)) for width in font['/Widths'].get_object()]
+                descriptor = font.get('/FontDescriptor')
+                if descriptor is not None:
+                    widths.append(abs(float(descriptor.get_object().get('/MissingWidth', 0))))
+                width = max(widths, default=0) / 1000
+            else:
+                width = self.UNKNOWN_GLYPH_WIDTH
+            self._glyph_widths[key] = width
+        return self._glyph_widths[key]
+
+    def _xobject_bounds(self, xobject, ctm):
+        """
+        Gets the bounds of an image or form in default user space.
+        :param xobject: An XObject
+        :param ctm: The current transformation matrix
+        :return: A rectangle (x0, y0, x1, y1), or None if the bounds aren't known
+        """
+        subtype = xobject.get('/Subtype')
+        if subtype == '/Image':
+            return self._transform_rectangle((0.0, 0.0, 1.0, 1.0), ctm)
+        if subtype == '/Form' and '/BBox' in xobject:
+            bbox = [float(position) for position in xobject['/BBox']]
+            matrix = tuple(float(value) for value in xobject.get('/Matrix', self.IDENTITY))
+            return self._transform_rectangle(bbox, self._multiply(matrix, ctm))
+        return None
+
+    @staticmethod
+    def _graphics_state_line_width(graphics_states, operands, line_width):
+        """
+        Gets the line width after a graphics state parameter dictionary is applied with gs.
+        :param graphics_states: The graphics state parameter dictionaries of the content stream
+        :param operands: The operands of gs
+        :param line_width: The line width before gs
+        :return: The line width, or None if it can't be known
+        """
+        try:
+            graphics_state = graphics_states[operands[0]].get_object()
+            if '/LW' not in graphics_state:
+                return line_width
+            return abs(float(graphics_state['/LW']))
+        except Exception:
+            return None
+
+    def _line_padding(self, state):
+        """
+        Gets how far a stroked path can reach past its points, in default user space.
+        :param state: The graphics state
+        :return: The padding, which is infinite if the line width isn't known
+        """
+        if state["line_width"] is None:
+            return float("inf")
+        a, b, c, d, _, _ = state["ctm"]
+        return max(state["line_width"], 1.0) * self.MITER_WIDTHS * max(abs(a) + abs(c), abs(b) + abs(d))
+
+    def _path_points(self, operands, operator, ctm):
+        """
+        Gets the points of a path operator in default user space. The control points of curves are included,
+        since a curve never leaves the area they enclose.
+        :param operands: The operands
+        :param operator: The path operator
+        :param ctm: The current transformation matrix
+        :return: A list of (x, y)
+        """
+        values = [float(operand) for operand in operands]
+        if operator == b're' and len(values) == 4:
+            x, y, width, height = values
+            values = [x, y, x + width, y, x, y + height, x + width, y + height]
+        return [self._transform(values[index], values[index + 1], ctm) for index in range(0, len(values) - 1, 2)]
+
+    def _inside(self, rectangle):
+        """
+        Checks if a rectangle overlaps the bounding box.
+        :param rectangle: A rectangle (x0, y0, x1, y1) in default user space
+        :return: True unless the rectangle is entirely outside the bounding box
+        """
+        x0, y0, x1, y1 = rectangle
+        return x1 >= self.left and x0 <= self.right and y1 >= self.bottom and y0 <= self.top
+
+    @staticmethod
+    def _padded(points, padding):
+        """
+        Gets the bounds of points, widened on every side.
+        :param points: A list of (x, y)
+        :param padding: How far to widen the bounds
+        :return: A rectangle (x0, y0, x1, y1)
+        """
+        if not points:
+            # A path without points paints nothing
+            return float("inf"), float("inf"), float("inf"), float("inf")
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        return min(xs) - padding, min(ys) - padding, max(xs) + padding, max(ys) + padding
+
+    @classmethod
+    def _transform_rectangle(cls, rectangle, matrix):
+        """
+        Gets the bounds of a rectangle after it is transformed.
+        :param rectangle: A rectangle (x0, y0, x1, y1)
+        :param matrix: A transformation matrix (a, b, c, d, e, f)
+        :return: A rectangle (x0, y0, x1, y1)
+        """
+        x0, y0, x1, y1 = rectangle
+        return cls._padded([cls._transform(x, y, matrix) for x, y in ((x0, y0), (x0, y1), (x1, y0), (x1, y1))], 0)
+
+    @staticmethod
+    def _transform(x, y, matrix):
+        """
+        Transform a point.
+        :param x: The x coordinate
+        :param y: The y coordinate
+        :param matrix: A transformation matrix (a, b, c, d, e, f)
+        :return: The transformed (x, y)
+        """
+        a, b, c, d, e, f = matrix
+        return a * x + c * y + e, b * x + d * y + f
+
+    @staticmethod
+    def _multiply(first, second):
+        """
+        Multiply two transformation matrices, so the first is applied before the second.
+        :param first: A transformation matrix (a, b, c, d, e, f)
+        :param second: A transformation matrix (a, b, c, d, e, f)
+        :return: The transformation matrix
+        """
+        a1, b1, c1, d1, e1, f1 = first
+        a2, b2, c2, d2, e2, f2 = second
+        return (a1 * a2 + b1 * c2, a1 * b2 + b1 * d2,
+                c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+                e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2)
+
+    @staticmethod
+    def _used_resources(resources, operations):
+        """
+        Gets a copy of resources without the fonts and XObjects that operations no longer use.
+        :param resources: The resources of the content stream
+        :param operations: The kept operations
+        :return: A new resources dictionary, sharing every resource that is still used
+        """
+        used = {operands[0] for operands, operator in operations if operator in (b'Do', b'Tf') and operands}
+        new_resources = DictionaryObject({key: resources.raw_get(key) for key in resources})
+        for key in ('/Font', '/XObject'):
+            if key not in resources:
+                continue
+            entries = resources[key].get_object()
+            kept = DictionaryObject({name: entries.raw_get(name) for name in entries if name in used})
+            if len(kept) < len(entries):
+                metrics.count("resources_hard_cropped", len(entries) - len(kept))
+            new_resources[NameObject(key)] = kept
+        return new_resources
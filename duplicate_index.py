@@ -0,0 +1,124 @@
+#!/usr/bin/python
+import os
+import sqlite3
+import threading
+import time
+
+
+class DuplicateIndex:
+    """This class represents an on disk index of the pdfs and pages that have been processed, so the same label
+    exported again under another filename is found before it is printed twice. Pdfs are keyed by a hash of the
+    file, and pages by a hash of their content and resources (see Pdf.page_hash), so a label is still found when
+    it is exported again into a pdf with a different file hash.
+
+    Each hash is kept with the filename it was first processed from. A pdf or page is only a duplicate when it
+    was processed from another filename, so processing the same pdf again, or a pdf showing the same page twice,
+    isn't a duplicate. The least recently seen hashes are evicted once there are more than max_entries of each."""
+
+    # What is done with duplicates: nothing, reported, or reported and left out.
+    MODES = ("off", "report", "skip")
+
+    # One index connection per index file, per process, keyed by process id and filename. A worker forked after
+    # the index was opened inherits the parent's connection, which sqlite must not use in another process, so the
+    # worker connects again instead. The inherited connection is never closed, since workers exit without
+    # cleaning up.
+    _opened = {}
+
+    def __init__(self, filename, max_entries=100000):
+        self.filename = filename
+        self.max_entries = max_entries
+
+        # Pdfs are checked on the read thread of the pipeline, and their pages on the processing thread.
+        self._lock = threading.Lock()
+        # Several worker processes share the index, so wait on locks rather than failing.
+        self.connection = sqlite3.connect(filename, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        for table in ("files", "pages"):
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                    f"(hash TEXT PRIMARY KEY, file TEXT NOT NULL, seen REAL NOT NULL)")
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_seen ON {table} (seen)")
+
+    def __len__(self):
+        return sum(self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                   for table in ("files", "pages"))
+
+    @classmethod
+    def open(cls, filename, max_entries=100000):
+        """
+        Gets the index for a filename, connecting to it the first time it is used in this process.
+        :param filename: The filename of the index
+        :param max_entries: The most pdfs, and the most pages, kept in the index
+        :return: A DuplicateIndex
+        """
+        key = (os.getpid(), filename)
+        index = cls._opened.get(key)
+        if index is None:
+            index = cls(filename, max_entries)
+            cls._opened[key] = index
+        else:
+            index.max_entries = max_entries
+        return index
+
+    def file_original(self, file_hash, filename, record=True):
+        """
+        Checks if a pdf was processed before from another filename, and records it if it wasn't.
+        :param file_hash: The hash of the pdf, from Manifest.file_hash
+        :param filename: The filename of the pdf
+        :param record: Record the pdf. Pdfs are only checked before they are processed, and recorded once they
+        have been processed, so a pdf that fails isn't taken for the original of a later copy.
+        :return: The filename the pdf was first processed from, or None if it isn't a duplicate
+        """
+        return self._original("files", file_hash, filename, record)
+
+    def page_original(self, page_hash, filename):
+        """
+        Checks if a page was processed before from another pdf, and records it if it wasn't.
+        :param page_hash: The hash of the page, from Pdf.page_hash
+        :param filename: The filename of the pdf the page is in
+        :return: The filename of the pdf the page was first processed from, or None if it isn't a duplicate
+        """
+        return self._original("pages", page_hash, filename)
+
+    def _original(self, table, key, filename, record=True):
+        """
+        Checks if a hash was recorded from another filename, and records it if it wasn't.
+        :param table: The table of hashes: files or pages
+        :param key: The hash
+        :param filename: The filename it is being processed from
+        :param record: Record the hash, or only check for it
+        :return: The filename the hash was recorded from, or None if it was recorded from the same filename, or
+        wasn't recorded
+        """
+        now = time.time()
+        with self._lock:
+            row = self.connection.execute(f"SELECT file FROM {table} WHERE hash = ?", (key,)).fetchone()
+            if row is None:
+                # Another process may have recorded it since, in which case its filename is kept
+                if record:
+                    self.connection.execute(f"INSERT OR IGNORE INTO {table} (hash, file, seen) VALUES (?, ?, ?)",
+                                            (key, filename, now))
+                return None
+
+            if record:
+                self.connection.execute(f"UPDATE {table} SET seen = ? WHERE hash = ?", (now, key))
+        return row[0] if row[0] != filename else None
+
+    def evict(self):
+        """
+        Remove the least recently seen pdfs and pages until the index is small enough.
+        :return: The number of hashes removed
+        """
+        removed = 0
+        for table in ("files", "pages"):
+            removed += self.connection.execute(f"DELETE FROM {table} WHERE hash IN "
+                                               f"(SELECT hash FROM {table} ORDER BY seen DESC LIMIT -1 OFFSET ?)",
+                                               (self.max_entries,)).rowcount
+        return removed
+
+    def close(self):
+        """
+        Close the index.
+        """
+        self.connection.close()
+        self._opened.pop((os.getpid(), self.filename), None)
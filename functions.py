@@ -1,7 +1,18 @@
 #!/usr/bin/python
 
-import glob
+import fnmatch
 import os
+import re
+import sys
+
+from metrics import metrics
+
+# Filesystem types that live on another machine, where every read is a round trip over the network.
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "afpfs", "webdav", "davfs", "9p", "afs", "ceph",
+                       "glusterfs", "fuse.sshfs", "fuse.rclone"}
+
+# The (mount point, filesystem type) of every mounted filesystem, longest mount point first. Read once.
+_mounts = None
 
 
 def plural(number_input):
@@ -16,19 +27,185 @@ def plural(number_input):
         return ""
 
 
+def file_size(size):
+    """
+    Return a size in bytes as a human readable string.
+    :param size: A number of bytes
+    :return: The size, ie: '512 bytes', '1.5 MB'
+    """
+    if size < 1024:
+        return f"{size} byte{plural(size)}"
+    for unit in ("KB", "MB", "GB"):
+        size /= 1024
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}"
+
+
 def get_all_pdfs(directory, output_filename):
     """
-    Get a list of valid pdf filenames in a directory. The processed output filename will not be included.
+    Get a sorted list of valid pdf filenames in a directory. The processed output filename, and its volumes
+    (ie: pdf_crop_merge-001.pdf), will not be included.
     :param directory: An absolute directory path
     :param output_filename: The output filename of the processed pdf.
     :return: A list of valid pdf filenames in a directory.
     """
-    file_list = []
+    return list(scan_pdfs(directory, output_filename))
+
 
-    for filename in glob.glob(os.path.join(directory, '*.pdf')):
-        if filename != directory + output_filename:
-            file_list.append(filename)
+def scan_pdfs(directory, output_filename, suffix="", recursive=False, include=(), exclude=(),
+              excluded_directories=()):
+    """
+    Find the pdfs in a directory, yielding each one as soon as it is found so they can be processed while the rest
+    of the directory is still being listed. Each directory is listed once, and its pdfs and subdirectories are
+    searched in name order. Hidden files and directories are left out.
+    :param directory: An absolute directory path, ending in /
+    :param output_filename: The output filename of the processed pdf, which is not included, nor are its volumes
+    :param suffix: (Optional) The suffix of processed pdfs, or a list of suffixes, which are not included
+    :param recursive: (Optional) Also find pdfs in subdirectories
+    :param include: (Optional) A list of globs. If given, only pdfs that match one of them are included.
+    :param exclude: (Optional) A list of globs. Pdfs and subdirectories that match one of them are left out.
+    Globs are matched against the path relative to the directory, ie: acme/label.pdf, and against the name.
+    :param excluded_directories: (Optional) A list of subdirectory paths that are never searched, ie: the archive
+    :return: A generator of pdf filenames
+    """
+    merge_filepath = directory + output_filename
+    excluded_directories = {os.path.normpath(excluded) for excluded in excluded_directories}
+    yield from _scan_directory(directory, "", merge_filepath, suffix, recursive, include, exclude,
+                               excluded_directories)
 
-    return file_list
 
+def _scan_directory(directory, relative_directory, merge_filepath, suffix, recursive, include, exclude,
+                    excluded_directories):
+    """
+    Find the pdfs in a directory and, if recursive, its subdirectories. See scan_pdfs.
+    :param directory: The directory path of the top level directory
+    :param relative_directory: The path of the directory being searched, relative to the top level directory
+    :return: A generator of pdf filenames
+    """
+    with metrics.time("scan"):
+        try:
+            with os.scandir(os.path.join(directory, relative_directory)) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            # A subdirectory that was removed, or can't be read, is left out
+            return
+
+    for entry in entries:
+        relative_path = relative_directory + entry.name
+        # Hidden files are left out like glob does, ie: the ._label.pdf files macOS leaves on external drives
+        if entry.name.startswith(".") or _matches(relative_path, entry.name, exclude):
+            continue
+
+        try:
+            is_directory = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            continue
+
+        if is_directory:
+            if recursive and os.path.normpath(entry.path) not in excluded_directories:
+                yield from _scan_directory(directory, relative_path + "/", merge_filepath, suffix, recursive,
+                                           include, exclude, excluded_directories)
+        elif entry.name.endswith(".pdf"):
+            filename = entry.path
+            # The merged pdf and its volumes are only ever in the top level directory
+            if not relative_directory and is_merged_pdf(filename, merge_filepath) or \
+                    is_processed_pdf(filename, suffix):
+                continue
+            if include and not _matches(relative_path, entry.name, include):
+                continue
+            yield filename
+
+
+def _matches(relative_path, name, globs):
+    """
+    Checks if a path matches any of a list of globs.
+    :param relative_path: The path relative to the input directory
+    :param name: The name of the file or directory
+    :param globs: A list of globs
+    :return: True if the relative path or the name matches one of the globs.
+    """
+    return any(fnmatch.fnmatchcase(relative_path, glob_pattern) or fnmatch.fnmatchcase(name, glob_pattern)
+               for glob_pattern in globs)
 
+
+def is_merged_pdf(filename, merge_filepath):
+    """
+    Checks if a pdf is the merged pdf, or one of its volumes.
+    :param filename: The filename of the pdf
+    :param merge_filepath: The filename of the merged pdf
+    :return: True if the pdf is the merged pdf or one of its volumes.
+    """
+    if filename == merge_filepath:
+        return True
+    base, extension = os.path.splitext(merge_filepath)
+    return re.fullmatch(re.escape(base) + r'-\d{3,}' + re.escape(extension), filename) is not None
+
+
+def is_network_path(path):
+    """
+    Checks if a file is on a network filesystem, ie: an SMB or NFS share.
+    :param path: The filename of a file
+    :return: True if the file is on a network filesystem, False if it is local or it can't be told.
+    """
+    path = os.path.realpath(path)
+    if os.name == "nt":
+        drive = os.path.splitdrive(path)[0]
+        if drive.startswith("\\\\"):
+            return True
+        try:
+            import ctypes
+            # DRIVE_REMOTE
+            return ctypes.windll.kernel32.GetDriveTypeW(drive + "\\") == 4
+        except (AttributeError, OSError):
+            return False
+
+    for mount_point, filesystem in mounts():
+        if path == mount_point or path.startswith(mount_point.rstrip("/") + "/"):
+            return filesystem in NETWORK_FILESYSTEMS
+    return False
+
+
+def mounts():
+    """
+    Get the mounted filesystems. The mount table is only read the first time.
+    :return: A list of (mount point, filesystem type), longest mount point first.
+    """
+    global _mounts
+    if _mounts is not None:
+        return _mounts
+
+    _mounts = []
+    try:
+        if os.path.exists("/proc/mounts"):
+            with open("/proc/mounts") as mounts_file:
+                for line in mounts_file:
+                    fields = line.split()
+                    if len(fields) >= 3:
+                        # Spaces in mount points are written as octal escapes, ie: \040
+                        mount_point = re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), fields[1])
+                        _mounts.append((mount_point, fields[2]))
+        elif sys.platform == "darwin":
+            # Only imported here, since nothing else needs it and it is slow to import
+            import subprocess
+            try:
+                output = subprocess.run(["mount"], capture_output=True, text=True, check=True).stdout
+            except subprocess.SubprocessError:
+                output = ""
+            for match in re.finditer(r'^.+? on (.+) \((\w+)[,)]', output, re.MULTILINE):
+                _mounts.append((match.group(1), match.group(2)))
+    except OSError:
+        pass
+
+    _mounts.sort(key=lambda mount: len(mount[0]), reverse=True)
+    return _mounts
+
+
+def is_processed_pdf(filename, suffix):
+    """
+    Checks if a pdf is the output of processing another pdf.
+    :param filename: The filename of the pdf
+    :param suffix: The suffix added to processed files, or a list of the suffixes of every output
+    :return: True if the pdf is a processed pdf.
+    """
+    suffixes = [suffix] if isinstance(suffix, str) else suffix
+    return any(output_suffix and filename.endswith("-" + output_suffix + ".pdf") for output_suffix in suffixes)
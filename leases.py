@@ -0,0 +1,280 @@
+#!/usr/bin/python
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+from metrics import metrics
+
+
+class Leases:
+    """This class lets several stations share one input directory, ie: a synced folder, without processing the
+    same pdf twice. Before a station processes a pdf it claims it by creating a lease file, which only one station
+    can create, and it removes the lease once the pdf is archived.
+
+    Leases are renewed while they are held. A station that stops holding leases without removing them, ie: it
+    crashed or lost power, lets them expire, and any other station can then take the pdf over. Expiry compares a
+    lease's modified time with the station's own clock, so the clocks of the stations must agree to well within
+    the lease time."""
+
+    # The directory holding the lease files, inside the input directory. It is hidden, so it is never scanned.
+    DIRECTORY = ".pdf_batch_crop_leases"
+    # The longest a station takes to create a lease and check it, before removing it again if it doesn't hold it.
+    CLAIM_SECONDS = 1.0
+
+    def __init__(self, input_directory, station, lease_seconds):
+        """
+        :param input_directory: The input directory shared by the stations
+        :param station: The name of the station, ie: its host name
+        :param lease_seconds: Seconds a lease lasts without being renewed, before another station can take it over
+        """
+        self.input_directory = input_directory
+        self.directory = os.path.join(input_directory, self.DIRECTORY)
+        os.makedirs(self.directory, exist_ok=True)
+        # Several processes can run on the same station, so each one is its own owner
+        self.owner = f"{station}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+
+        # The lease filename of each pdf held, keyed by the pdf's filename
+        self.held = {}
+        self._lock = threading.Lock()
+        self._renewer = None
+
+    def __len__(self):
+        return len(self.held)
+
+    def lease_filename(self, filename, generation=0):
+        """
+        Gets the filename of a generation of a pdf's lease. The pdf's path relative to the input directory is used,
+        so stations that mount the shared directory at different paths use the same lease.
+        :param filename: The filename of the pdf
+        :param generation: The generation of the lease, which goes up by one each time it is taken over
+        :return: The filename of the lease
+        """
+        return os.path.join(self.directory, f"{self._lease_name(filename)}.{generation}.lease")
+
+    def _lease_name(self, filename):
+        """
+        Gets the start of the filename of every generation of a pdf's lease.
+        :param filename: The filename of the pdf
+        :return: The start of the filename
+        """
+        relative_path = os.path.relpath(filename, self.input_directory).replace(os.sep, "/")
+        return hashlib.sha1(relative_path.encode()).hexdigest()
+
+    def claim(self, filename):
+        """
+        Claim a pdf for this station, taking it over if the station holding it let its lease expire.
+
+        Each time a lease is taken over, the next generation of it is created, which only one station can do. The
+        expired generations are left until the pdf is released, so the generations of a lease always run from 0 up.
+        A station only holds a pdf if, once its lease is created, there is no later generation, and every earlier
+        generation has expired.
+        :param filename: The filename of the pdf
+        :return: True if this station holds the pdf, False if another station does
+        """
+        leases = self._leases(filename)
+        generation = 0
+        if leases:
+            generation = len(leases) - 1
+            lease_filename, contents, modified = leases[generation]
+            if self._owner(contents) == self.owner:
+                return self._hold(filename, lease_filename)
+            if not self._expired(modified):
+                metrics.count("leases_busy")
+                return False
+            generation += 1
+
+        lease_filename = self.lease_filename(filename, generation)
+        if not self._create(lease_filename):
+            metrics.count("leases_busy")
+            return False
+
+        # Another station may have claimed the pdf with another generation while this lease was created
+        if not self._verify(filename, generation):
+            self._remove(lease_filename)
+            metrics.count("leases_busy")
+            return False
+
+        metrics.count("leases_taken_over" if generation else "leases_claimed")
+        return self._hold(filename, lease_filename)
+
+    def _verify(self, filename, generation):
+        """
+        Checks that this station holds a generation of a pdf's lease it has just created.
+        :param filename: The filename of the pdf
+        :param generation: The generation of the lease
+        :return: True if it is the latest generation, and every earlier generation has expired
+        """
+        leases = self._leases(filename)
+        if len(leases) != generation + 1 or self._owner(leases[generation][1]) != self.owner:
+            return False
+        return all(self._expired(modified) for _, _, modified in leases[:generation])
+
+    def _leases(self, filename):
+        """
+        Read every generation of a pdf's lease, from generation 0 up to the first that isn't there. Only the
+        leases of the pdf are looked for, so claiming a pdf takes the same time however many leases there are.
+        :param filename: The filename of the pdf
+        :return: A list of (lease filename, contents, modified time), one per generation
+        """
+        leases = []
+        while True:
+            lease_filename = self.lease_filename(filename, len(leases))
+            lease = self._read(lease_filename)
+            if lease is None:
+                return leases
+            leases.append((lease_filename, *lease))
+
+    def _expired(self, modified):
+        """
+        Checks if a lease has expired.
+        :param modified: The modified time of the lease
+        :return: True if the lease hasn't been renewed for the lease time
+        """
+        return time.time() - modified >= self.lease_seconds
+
+    def release(self, filename):
+        """
+        Remove the lease of a pdf held by this station, so the pdf can be claimed again if it is still there. The
+        expired generations before it are removed too, latest first, so the generations always run from 0 up.
+        :param filename: The filename of the pdf
+        """
+        with self._lock:
+            lease_filename = self.held.pop(filename, None)
+        if lease_filename is None:
+            return
+        lease = self._read(lease_filename)
+        if lease is None or self._owner(lease[0]) != self.owner:
+            return
+        for generation in range(self._generation(lease_filename), -1, -1):
+            self._remove(self.lease_filename(filename, generation))
+
+    def release_all(self):
+        """
+        Remove the lease of every pdf held by this station.
+        """
+        for filename in list(self.held):
+            self.release(filename)
+
+    def renew(self):
+        """
+        Renew every lease held by this station. Leases another station took over are no longer held.
+        """
+        with self._lock:
+            held = list(self.held.items())
+        now = time.time()
+        for filename, lease_filename in held:
+            lease = self._read(lease_filename)
+            if lease is None or self._owner(lease[0]) != self.owner:
+                self._lose(filename)
+                continue
+            try:
+                os.utime(lease_filename, (now, now))
+            except OSError:
+                pass
+
+            # A later generation is only kept by another station if this lease had expired when it was created.
+            # Otherwise the station creating it removes it again, so it is only lost if it is still there later.
+            if len(self._leases(filename)) > self._generation(lease_filename) + 1:
+                time.sleep(self.CLAIM_SECONDS)
+                if len(self._leases(filename)) > self._generation(lease_filename) + 1:
+                    self._lose(filename)
+
+    def _lose(self, filename):
+        """
+        Stop holding a pdf another station has taken over.
+        :param filename: The filename of the pdf
+        """
+        with self._lock:
+            self.held.pop(filename, None)
+        metrics.count("leases_lost")
+
+    @staticmethod
+    def _generation(lease_filename):
+        """
+        Gets the generation of a lease from its filename.
+        :param lease_filename: The filename of the lease
+        :return: The generation
+        """
+        return int(lease_filename.rsplit(".", 2)[1])
+
+    def _hold(self, filename, lease_filename):
+        """
+        Keep a lease as held, and start renewing leases if they aren't being renewed already.
+        :param filename: The filename of the pdf
+        :param lease_filename: The filename of its lease
+        :return: True
+        """
+        with self._lock:
+            self.held[filename] = lease_filename
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_forever, name="lease-renewer", daemon=True)
+                self._renewer.start()
+        return True
+
+    def _renew_forever(self):
+        """
+        Renew the held leases three times per lease, for as long as the station runs.
+        """
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            self.renew()
+
+    def _create(self, lease_filename):
+        """
+        Create a lease file, which only one station can do.
+        :param lease_filename: The filename of the lease
+        :return: True if this station created the lease, False if it already exists
+        """
+        try:
+            descriptor = os.open(lease_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        lease = {"owner": self.owner, "host": socket.gethostname(), "pid": os.getpid(), "claimed": time.time()}
+        try:
+            os.write(descriptor, json.dumps(lease).encode())
+        finally:
+            os.close(descriptor)
+        # The modified time is set from this station's clock, like when the lease is renewed
+        now = time.time()
+        os.utime(lease_filename, (now, now))
+        return True
+
+    @staticmethod
+    def _read(lease_filename):
+        """
+        Read a lease file.
+        :param lease_filename: The filename of the lease
+        :return: The contents of the lease and its modified time, or None if there is no lease
+        """
+        try:
+            with open(lease_filename, "rb") as lease_file:
+                return lease_file.read(), os.fstat(lease_file.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _owner(contents):
+        """
+        Gets the owner of a lease.
+        :param contents: The contents of the lease
+        :return: The owner, or None if the lease is still being written
+        """
+        try:
+            return json.loads(contents)["owner"]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    @staticmethod
+    def _remove(lease_filename):
+        """
+        Remove a lease file, if it is still there.
+        :param lease_filename: The filename of the lease
+        """
+        try:
+            os.remove(lease_filename)
+        except OSError:
+            pass
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class Manifest:
+    """This class represents a journal of the pdfs that have been processed, kept in the input directory.
+    Each pdf is recorded as started before it is processed, and as done once its output is written and it
+    has been archived. A pdf is skipped on later runs while it is unchanged and the crop settings are the same,
+    so an interrupted batch carries on from the first pdf that wasn't done."""
+
+    # Rewrite the journal with only the latest record of each pdf once it has this many times more records.
+    COMPACT_RATIO = 2
+
+    def __init__(self, filename, fingerprint):
+        self.filename = filename
+        self.fingerprint = fingerprint
+        self.entries = {}
+        self.records = 0
+        # Pdfs are recorded as started on the read thread of the pipeline
+        self._lock = threading.Lock()
+
+        if os.path.exists(filename):
+            with open(filename, "r", encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A crash while writing can leave a partial last line
+                        continue
+                    self.entries[entry["file"]] = entry
+                    self.records += 1
+
+            if self.records > self.COMPACT_RATIO * len(self.entries):
+                self.compact()
+
+        self.journal = open(filename, "a", encoding="utf-8")
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def config_fingerprint(bounding_box, filter_text, rotate, suffix, rules=None, outputs=None, hard_crop=False):
+        """
+        Gets a fingerprint of the settings that change the output of a pdf.
+        :param bounding_box: The bounding box used for cropping
+        :param filter_text: Pages containing this text are not cropped
+        :param rotate: Rotate Portrait to Landscape
+        :param suffix: The suffix added to processed files
+        :param rules: (Optional) The RuleEngine with the crop profiles
+        :param outputs: (Optional) A list of the extra Output written for each pdf
+        :param hard_crop: (Optional) Content outside the bounding box is removed
+        :return: A hex digest of the settings
+        """
+        settings = [bounding_box, filter_text, rotate, suffix]
+        if rules or outputs or hard_crop:
+            settings.append(rules.settings() if rules else [])
+        if outputs or hard_crop:
+            settings.append([output.settings() for output in outputs or []])
+        if hard_crop:
+            settings.append(hard_crop)
+        settings = json.dumps(settings)
+        return hashlib.sha256(settings.encode()).hexdigest()
+
+    @staticmethod
+    def file_hash(filename):
+        """
+        Gets a hash of the contents of a file.
+        :param filename: The filename
+        :return: A hex digest of the file
+        """
+        digest = hashlib.sha256()
+        with open(filename, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def is_done(self, filename):
+        """
+        Checks if a pdf has already been processed with the current settings, and hasn't changed since.
+        Only the size and modified time are checked, unless they have changed.
+        :param filename: The filename of the pdf
+        :return: True if the pdf can be skipped.
+        """
+        entry = self.entries.get(filename)
+        if entry is None or entry["status"] != "done" or entry["config"] != self.fingerprint:
+            return False
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return True
+
+        # The file was touched or copied over. It only needs processing if the contents are different.
+        if entry["size"] == stat.st_size and entry["sha256"] == self.file_hash(filename):
+            self._write(dict(entry, mtime_ns=stat.st_mtime_ns))
+            return True
+
+        return False
+
+    def snapshot(self, filename):
+        """
+        Gets the size, modified time and hash of a pdf, before it is archived.
+        :param filename: The filename of the pdf
+        :return: A dictionary of the size, modified time and hash of the pdf
+        """
+        stat = os.stat(filename)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": self.file_hash(filename)}
+
+    def started(self, filename):
+        """
+        Record that a pdf is being processed.
+        :param filename: The filename of the pdf
+        """
+        self._write({"file": filename, "status": "started", "config": self.fingerprint})
+
+    def done(self, filename, snapshot, output):
+        """
+        Record that a pdf has been processed.
+        :param filename: The filename of the pdf
+        :param snapshot: The size, modified time and hash of the pdf, from before it was archived
+        :param output: The filename of the output the pdf was processed to
+        """
+        self._write(dict(snapshot, file=filename, status="done", config=self.fingerprint, output=output))
+
+    def failed(self, filename):
+        """
+        Record that a pdf failed to process, so it is tried again next time.
+        :param filename: The filename of the pdf
+        """
+        self._write({"file": filename, "status": "failed", "config": self.fingerprint})
+
+    def _write(self, entry):
+        """
+        Add a record to the journal, and make sure it is on disk before carrying on.
+        :param entry: A dictionary with the filename of the pdf under "file"
+        """
+        entry["time"] = time.time()
+        with self._lock:
+            self.entries[entry["file"]] = entry
+            self.records += 1
+            self.journal.write(json.dumps(entry) + "\n")
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def compact(self):
+        """
+        Rewrite the journal with only the latest record of each pdf.
+        """
+        temporary_filename = self.filename + ".tmp"
+        with open(temporary_filename, "w", encoding="utf-8") as journal:
+            for entry in self.entries.values():
+                journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temporary_filename, self.filename)
+        self.records = len(self.entries)
+
+    def close(self):
+        """
+        Close the journal.
+        """
+        self.journal.close()
@@ -0,0 +1,370 @@
+#!/usr/bin/python
+from PyPDF2 import PdfWriter, PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+import hashlib
+import io
+import itertools
+import os
+
+from metrics import metrics
+
+
+class MergedPdf:
+    """This class represents a merged PDF file. Processed pages are added straight into a single writer,
+    so there is no need to write each processed pdf to disk and parse it again.
+
+    If a page or size limit is given, the merged pdf is split into volumes, ie: pdf_crop_merge-001.pdf.
+    Each volume is written as soon as it is full and its pages are released, so memory stays bounded
+    no matter how big the batch is.
+
+    Labels from the same carrier embed the same fonts and logos. Resources are compared by a hash of their
+    contents, and each distinct resource is only stored once in each volume, so only resources new to a volume
+    count towards its size."""
+    # The bytes written once in every pdf: the header, catalog, page tree, cross reference table and trailer.
+    PDF_OVERHEAD = 320
+    # The bytes written around each object: its number, obj and endobj, and its cross reference entry.
+    OBJECT_OVERHEAD = 40
+
+    # What kind of pdf object each type is. PyPDF2 types are typing protocols, which makes isinstance slow.
+    _kinds = {}
+
+    def __init__(self, filename=None, max_pages=0, max_bytes=0):
+        self.filename = filename
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.writer = PdfWriter()
+
+        # The filenames of the volumes already written, and the pages and estimated size of the current volume.
+        self.volumes = []
+        self.volume_pages = 0
+        self.volume_bytes = 0
+        self.written_pages = 0
+
+        # Hashes of the resources in the current volume, and the writer object number and size of each.
+        self.resources = {}
+        self.sizes = {}
+        # Hashes of the resources of the pdf being added, keyed by (reader id, object number).
+        self.digests = {}
+        self.deduplicated = 0
+        self.bytes_saved = 0
+
+    def __len__(self):
+        return self.pages
+
+    @property
+    def pages(self):
+        """
+        Gets the number of pages in the merged pdf, including volumes already written
+        :return: The number of pages in the merged pdf
+        """
+        return self.written_pages + len(self.writer.pages)
+
+    @property
+    def split(self):
+        """
+        Gets whether the merged pdf is split into volumes
+        :return: True if there is a page or size limit
+        """
+        return bool(self.max_pages or self.max_bytes)
+
+    @property
+    def current_filename(self):
+        """
+        Gets the filename the pages added so far will be written to
+        :return: The filename of the current volume, or of the merged pdf if it isn't split
+        """
+        if not self.split:
+            return self.filename
+        return self.volume_filename(len(self.volumes) + 1)
+
+    def volume_filename(self, number):
+        """
+        Gets the filename of a volume, ie: pdf_crop_merge-001.pdf
+        :param number: The volume number, starting at 1
+        :return: The filename of the volume
+        """
+        base, extension = os.path.splitext(self.filename)
+        return f"{base}-{number:03d}{extension}"
+
+    def add_pages(self, pages, size=None):
+        """
+        Add processed pages to the merged pdf. When splitting by size, the pages of a pdf are kept in the same volume.
+        :param pages: A list of pages that all come from the same pdf
+        :param size: (Optional) The size of the pages on their own as a pdf, if it is already known, ie: from the
+        processed pdf written for them. Otherwise it is estimated.
+        """
+        if not pages:
+            return
+
+        page_resources = self._page_resources(pages)
+        if self.max_bytes:
+            if size is None:
+                size = self.estimate(pages)
+            # Resources already in the volume, or on an earlier page, aren't stored again, so they add nothing
+            shared_size = self._shared_size()
+            if self.volume_pages and self.volume_bytes + size - shared_size > self.max_bytes:
+                self.flush()
+                shared_size = self._shared_size()
+            self.volume_bytes += size - shared_size
+
+        with metrics.time("merge"):
+            for number, page in enumerate(pages):
+                if self.max_pages and self.volume_pages >= self.max_pages:
+                    self.flush()
+                    # Resources the rest of the pages share with earlier pages aren't in the new volume
+                    self.digests = {}
+                    page_resources[number:] = self._page_resources(pages[number:])
+                new_resources = self._share_resources(page_resources[number])
+                self.writer.add_page(page)
+                self._remember_resources(new_resources)
+                self.volume_pages += 1
+
+        # The writer remembers which source objects it has already copied, keyed by id() of the source reader.
+        # Every object is copied by now, and ids get reused once readers are closed, so forget this reader.
+        self.writer._id_translated.pop(id(pages[0].pdf), None)
+        self.digests = {}
+
+    def add_bytes(self, data):
+        """
+        Add all pages of a processed pdf held in memory to the merged pdf.
+        :param data: The bytes of a processed pdf
+        """
+        with metrics.time("parse"):
+            pages = list(PdfReader(io.BytesIO(data)).pages)
+        self.add_pages(pages, len(data))
+
+    def _page_resources(self, pages):
+        """
+        Hash the resources of pages, adding the hash of each to digests.
+        :param pages: A list of pages that all come from the same pdf
+        :return: A list with the (reader id, object number) of the resources of each page, leaving out resources
+        already found on an earlier page
+        """
+        page_resources = []
+        for page in pages:
+            seen = len(self.digests)
+            self._resource_digest(page.get('/Resources'), self.digests, ())
+            # Only the newest keys are taken, so a pdf with many pages isn't slow to look through
+            page_resources.append(list(itertools.islice(reversed(self.digests), len(self.digests) - seen))[::-1])
+        return page_resources
+
+    def estimate(self, pages):
+        """
+        Estimates the size of pages written on their own as a pdf, from the sizes of their objects, without writing
+        them. The resources of the pages must already be hashed with _page_resources.
+        :param pages: A list of pages that all come from the same pdf
+        :return: The size in bytes
+        """
+        size = self.PDF_OVERHEAD
+        for page in pages:
+            output_stream = io.BytesIO()
+            page.write_to_stream(output_stream, None)
+            size += output_stream.tell() + self.OBJECT_OVERHEAD
+            for key in page:
+                value = page.raw_get(key)
+                if key == '/Contents' and self._kind(type(value)) is ArrayObject:
+                    size += sum(self._object_size(item) for item in value if self._kind(type(item)) is IndirectObject)
+                elif key not in ('/Parent', '/Resources') and self._kind(type(value)) is IndirectObject:
+                    size += self._object_size(value)
+        for digest, reference in self.digests.values():
+            size += self._resource_size(digest, reference)
+        return size
+
+    def _resource_size(self, digest, reference):
+        """
+        Gets the size a resource takes up in a pdf file. Resources with the same hash are only measured once.
+        :param digest: The hash of the resource, or None if it can't be shared
+        :param reference: An IndirectObject
+        :return: The size in bytes
+        """
+        if digest is None:
+            return self._object_size(reference)
+        if digest not in self.sizes:
+            self.sizes[digest] = self._object_size(reference)
+        return self.sizes[digest]
+
+    def _shared_size(self):
+        """
+        Gets how much smaller the pdf being added is in the current volume than on its own as a pdf, since its
+        resources already in the volume, or on an earlier page of the pdf, aren't stored again.
+        :return: The size in bytes of the resources that aren't stored again
+        """
+        shared_size = 0
+        seen = set(self.resources)
+        for digest, reference in self.digests.values():
+            if digest is None:
+                continue
+            if digest in seen:
+                shared_size += self._resource_size(digest, reference)
+            seen.add(digest)
+        return shared_size
+
+    def _share_resources(self, resources):
+        """
+        Make the writer reuse resources already in the current volume, for every resource of a page with the same
+        contents, instead of copying them again.
+        :param resources: The (reader id, object number) of the resources of a page that is about to be added
+        :return: A list of (hash, reader id, object number) of resources that aren't in the current volume yet
+        """
+        # The writer's map of the objects it has copied is private, so PyPDF2 is pinned in requirements.txt to the
+        # version this was checked against, and test_writer_translations fails if it changes.
+        translated = self.writer._id_translated
+        new_resources = []
+        for reader_id, idnum in resources:
+            digest, reference = self.digests[(reader_id, idnum)]
+            if digest is None or idnum in translated.get(reader_id, {}):
+                continue
+            if digest in self.resources:
+                translated.setdefault(reader_id, {})[idnum] = self.resources[digest]
+                resource_size = self._resource_size(digest, reference)
+                self.deduplicated += 1
+                self.bytes_saved += resource_size
+                metrics.count("resources_deduplicated")
+                metrics.count("bytes_deduplicated", resource_size)
+            else:
+                new_resources.append((digest, reader_id, idnum))
+
+        return new_resources
+
+    def _remember_resources(self, new_resources):
+        """
+        Remember which writer objects the new resources of a page were copied to.
+        :param new_resources: The list returned by _share_resources
+        """
+        translated = self.writer._id_translated
+        for digest, reader_id, idnum in new_resources:
+            writer_idnum = translated.get(reader_id, {}).get(idnum)
+            if writer_idnum is not None:
+                self.resources.setdefault(digest, writer_idnum)
+
+    @classmethod
+    def _resource_digest(cls, pdf_object, digests, stack):
+        """
+        Gets a hash of a pdf object and everything it refers to. The hash of every indirect object found is
+        added to digests, keyed by (reader id, object number).
+        :param pdf_object: A pdf object
+        :param digests: A dictionary of (hash, IndirectObject), keyed by (reader id, object number)
+        :param stack: The indirect objects being hashed, to find reference loops
+        :return: The hash (or the bytes of a number, name or string), or None if the object is part of a
+        reference loop and can't be shared
+        """
+        kind = cls._kind(type(pdf_object))
+        if kind is IndirectObject:
+            key = (id(pdf_object.pdf), pdf_object.idnum)
+            if key in digests:
+                return digests[key][0]
+            if key in stack:
+                return None
+            digest = cls._resource_digest(pdf_object.get_object(), digests, stack + (key,))
+            digests[key] = (digest, pdf_object)
+            return digest
+
+        if kind is None:
+            # Numbers, names and strings are short, so they don't need hashing
+            return type(pdf_object).__name__.encode() + repr(pdf_object).encode()
+
+        digest = hashlib.sha256(type(pdf_object).__name__.encode())
+        if kind is DictionaryObject or kind is StreamObject:
+            # Objects in the page tree are never shared
+            if '/Parent' in pdf_object:
+                return None
+            for key in sorted(pdf_object):
+                child_digest = cls._resource_digest(pdf_object.raw_get(key), digests, stack)
+                if child_digest is None:
+                    return None
+                digest.update(key.encode())
+                digest.update(child_digest)
+            if kind is StreamObject:
+                digest.update(pdf_object._data)
+        elif kind is ArrayObject:
+            for item in pdf_object:
+                child_digest = cls._resource_digest(item, digests, stack)
+                if child_digest is None:
+                    return None
+                digest.update(child_digest)
+        return digest.digest()
+
+    @classmethod
+    def _kind(cls, object_type):
+        """
+        Gets what kind of pdf object a type is.
+        :param object_type: The type of a pdf object
+        :return: IndirectObject, StreamObject, DictionaryObject, ArrayObject, or None for anything else
+        """
+        kind = cls._kinds.get(object_type, False)
+        if kind is False:
+            kind = next((kind for kind in (IndirectObject, StreamObject, DictionaryObject, ArrayObject)
+                         if issubclass(object_type, kind)), None)
+            cls._kinds[object_type] = kind
+        return kind
+
+    @staticmethod
+    def _object_size(reference):
+        """
+        Gets the size an indirect object takes up in a pdf file, including its cross reference entry.
+        :param reference: An IndirectObject
+        :return: The size in bytes
+        """
+        output_stream = io.BytesIO()
+        reference.get_object().write_to_stream(output_stream, None)
+        return output_stream.tell() + len(f"{reference.idnum} 0 obj\n\nendobj\n") + 20
+
+    @staticmethod
+    def measure(pages):
+        """
+        Gets the size of pages written on their own as a pdf. Pages that share resources are counted once.
+        :param pages: A list of pages
+        :return: The size in bytes
+        """
+        writer = PdfWriter()
+        for page in pages:
+            writer.add_page(page)
+        output_stream = io.BytesIO()
+        writer.write(output_stream)
+        return output_stream.tell()
+
+    def flush(self):
+        """
+        Write the current volume, and start a new one. Nothing is written if the current volume is empty.
+        """
+        if not self.volume_pages:
+            return
+
+        filename = self.current_filename
+        self._write_writer(filename)
+        self.volumes.append(filename)
+        self.written_pages += len(self.writer.pages)
+
+        self.writer = PdfWriter()
+        self.volume_pages = 0
+        self.volume_bytes = 0
+        self.resources = {}
+
+    def write(self, filename=None):
+        """
+        Write the merged pdf to a file, or write the last volume if it is split.
+        :param filename: (Optional) The filename of the merged pdf, if it wasn't given when it was created
+        """
+        if filename:
+            self.filename = filename
+
+        if self.split:
+            self.flush()
+
+            # Volumes left over from an earlier, bigger batch would be mistaken for part of this one.
+            number = len(self.volumes) + 1
+            while os.path.exists(self.volume_filename(number)):
+                os.remove(self.volume_filename(number))
+                number += 1
+        else:
+            self._write_writer(self.filename)
+
+    def _write_writer(self, filename):
+        """
+        Write the pages in the writer to a file.
+        :param filename: The filename
+        """
+        with metrics.time("merge_write"):
+            with open(filename, "wb") as output_stream:
+                self.writer.write(output_stream)
+        metrics.count("bytes_written", os.path.getsize(filename))
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Metrics:
+    """This class collects how long each stage of processing takes, and counts of pages, files and bytes.
+    Worker processes collect their own metrics, which are merged into the main process's metrics.
+
+    The depth of each queue between the stages of a pipeline is sampled too. A queue that is usually full is
+    waiting on the stage after it, and a queue that is usually empty is waiting on the stage before it.
+
+    Only the most recent files are kept, since in watch and serve mode the metrics add up for as long as the
+    program runs."""
+
+    PROMETHEUS_PREFIX = "pdf_batch_crop"
+
+    # The most files kept in the report
+    RECENT_FILES = 1000
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.queues = {}
+        self.files = collections.deque(maxlen=self.RECENT_FILES)
+        self.started = time.time()
+        # The stages of a pipeline run on their own threads
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        """
+        Time a stage of processing, ie: with metrics.time("parse"):
+        :param stage: The name of the stage
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start_time)
+
+    def add_time(self, stage, seconds, calls=1):
+        """
+        Add time spent in a stage of processing.
+        :param stage: The name of the stage
+        :param seconds: The time spent in the stage
+        :param calls: The number of times the stage ran
+        """
+        with self._lock:
+            totals = self.stages.setdefault(stage, {"seconds": 0.0, "calls": 0})
+            totals["seconds"] += seconds
+            totals["calls"] += calls
+
+    def count(self, name, amount=1):
+        """
+        Add to a counter.
+        :param name: The name of the counter, ie: pages_filtered
+        :param amount: The amount to add
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_depth(self, queue_name, depth, samples=1, total=None):
+        """
+        Sample the depth of a queue between two stages of a pipeline.
+        :param queue_name: The name of the queue, ie: read
+        :param depth: The number of items in the queue, or the deepest of several samples
+        :param samples: The number of samples
+        :param total: (Optional) The total depth of several samples. Defaults to the depth.
+        """
+        with self._lock:
+            totals = self.queues.setdefault(queue_name, {"samples": 0, "total": 0, "max": 0})
+            totals["samples"] += samples
+            totals["total"] += depth if total is None else total
+            totals["max"] = max(totals["max"], depth)
+
+    def add_file(self, filename, pages, new_pages, seconds, error=None):
+        """
+        Record the processing of a single pdf. Once RECENT_FILES are recorded, the oldest is forgotten.
+        :param filename: The filename of the pdf
+        :param pages: The number of pages in the pdf
+        :param new_pages: The number of pages in the processed pdf
+        :param seconds: The time taken to process the pdf
+        :param error: (Optional) Why the pdf failed to process
+        """
+        with self._lock:
+            self.files.append({"file": filename, "pages": pages, "new_pages": new_pages,
+                               "seconds": round(seconds, 6), "error": error})
+
+    def snapshot(self):
+        """
+        Gets the metrics in a form that can be sent between processes.
+        :return: A dictionary of stages, counters and queues
+        """
+        with self._lock:
+            return {"stages": {stage: dict(totals) for stage, totals in self.stages.items()},
+                    "counters": dict(self.counters),
+                    "queues": {queue_name: dict(totals) for queue_name, totals in self.queues.items()}}
+
+    def merge(self, snapshot):
+        """
+        Add metrics collected by another process.
+        :param snapshot: A dictionary from snapshot
+        """
+        for stage, totals in snapshot["stages"].items():
+            self.add_time(stage, totals["seconds"], totals["calls"])
+        for name, amount in snapshot["counters"].items():
+            self.count(name, amount)
+        for queue_name, totals in snapshot.get("queues", {}).items():
+            self.add_depth(queue_name, totals["max"], totals["samples"], totals["total"])
+
+    def reset(self):
+        """
+        Forget every metric collected so far.
+        """
+        self.__init__()
+
+    def report(self):
+        """
+        Gets a report of every metric.
+        :return: A dictionary of the metrics
+        """
+        # The stages of a pipeline and the server add to the metrics on other threads while they are reported
+        with self._lock:
+            stage_totals = {stage: dict(totals) for stage, totals in self.stages.items()}
+            counters = dict(self.counters)
+            queue_totals = {queue_name: dict(totals) for queue_name, totals in self.queues.items()}
+            files = list(self.files)
+
+        stages = {}
+        for stage, totals in sorted(stage_totals.items()):
+            stages[stage] = {"seconds": round(totals["seconds"], 6), "calls": totals["calls"],
+                             "average_seconds": round(totals["seconds"] / totals["calls"], 6) if totals["calls"] else 0}
+        queues = {queue_name: {"samples": totals["samples"], "max_depth": totals["max"],
+                               "average_depth": round(totals["total"] / totals["samples"], 3)}
+                  for queue_name, totals in sorted(queue_totals.items()) if totals["samples"]}
+        return {
+            "started": self.started,
+            "seconds": round(time.time() - self.started, 6),
+            "stages": stages,
+            "counters": dict(sorted(counters.items())),
+            "queues": queues,
+            "files": files,
+        }
+
+    def write_json(self, filename):
+        """
+        Write a report of every metric as JSON.
+        :param filename: The filename of the report
+        """
+        self._write_atomic(filename, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, filename):
+        """
+        Write the metrics in the Prometheus text format, for the node exporter textfile collector.
+        :param filename: The filename of the metrics file, which should end with .prom
+        """
+        prefix = self.PROMETHEUS_PREFIX
+        report = self.report()
+        # Stage times and counters only ever go up, until the program restarts, so they are Prometheus counters
+        lines = [f"# HELP {prefix}_stage_seconds_total Time spent in each stage of processing.",
+                 f"# TYPE {prefix}_stage_seconds_total counter"]
+        lines += [f'{prefix}_stage_seconds_total{{stage="{stage}"}} {totals["seconds"]}'
+                  for stage, totals in report["stages"].items()]
+        lines += [f"# HELP {prefix}_stage_calls_total Number of times each stage of processing ran.",
+                  f"# TYPE {prefix}_stage_calls_total counter"]
+        lines += [f'{prefix}_stage_calls_total{{stage="{stage}"}} {totals["calls"]}'
+                  for stage, totals in report["stages"].items()]
+        for name, amount in report["counters"].items():
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {amount}"]
+        if report["queues"]:
+            lines += [f"# HELP {prefix}_queue_depth Average number of items waiting in each pipeline queue.",
+                      f"# TYPE {prefix}_queue_depth gauge"]
+            lines += [f'{prefix}_queue_depth{{queue="{queue_name}"}} {totals["average_depth"]}'
+                      for queue_name, totals in report["queues"].items()]
+            lines += [f"# HELP {prefix}_queue_max_depth Most items waiting in each pipeline queue.",
+                      f"# TYPE {prefix}_queue_max_depth gauge"]
+            lines += [f'{prefix}_queue_max_depth{{queue="{queue_name}"}} {totals["max_depth"]}'
+                      for queue_name, totals in report["queues"].items()]
+        lines += [f"# HELP {prefix}_run_seconds Time since processing started.",
+                  f"# TYPE {prefix}_run_seconds gauge",
+                  f"{prefix}_run_seconds {report['seconds']}",
+                  f"# HELP {prefix}_last_run_timestamp_seconds When the metrics were written.",
+                  f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+                  f"{prefix}_last_run_timestamp_seconds {round(time.time(), 3)}"]
+        self._write_atomic(filename, "\n".join(lines) + "\n")
+
+    @staticmethod
+    def _write_atomic(filename, text):
+        """
+        Write a file so it is never seen half written.
+        :param filename: The filename
+        :param text: The contents of the file
+        """
+        temporary_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(temporary_filename, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temporary_filename, filename)
+
+
+# The metrics of this process
+metrics = Metrics()
@@ -0,0 +1,46 @@
+#!/usr/bin/python
+
+
+class Output:
+    """This class is an extra output written for every input pdf, alongside the cropped pdf, ie: the commercial
+    invoice pages that are filtered out, or a second crop of the customs declaration. Each output is written to the
+    input pdf's filename with the output's suffix, ie: label-invoice.pdf, and only if it has pages."""
+
+    # Which pages of the input pdf go in an output: the pages that are cropped, the pages that are filtered out,
+    # or every page.
+    PAGES = ("kept", "filtered", "all")
+
+    def __init__(self, name, suffix="", pages="kept", bounding_box=None, rotate=False):
+        """
+        :param name: The name of the output, ie: invoices
+        :param suffix: (Optional) The suffix added to the end of the new file. Defaults to the name.
+        :param pages: (Optional) Which pages go in the output: kept, filtered or all
+        :param bounding_box: (Optional) The bounding box used for cropping. If None, pages aren't cropped.
+        :param rotate: (Optional) Rotate Portrait to Landscape
+        """
+        if pages not in self.PAGES:
+            raise ValueError(f"Invalid output pages: {pages}. Must be one of: {', '.join(self.PAGES)}.")
+        self.name = name
+        self.suffix = suffix or name
+        self.pages = pages
+        self.bounding_box = bounding_box
+        self.rotate = rotate
+
+    def __str__(self):
+        return self.name
+
+    def settings(self):
+        """
+        Gets the settings of the output, ie: for the manifest fingerprint.
+        :return: A dictionary of the settings
+        """
+        return {"name": self.name, "suffix": self.suffix, "pages": self.pages, "bounding_box": self.bounding_box,
+                "rotate": self.rotate}
+
+    def includes(self, kept):
+        """
+        Checks if a page goes in the output.
+        :param kept: True if the page is cropped, False if it is filtered out
+        :return: True if the page goes in the output
+        """
+        return self.pages == "all" or self.pages == ("kept" if kept else "filtered")
@@ -0,0 +1,300 @@
+#!/usr/bin/python
+from PyPDF2.generic import ArrayObject
+import re
+
+from metrics import metrics
+
+
+class PageFilter:
+    """This class checks if the filter text appears in a page. Full text extraction is slow, so the page's
+    content stream is scanned for the text first, and the text is only extracted when the scan can't decide.
+
+    The scan can only decide when the filter text is plain text (not a regular expression) and every font
+    on the page maps ascii characters to themselves, so the text shown is the same as the extracted text:
+    - If a single string drawn on the page contains the filter text, the page matches.
+    - If the filter text, ignoring whitespace, isn't in all the strings drawn on the page joined together,
+      the page doesn't match. Text extraction only adds whitespace between the strings.
+    - If nothing is drawn with text operators, the extracted text would be blank."""
+
+    # Filter text made of only these characters is treated as plain text.
+    PLAIN_TEXT_REGEX = r'[A-Za-z0-9 ,:#/&-]+'
+
+    # Fonts whose ascii characters are always extracted as themselves, unless they have a /ToUnicode map.
+    SIMPLE_FONT_TYPES = ('/Type1', '/TrueType', '/MMType1')
+    SIMPLE_ENCODINGS = ('/WinAnsiEncoding', '/StandardEncoding', '/MacRomanEncoding', '/PDFDocEncoding')
+    SYMBOLIC_FONTS = ('/Symbol', '/ZapfDingbats')
+
+    # Form XObjects can contain further forms, but not forever.
+    MAX_FORM_DEPTH = 8
+
+    WHITESPACE = b' \t\r\n\f\x00'
+    DELIMITERS = b'()<>[]{}/%'
+    ESCAPES = {ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f'}
+
+    def __init__(self, filter_text):
+        self.filter_text = filter_text
+        self.pattern = re.compile(filter_text)
+        self.plain_text = re.fullmatch(self.PLAIN_TEXT_REGEX, filter_text) is not None
+        self.stripped_text = "".join(filter_text.split())
+
+        # How many pages were decided by scanning content streams, and how many needed text extraction.
+        self.fast = 0
+        self.slow = 0
+
+    def matches(self, page, page_text=None):
+        """
+        Checks if the filter text appears in a page.
+        :param page: A page
+        :param page_text: (Optional) The PageText of the page, if it is shared with the crop profiles
+        :return: True if the filter text appears in the page.
+        """
+        if page_text is None:
+            page_text = PageText(page)
+
+        verdict = self.scan(page, page_text)
+        if verdict is not None:
+            self.fast += 1
+            metrics.count("pages_filter_scanned")
+            return verdict
+
+        self.slow += 1
+        metrics.count("pages_filter_extracted")
+        return self.pattern.search(page_text.extracted) is not None
+
+    def scan(self, page, page_text=None):
+        """
+        Checks if the filter text appears in a page by scanning the page's content stream, without extracting text.
+        :param page: A page
+        :param page_text: (Optional) The PageText of the page, if it is shared with the crop profiles
+        :return: True if the filter text appears, False if it doesn't, and None if the scan can't decide.
+        """
+        if page_text is None:
+            page_text = PageText(page)
+
+        texts = page_text.shown
+        if texts is None:
+            return None
+
+        if not texts:
+            return self.pattern.search("") is not None
+
+        if not self.plain_text:
+            return None
+
+        if any(self.filter_text in text for text in texts):
+            return True
+        if self.stripped_text not in "".join("".join(texts).split()):
+            return False
+
+        return None
+
+    @classmethod
+    def _shown_strings(cls, contents, resources, depth):
+        """
+        Gets every string drawn by text operators in a content stream, in order, including strings drawn by forms.
+        :param contents: A content stream, or an array of content streams
+        :param resources: The resources of the content stream
+        :param depth: How many forms deep the content stream is
+        :return: A list of byte strings, or None if the strings can't be read reliably.
+        """
+        if contents is None:
+            return []
+        if resources is None or depth > cls.MAX_FORM_DEPTH:
+            return None
+
+        resources = resources.get_object()
+        fonts = resources.get('/Font')
+        fonts = fonts.get_object() if fonts is not None else {}
+        xobjects = resources.get('/XObject')
+        xobjects = xobjects.get_object() if xobjects is not None else {}
+
+        contents = contents.get_object()
+        if isinstance(contents, ArrayObject):
+            data = b"\n".join(stream.get_object().get_data() for stream in contents)
+        else:
+            data = contents.get_data()
+
+        strings = []
+        for operator, operands in cls._operations(data):
+            if operator is None:
+                return None
+            if operator == b'Tf':
+                if not operands or operands[0] not in fonts or not cls._simple_font(fonts[operands[0]].get_object()):
+                    return None
+            elif operator in (b'Tj', b"'", b'"'):
+                if operands and isinstance(operands[-1], bytes):
+                    strings.append(operands[-1])
+            elif operator == b'TJ':
+                if operands and isinstance(operands[-1], list):
+                    strings.extend(item for item in operands[-1] if isinstance(item, bytes))
+            elif operator == b'Do':
+                if not operands or operands[0] not in xobjects:
+                    return None
+                xobject = xobjects[operands[0]].get_object()
+                if xobject.get('/Subtype') == '/Form':
+                    form_strings = cls._shown_strings(xobject, xobject.get('/Resources'), depth + 1)
+                    if form_strings is None:
+                        return None
+                    strings.extend(form_strings)
+
+        # Strings starting with a byte order mark are extracted as unicode text
+        if any(string.startswith(b'\xfe\xff') or string.startswith(b'\xff\xfe') for string in strings):
+            return None
+
+        return strings
+
+    @classmethod
+    def _simple_font(cls, font):
+        """
+        Checks if a font extracts ascii characters as themselves.
+        :param font: A font dictionary
+        :return: True if the font extracts ascii characters as themselves.
+        """
+        if font.get('/Subtype') not in cls.SIMPLE_FONT_TYPES or '/ToUnicode' in font:
+            return False
+        if '/Encoding' not in font:
+            return font.get('/BaseFont') not in cls.SYMBOLIC_FONTS
+        return font['/Encoding'].get_object() in cls.SIMPLE_ENCODINGS
+
+    @classmethod
+    def _operations(cls, data):
+        """
+        Splits a content stream into operations. Only strings, arrays of strings and names are kept as operands.
+        :param data: The decoded content stream
+        :return: A generator of (operator, operands). The operator is None if the stream can't be read.
+        """
+        operands = []
+        arrays = []
+        index = 0
+        length = len(data)
+
+        while index < length:
+            char = data[index]
+            if char in cls.WHITESPACE:
+                index += 1
+            elif char == ord('%'):
+                while index < length and data[index] not in b'\r\n':
+                    index += 1
+            elif char == ord('('):
+                string, index = cls._literal_string(data, index)
+                (arrays[-1] if arrays else operands).append(string)
+            elif char == ord('<'):
+                if data[index + 1:index + 2] == b'<':
+                    index += 2
+                else:
+                    end = data.index(b'>', index)
+                    digits = bytes(c for c in data[index + 1:end] if c not in cls.WHITESPACE)
+                    if len(digits) % 2:
+                        digits += b'0'
+                    (arrays[-1] if arrays else operands).append(bytes.fromhex(digits.decode('ascii')))
+                    index = end + 1
+            elif char == ord('>'):
+                index += 1
+            elif char == ord('['):
+                arrays.append([])
+                index += 1
+            elif char == ord(']'):
+                if not arrays:
+                    yield None, []
+                    return
+                array = arrays.pop()
+                (arrays[-1] if arrays else operands).append(array)
+                index += 1
+            elif char == ord('/'):
+                end = index + 1
+                while end < length and data[end] not in cls.WHITESPACE and data[end] not in cls.DELIMITERS:
+                    end += 1
+                (arrays[-1] if arrays else operands).append('/' + data[index + 1:end].decode('latin-1'))
+                index = end
+            else:
+                end = index + 1
+                while end < length and data[end] not in cls.WHITESPACE and data[end] not in cls.DELIMITERS:
+                    end += 1
+                word = data[index:end]
+                index = end
+
+                if arrays or word[:1] in b'+-.0123456789' or word in (b'true', b'false', b'null'):
+                    continue
+                if word == b'BI':
+                    # Inline image data is binary and can't be tokenized
+                    yield None, []
+                    return
+
+                yield word, operands
+                operands = []
+
+    @classmethod
+    def _literal_string(cls, data, index):
+        """
+        Reads a literal string, ie: (Commercial Invoice), from a content stream.
+        :param data: The decoded content stream
+        :param index: The position of the opening parenthesis
+        :return: The string and the position after the closing parenthesis
+        """
+        string = bytearray()
+        depth = 1
+        index += 1
+
+        while depth:
+            char = data[index]
+            if char == ord('\\'):
+                index += 1
+                char = data[index]
+                if char in cls.ESCAPES:
+                    string += cls.ESCAPES[char]
+                elif char in b'01234567':
+                    end = index
+                    while end < index + 3 and data[end] in b'01234567':
+                        end += 1
+                    string.append(int(data[index:end], 8) & 0xFF)
+                    index = end - 1
+                elif char == ord('\r'):
+                    if data[index + 1:index + 2] == b'\n':
+                        index += 1
+                elif char != ord('\n'):
+                    string.append(char)
+            else:
+                if char == ord('('):
+                    depth += 1
+                elif char == ord(')'):
+                    depth -= 1
+                if depth:
+                    string.append(char)
+            index += 1
+
+        return bytes(string), index
+
+
+class PageText:
+    """This class holds the text of a page while the page filter and the crop profiles look at it, so the content
+    stream of the page is read at most once, and the text is extracted at most once."""
+
+    def __init__(self, page):
+        self.page = page
+        self._shown = False
+        self._extracted = None
+
+    @property
+    def shown(self):
+        """
+        Gets the strings drawn on the page by text operators, including strings drawn by forms.
+        :return: A list of strings, or None if they can't be read reliably.
+        """
+        if self._shown is False:
+            try:
+                strings = PageFilter._shown_strings(self.page.get('/Contents'), self.page.get('/Resources'), 0)
+            except Exception:
+                strings = None
+            self._shown = None if strings is None else [string.decode('latin-1') for string in strings]
+        return self._shown
+
+    @property
+    def extracted(self):
+        """
+        Gets the text of the page, extracting it the first time it is needed.
+        :return: The extracted text
+        """
+        if self._extracted is None:
+            with metrics.time("extract_text"):
+                self._extracted = self.page.extract_text()
+        return self._extracted
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+import collections
+
+
+class PatternSet:
+    """This class finds which of many literal patterns appear in a text, in a single pass over the text.
+
+    A few patterns are each looked for with the in operator, which is fastest for a handful. Once there are
+    AUTOMATON_PATTERNS or more, they are compiled into an Aho-Corasick automaton, so the time taken depends on the
+    length of the text and not on how many patterns there are."""
+
+    # The fewest patterns that are compiled into an automaton.
+    AUTOMATON_PATTERNS = 64
+
+    def __init__(self, patterns):
+        """
+        :param patterns: A list of literal patterns. Blank patterns are left out.
+        """
+        self.patterns = list(dict.fromkeys(pattern for pattern in patterns if pattern))
+
+        # The transitions of each state, the state each falls back to, and the patterns ending at each state.
+        self._goto = None
+        self._fail = None
+        self._output = None
+        if len(self.patterns) >= self.AUTOMATON_PATTERNS:
+            self._compile()
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def _compile(self):
+        """
+        Build the Aho-Corasick automaton: a trie of the patterns, where each state also knows the longest suffix of
+        it that is in the trie, and every pattern that ends there.
+        """
+        goto = [{}]
+        output = [()]
+        for pattern in self.patterns:
+            state = 0
+            for char in pattern:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    output.append(())
+                state = next_state
+            output[state] += (pattern,)
+
+        fail = [0] * len(goto)
+        queue = collections.deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                output[next_state] += output[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+
+    def find(self, text):
+        """
+        Finds which patterns appear in a text.
+        :param text: The text
+        :return: A set of the patterns that appear in the text
+        """
+        if self._goto is None:
+            return {pattern for pattern in self.patterns if pattern in text}
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
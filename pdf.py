@@ -1,20 +1,189 @@
 #!/usr/bin/python
-from PyPDF2 import PdfWriter, PdfReader
-import re
-import datetime
+from PyPDF2 import PageObject, PdfWriter, PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+import collections
+import hashlib
+import io
+import mmap
 import os
-import shutil
-from pathlib import Path
+import threading
+import time
+
+import functions
+from content_cropper import ContentCropper
+from metrics import metrics
+from page_filter import PageFilter, PageText
+
+
+class ReaderPool:
+    """This class keeps a bounded number of pdf readers open. Once the pool is full,
+    the least recently used reader is closed to make room for the next one.
+
+    PdfReader does many small seeks and reads while parsing, so how a pdf is opened depends on the input mode:
+    buffered reads the file as it is parsed, mmap maps the file into memory, and read loads the whole file with a
+    single read. Auto uses mmap for local files and read for files on a network filesystem, where every small read
+    is a round trip and a mapped file can be changed from another machine while it is being parsed."""
+    INPUT_MODES = ("auto", "buffered", "mmap", "read")
+
+    def __init__(self, size):
+        self.size = size
+        self._readers = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._readers)
+
+    def get(self, filename, input_mode="auto", data=None):
+        """
+        Gets an open pdf reader, opening the file if it isn't already open.
+        :param filename: The filename of the pdf
+        :param input_mode: (Optional) How the file is opened: auto, buffered, mmap or read
+        :param data: (Optional) The bytes of a pdf held in memory, to read instead of the file. The reader isn't
+            kept in the pool, as the same name can be given different data, and there is no file to keep open.
+        :return: A PdfReader
+        """
+        if data is not None:
+            return self._read(io.BytesIO(data), len(data))
+
+        with self._lock:
+            if filename in self._readers:
+                self._readers.move_to_end(filename)
+                return self._readers[filename][1]
+
+            try:
+                stream, size = self.open(filename, input_mode)
+            except OSError:
+                raise ValueError(f"Cannot find file: {filename}")
+
+            reader = self._read(stream, size)
+            self._readers[filename] = (stream, reader)
+            while len(self._readers) > self.size:
+                _, (old_stream, _) = self._readers.popitem(last=False)
+                old_stream.close()
+
+            return reader
+
+    @staticmethod
+    def _read(stream, size):
+        """
+        Parse an opened pdf.
+        :param stream: The opened pdf, which is closed if it can't be parsed
+        :param size: The size of the pdf in bytes
+        :return: A PdfReader
+        """
+        try:
+            with metrics.time("parse"):
+                reader = PdfReader(stream)
+        except Exception:
+            stream.close()
+            raise
+
+        metrics.count("bytes_read", size)
+        return reader
+
+    @staticmethod
+    def open(filename, input_mode="auto"):
+        """
+        Open a pdf file for a PdfReader.
+        :param filename: The filename of the pdf
+        :param input_mode: How the file is opened: auto, buffered, mmap or read
+        :return: The opened file, and its size in bytes
+        """
+        if input_mode not in ReaderPool.INPUT_MODES:
+            raise ValueError(f"Invalid input mode: {input_mode}. Must be one of: {', '.join(ReaderPool.INPUT_MODES)}.")
+        if input_mode == "auto":
+            input_mode = "read" if functions.is_network_path(filename) else "mmap"
+
+        if input_mode == "buffered":
+            stream = open(filename, "rb")
+            return stream, os.fstat(stream.fileno()).st_size
+
+        with open(filename, "rb", buffering=0) as raw_file:
+            if input_mode == "mmap":
+                try:
+                    # The mapping stays valid after the file is closed
+                    stream = mmap.mmap(raw_file.fileno(), 0, access=mmap.ACCESS_READ)
+                    return stream, len(stream)
+                except (OSError, ValueError):
+                    # Empty files, and filesystems that can't be mapped, are read instead
+                    pass
+            # The whole file in one read, unless the filesystem returns less than was asked for
+            size = os.fstat(raw_file.fileno()).st_size
+            data = raw_file.read(size)
+            if len(data) < size:
+                data += raw_file.readall()
+        return io.BytesIO(data), len(data)
+
+    def close(self, filename):
+        """
+        Close the reader of a pdf, if it is open.
+        :param filename: The filename of the pdf
+        """
+        with self._lock:
+            readers = self._readers.pop(filename, None)
+        if readers:
+            readers[0].close()
+
+    def close_all(self):
+        """
+        Close every open reader.
+        """
+        with self._lock:
+            readers = list(self._readers.values())
+            self._readers.clear()
+        for stream, _ in readers:
+            stream.close()
 
 
 class Pdf:
-    """This class represents a PDF file."""
-    def __init__(self, filename, filter_text, bounding_box, rotate):
+    """This class represents a PDF file. The file isn't opened until its pages are needed.
+    A pdf held in memory can be given as data, in which case the filename is only used as its name.
+
+    If there is a RuleEngine, each page is cropped with the bounding box and rotation of the first crop profile
+    it matches, and with the bounding box and rotation of the Pdf if it matches none.
+
+    Extra Outputs get a copy of each page they include, cropped their own way, so every output of a pdf is made
+    from a single parse, and the text of each page is extracted at most once.
+
+    With a DuplicateIndex, pages already processed from another pdf are counted in duplicate_pages, and left out
+    if skip_duplicates is set.
+
+    With hard crop, everything drawn outside the bounding box is also removed from each cropped page, so the new
+    pdf is smaller, instead of only being hidden by the crop box."""
+
+    # The most pdf files that are kept open at once, no matter how many Pdf objects exist.
+    MAX_OPEN_READERS = 16
+    readers = ReaderPool(MAX_OPEN_READERS)
+
+    # Page attributes that are inherited from the parent nodes of the page tree.
+    INHERITED_KEYS = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+    # Keys holding embedded font programs, which can't change the text of a page.
+    FONT_FILE_KEYS = ('/FontFile', '/FontFile2', '/FontFile3')
+
+    def __init__(self, filename, filter_text, bounding_box, rotate, text_cache=None, input_mode="auto", data=None,
+                 rules=None, outputs=None, hard_crop=False, duplicates=None, skip_duplicates=False):
+        self.input_mode = input_mode
+        self.data = data
+        # The reader of a pdf held in memory, which isn't kept in the ReaderPool
+        self._data_reader = None
         self.file = filename
-        self.filename = filename
         self.filter_text = filter_text
         self.bounding_box = bounding_box
         self.rotate = rotate
+        self.text_cache = text_cache
+        self.page_filter = PageFilter(filter_text) if filter_text else None
+        self.rules = rules
+        self.outputs = outputs or []
+        # The pages of each extra output, keyed by output name
+        self.output_pages = {}
+        self.hard_crop = hard_crop
+        # The ContentCropper of each bounding box, keyed by the bounding box
+        self._content_croppers = {}
+        # Pages already processed from another pdf are found in the DuplicateIndex
+        self.duplicates = duplicates
+        self.skip_duplicates = skip_duplicates
+        self.duplicate_pages = 0
 
         self.pages = 0
         self.new_pages = 0
@@ -22,107 +191,385 @@ class Pdf:
     def __str__(self):
         return self.filename
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     @property
     def file(self):
         """
-        Gets the pdf file object
+        Gets the pdf file object. The file is opened the first time it is needed.
         :return: The pdf file object
         """
-        return self._filename
+        if self.data is None:
+            return self.readers.get(self.filename, self.input_mode)
+        if self._data_reader is None:
+            self._data_reader = self.readers.get(self.filename, self.input_mode, self.data)
+        return self._data_reader
 
     @file.setter
     def file(self, new_filename):
         """
-        Sets the filename of the pdf and creates a pdf object
+        Sets the filename of the pdf. The file is not opened until it is needed.
         :param new_filename: The filename of the pdf
         """
         if new_filename:
-            try:
-                self._filename = PdfReader(open(new_filename, "rb"))
-            except OSError:
-                raise ValueError(f"Cannot find file: {self.file}")
+            if getattr(self, "filename", None):
+                self.close()
+            self.filename = new_filename
         else:
             raise ValueError("PDF filename cannot be blank.")
 
-    def processed_file(self, file_suffix):
+    def close(self):
         """
-        The pdf file is cropped, rotated, and text filtered. A new file is created.
-        :param file_suffix: The suffix added to the end of the new file.
-        :return: A string of the new filename.
+        Close the pdf file if it is open.
+        """
+        self._data_reader = None
+        self.readers.close(self.filename)
+
+    def filtered(self, page, page_text=None):
+        """
+        Checks if the filter text appears in a page. Verdicts are looked up in the text cache first, if there is one.
+        :param page: A page
+        :param page_text: (Optional) The PageText of the page, if it is shared with the crop profiles
+        :return: True if the filter text appears in the page.
+        """
+        if not self.filter_text:
+            return False
+
+        key = None
+        if self.text_cache is not None:
+            key = self.text_cache.key(self.page_hash(page, text_only=True), self.filter_text)
+            verdict = self.text_cache.get(key)
+            if verdict is not None:
+                metrics.count("text_cache_hits")
+                return verdict
+            metrics.count("text_cache_misses")
+
+        verdict = self.page_filter.matches(page, page_text)
+
+        if key is not None:
+            self.text_cache.set(key, verdict)
+
+        return verdict
+
+    @classmethod
+    def page_hash(cls, page, text_only=False):
+        """
+        Gets a hash of a page's content stream and resources, so the same page has the same hash in any file.
+        :param page: A page
+        :param text_only: Leave out image and embedded font data, which can't change the text of the page.
+        :return: A hex digest of the page
         """
-        processed_file = PdfWriter()
+        digest = hashlib.sha256()
+
+        # Resources can be inherited from the parent page tree
+        resources_holder = page
+        while '/Resources' not in resources_holder and '/Parent' in resources_holder:
+            resources_holder = resources_holder['/Parent'].get_object()
+
+        cls._update_digest(digest, page.get('/Contents'), text_only, set())
+        cls._update_digest(digest, resources_holder.get('/Resources'), text_only, set())
+
+        return digest.hexdigest()
+
+    @classmethod
+    def _update_digest(cls, digest, pdf_object, text_only, seen):
+        """
+        Add a pdf object and everything it refers to, to a hash.
+        :param digest: A hashlib hash
+        :param pdf_object: A pdf object
+        :param text_only: Leave out image and embedded font data
+        :param seen: The indirect objects already added, to stop at reference loops
+        """
+        if isinstance(pdf_object, IndirectObject):
+            reference = (id(pdf_object.pdf), pdf_object.idnum)
+            if reference in seen:
+                digest.update(b"R")
+                return
+            seen.add(reference)
+            pdf_object = pdf_object.get_object()
+
+        if isinstance(pdf_object, DictionaryObject):
+            digest.update(b"<<")
+            for key in sorted(pdf_object):
+                if key == '/Parent':
+                    continue
+                digest.update(key.encode())
+                if text_only and key in cls.FONT_FILE_KEYS:
+                    continue
+                cls._update_digest(digest, pdf_object.raw_get(key), text_only, seen)
+            digest.update(b">>")
+            if isinstance(pdf_object, StreamObject):
+                if not (text_only and pdf_object.get('/Subtype') == '/Image'):
+                    digest.update(pdf_object._data)
+        elif isinstance(pdf_object, ArrayObject):
+            digest.update(b"[")
+            for item in pdf_object:
+                cls._update_digest(digest, item, text_only, seen)
+            digest.update(b"]")
+        else:
+            digest.update(repr(pdf_object).encode())
+
+    def page_count(self):
+        """
+        Gets the number of pages from the page tree, without reading every page.
+        :return: The number of pages
+        """
+        return int(self.file.trailer['/Root']['/Pages']['/Count'])
+
+    def filter_verdicts(self, page_range):
+        """
+        Checks a range of pages for the filter text.
+        :param page_range: The (start, end) page numbers, from 0, end not included
+        :return: A dictionary of True if the filter text appears in a page and False if not, keyed by the page's
+        object number.
+        """
+        verdicts = {}
+        for page in self.pages_in_range(page_range):
+            with metrics.time("filter"):
+                verdicts[page.indirect_reference.idnum] = self.filtered(page)
+        return verdicts
+
+    def pages_in_range(self, page_range):
+        """
+        Gets a range of pages by walking down the page tree. Unlike self.file.pages, pages outside the range
+        are usually not read, which matters when each worker process only needs a shard of a huge pdf.
+        :param page_range: The (start, end) page numbers, from 0, end not included
+        :return: A generator of pages
+        """
+        start, end = page_range
+        root = self.file.trailer['/Root'].raw_get('/Pages')
+        yield from self._walk_page_tree(root, start, end, [0], {})
+
+    def _walk_page_tree(self, reference, start, end, position, inherited):
+        """
+        Gets the pages under a node of the page tree that are in a range.
+        :param reference: An indirect reference to a node of the page tree
+        :param start: The first page number
+        :param end: The page number after the last page
+        :param position: A list holding the page number of the next page in the tree
+        :param inherited: Attributes the node inherits from its parents, ie: /Resources
+        :return: A generator of pages
+        """
+        node = reference.get_object()
+        if node.get('/Type') != '/Pages' and '/Kids' not in node:
+            page = PageObject(self.file, reference)
+            page.update(node)
+            for key, value in inherited.items():
+                if key not in page:
+                    page[NameObject(key)] = value
+            position[0] += 1
+            yield page
+            return
+
+        inherited = dict(inherited, **{key: node.raw_get(key) for key in self.INHERITED_KEYS if key in node})
+        kids = node['/Kids']
+
+        # When there are as many kids as pages, every kid is a page and kids before the range aren't read.
+        all_pages = len(kids) == node.get('/Count')
+        for kid in kids:
+            if position[0] >= end:
+                return
+            if all_pages:
+                count = 1
+            else:
+                kid_node = kid.get_object()
+                count = int(kid_node.get('/Count', 1)) if '/Kids' in kid_node else 1
+            if position[0] + count <= start:
+                position[0] += count
+                continue
+            yield from self._walk_page_tree(kid, start, end, position, inherited)
+
+    def processed_pages(self, verdicts=None):
+        """
+        The pdf pages are cropped, rotated, and text filtered.
+        :param verdicts: (Optional) A dictionary of whether the filter text appears in each page, keyed by the page's
+        object number, for pages already checked in other processes
+        :return: A list of the processed pages.
+        """
+        processed_pages = []
         self.pages = len(self.file.pages)
+        profiles = self.rules.file_profiles(self.filename) if self.rules else []
+        self.output_pages = {output.name: [] for output in self.outputs}
+        self.duplicate_pages = 0
 
         for i in range(self.pages):
             page = self.file.pages[i]
+            # The page filter and the crop profiles share the text of the page
+            page_text = PageText(page)
 
             # Skip page if filtered text appears in that page.
-            if self.filter_text:
-                text_result = page.extract_text()
-                if re.search(self.filter_text, text_result):
-                    continue
+            filtered = None
+            if verdicts and page.indirect_reference is not None:
+                filtered = verdicts.get(page.indirect_reference.idnum)
+            if filtered is None:
+                with metrics.time("filter"):
+                    filtered = self.filtered(page, page_text)
+            if filtered:
+                metrics.count("pages_filtered")
+                self._add_to_outputs(page, False)
+                continue
 
-            # trim the PDF
-            page.trimbox.lower_left = (self.bounding_box[0], self.bounding_box[2])
-            page.trimbox.upper_right = (self.bounding_box[1], self.bounding_box[3])
-            page.cropbox.lower_left = (self.bounding_box[0], self.bounding_box[2])
-            page.cropbox.upper_right = (self.bounding_box[1], self.bounding_box[3])
+            bounding_box = self.bounding_box
+            rotate = self.rotate
+            if profiles:
+                with metrics.time("classify"):
+                    profile = self.rules.classify(page, profiles, page_text)
+                if profile is not None:
+                    if profile.skip:
+                        metrics.count("pages_filtered")
+                        self._add_to_outputs(page, False)
+                        continue
+                    if profile.bounding_box is not None:
+                        bounding_box = profile.bounding_box
+                    if profile.rotate is not None:
+                        rotate = profile.rotate
 
-            # If Portrait, rotate to Landscape
-            if self.rotate:
-                if page.mediabox.right - page.mediabox.left > \
-                        page.mediabox.top - page.mediabox.bottom:
-                    page.rotate(90)
+            if self.duplicates is not None:
+                with metrics.time("duplicates"):
+                    original = self.duplicates.page_original(self.page_hash(page), self.filename)
+                if original is not None:
+                    metrics.count("pages_duplicate")
+                    self.duplicate_pages += 1
+                    if self.skip_duplicates:
+                        continue
 
-            processed_file.add_page(page)
+            # Outputs copy the page before it is cropped
+            self._add_to_outputs(page, True)
 
-        # Create new file
-        new_filename = self.filename.replace(".pdf", "-" + file_suffix + ".pdf")
-        output_stream = open(new_filename, "wb")
+            crop_start_time = time.perf_counter()
+            self.crop_page(page, bounding_box, rotate)
+            metrics.add_time("crop", time.perf_counter() - crop_start_time)
+            self.hard_crop_page(page, bounding_box)
+            processed_pages.append(page)
 
-        processed_file.write(output_stream)
-        self.new_pages = len(processed_file.pages)
-        output_stream.close()
+        self.new_pages = len(processed_pages)
+        metrics.count("pages_read", self.pages)
+        metrics.count("pages_processed", self.new_pages)
 
-        return new_filename
+        return processed_pages
 
-    def archive(self, archived_directory, input_directory, archive_by_month):
+    @staticmethod
+    def crop_page(page, bounding_box, rotate):
         """
-        put the PDF in a subdirectory with the option of a further subdirectory broken down by month (ie: 2022-08).
-        :param archived_directory: The name of the archive directory
-        :param input_directory: The input directory where the processed pdf files are located.
-        :param archive_by_month: Is it archived by month?
-        :return: a string of the archived filename's absolute path
+        Crop a page, and rotate it if it is Portrait.
+        :param page: A page
+        :param bounding_box: The bounding box used for cropping
+        :param rotate: Rotate Portrait to Landscape
         """
-        if not archived_directory.endswith('/'):
-            archived_directory += '/'
+        # trim the PDF
+        page.trimbox.lower_left = (bounding_box[0], bounding_box[2])
+        page.trimbox.upper_right = (bounding_box[1], bounding_box[3])
+        page.cropbox.lower_left = (bounding_box[0], bounding_box[2])
+        page.cropbox.upper_right = (bounding_box[1], bounding_box[3])
 
-        if archive_by_month:
-            now = datetime.datetime.now()
-            now_append = f'{now.year}-{now.month:02d}/'
-            archived_directory += now_append
+        # If Portrait, rotate to Landscape
+        if rotate:
+            if page.mediabox.right - page.mediabox.left > \
+                    page.mediabox.top - page.mediabox.bottom:
+                page.rotate(90)
 
-        # Make sure the archive folder ends with a / but does not begin with a /
-        if archived_directory.startswith('/'):
-            archived_directory = archived_directory[1:]
-        if not input_directory.endswith('/'):
-            input_directory += '/'
+    def hard_crop_page(self, page, bounding_box):
+        """
+        Remove everything drawn outside the bounding box from a page, if hard crop is on.
+        :param page: A page
+        :param bounding_box: The bounding box used for cropping
+        """
+        if not self.hard_crop:
+            return
+        key = tuple(bounding_box)
+        if key not in self._content_croppers:
+            self._content_croppers[key] = ContentCropper(bounding_box)
+        self._content_croppers[key].crop(page)
 
-        pdf_archived_path = input_directory + archived_directory
+    def _add_to_outputs(self, page, kept):
+        """
+        Add a copy of a page to every extra output that includes it. The page itself isn't changed.
+        :param page: A page
+        :param kept: True if the page is cropped, False if it is filtered out
+        """
+        for output in self.outputs:
+            if not output.includes(kept):
+                continue
 
-        # Create the directory if it doesn't exist
-        if not os.path.exists(pdf_archived_path):
-            Path(pdf_archived_path).mkdir(parents=True, exist_ok=True)
+            # A new page dictionary sharing the contents and resources of the page
+            output_page = PageObject(page.pdf, page.indirect_reference)
+            output_page.update(page)
+            if output.bounding_box is not None:
+                self.crop_page(output_page, output.bounding_box, output.rotate)
+                self.hard_crop_page(output_page, output.bounding_box)
+            self.output_pages[output.name].append(output_page)
+            metrics.count("pages_output")
 
-        # Move the pdf to the new directory
-        pdf_archived_path_file = self.filename.replace(input_directory,input_directory + archived_directory)
-        shutil.move(self.filename, pdf_archived_path_file)
+    def new_filename(self, file_suffix):
+        """
+        Gets the filename of a new file made from the pdf.
+        :param file_suffix: The suffix added to the end of the new file.
+        :return: A string of the new filename, ie: label-crop.pdf
+        """
+        return self.filename.replace(".pdf", "-" + file_suffix + ".pdf")
 
-        return pdf_archived_path_file
+    def processed_file(self, file_suffix, pages=None):
+        """
+        The pdf file is cropped, rotated, and text filtered. A new file is created.
+        :param file_suffix: The suffix added to the end of the new file.
+        :param pages: (Optional) Pages already returned by processed_pages, so they are not processed twice
+        :return: A string of the new filename.
+        """
+        if pages is None:
+            pages = self.processed_pages()
 
-    @staticmethod
-    def merge(merged_pdf, input_filename):
-        merged_pdf.append(open(input_filename, "rb"))
+        # Create new file
+        new_filename = self.new_filename(file_suffix)
+        with open(new_filename, "wb") as output_stream:
+            self.write_pages(pages, output_stream)
+
+        return new_filename
+
+    def output_files(self):
+        """
+        Write the pages of each extra output, from processed_pages, to a new file. Outputs without pages aren't
+        written.
+        :return: A dictionary of the new filenames, keyed by output name
+        """
+        filenames = {}
+        for output in self.outputs:
+            pages = self.output_pages.get(output.name)
+            if not pages:
+                continue
+            filenames[output.name] = self.new_filename(output.suffix)
+            with open(filenames[output.name], "wb") as output_stream:
+                self.write_pages(pages, output_stream)
+        return filenames
+
+    def processed_bytes(self, pages=None):
+        """
+        The pdf file is cropped, rotated, and text filtered, without creating a new file.
+        :param pages: (Optional) Pages already returned by processed_pages, so they are not processed twice
+        :return: The bytes of the processed pdf
+        """
+        if pages is None:
+            pages = self.processed_pages()
+
+        output_stream = io.BytesIO()
+        self.write_pages(pages, output_stream)
+
+        return output_stream.getvalue()
 
-        # delete the temporary individual file.
-        os.remove(input_filename)
+    @staticmethod
+    def write_pages(pages, output_stream):
+        """
+        Write pages to a new pdf.
+        :param pages: A list of pages
+        :param output_stream: A binary stream the pdf is written to
+        """
+        with metrics.time("write"):
+            processed_file = PdfWriter()
+            for page in pages:
+                processed_file.add_page(page)
+            start_position = output_stream.tell()
+            processed_file.write(output_stream)
+        metrics.count("bytes_written", output_stream.tell() - start_position)
@@ -1,13 +1,134 @@
 #!/usr/bin/python
 
 import sys
-import time
 import functions
 
-from PyPDF2 import PdfMerger
-
 from config import Config
-from pdf import Pdf
+
+# Starting up is most of the time taken to crop a single pdf, so the batch runner (and the pdf library), the server
+# and the watcher are only imported once they are needed.
+
+
+def process_pdfs(runner, pdfs=None, merge=True):
+    """
+    Process pdfs (in parallel if more than one worker), then merge (if option enabled) and archive.
+    :param runner: The BatchRunner
+    :param pdfs: (Optional) A list of pdf filenames. Defaults to the pdfs in the input directory, which are processed
+    as they are found.
+    :param merge: Merge the pdfs, if the merge option is enabled
+    :return: The number of pdfs that failed to process
+    """
+    config = runner.config
+
+    # Pdfs are archived in batches, so where each one was archived to is printed at the end.
+    processed_pdfs = []
+    for pdf in runner.run(pdfs, merge):
+        if config.verbose:
+            print(f"Converting: {pdf.filename}")
+
+        if not pdf.ok:
+            print(f"Failed: {pdf.filename} ({pdf.error})\n")
+            continue
+
+        if config.verbose:
+            processed_pdfs.append(pdf)
+            for name, filename in pdf.outputs.items():
+                print(f"Output {name}: {filename}")
+            print(f"Processed: Input has {pdf.pages} page{functions.plural(pdf.pages)}, "
+                  f"output has {pdf.new_pages} page{functions.plural(pdf.new_pages)}.\n")
+
+    # Pdfs that haven't changed since they were processed with the same settings are skipped.
+    if runner.skipped and config.verbose:
+        print(f"Skipped: {runner.skipped} unchanged PDF file{functions.plural(runner.skipped)} already processed.\n")
+    # In coordinated mode, pdfs claimed by other stations are left to them.
+    if runner.busy and config.verbose:
+        print(f"Skipped: {len(runner.busy)} PDF file{functions.plural(len(runner.busy))} being processed by "
+              f"another station.\n")
+    # Labels exported again under another filename are reported, or left out if duplicates is skip.
+    if config.verbose:
+        for filename, original in runner.duplicates:
+            print(f"Duplicate: {filename} (same as {original})")
+    if runner.duplicates or runner.duplicate_pages:
+        files, pages = len(runner.duplicates), runner.duplicate_pages
+        print(f"{'Skipped' if config.duplicates == 'skip' else 'Duplicates'}: {files} PDF file{functions.plural(files)} "
+              f"and {pages} page{functions.plural(pages)} already processed under another filename.\n")
+    if not runner.processed and not runner.failed:
+        already_processed = runner.skipped or runner.duplicates
+        print("There are no new PDFs to process." if already_processed else "There are no PDFs to process.")
+        return 0
+
+    if config.verbose:
+        for pdf in processed_pdfs:
+            if pdf.archived_filename:
+                print(f"Archived To: {pdf.archived_filename}")
+    for filename, error in runner.archive_errors.items():
+        print(f"Failed to archive: {filename} ({error})")
+
+    processed = runner.processed
+    merged_pdf = runner.merged_pdf
+    if merged_pdf is not None:
+        if config.verbose:
+            if merged_pdf.split:
+                print(f"Merged: {processed} PDF file{functions.plural(processed)} to {merged_pdf.pages} "
+                      f"page{functions.plural(merged_pdf.pages)} in {len(merged_pdf.volumes)} "
+                      f"volume{functions.plural(len(merged_pdf.volumes))}: {', '.join(merged_pdf.volumes)}")
+            else:
+                print(f"Merged: {processed} PDF file{functions.plural(processed)} to a {merged_pdf.pages} "
+                      f"page PDF in {runner.merge_filepath}")
+
+        if merged_pdf.deduplicated:
+            print(f"Deduplicated: {merged_pdf.deduplicated} shared resource{functions.plural(merged_pdf.deduplicated)} "
+                  f"stored once, saving {functions.file_size(merged_pdf.bytes_saved)}.")
+
+    print(f"Success! {processed} PDF file{functions.plural(processed)} (totalling {runner.input_pages} "
+          f"page{functions.plural(runner.input_pages)}) in {round(runner.seconds,2)} seconds.")
+
+    if runner.failed:
+        print(f"Failed to process {runner.failed} PDF file{functions.plural(runner.failed)}.")
+
+    return runner.failed
+
+
+def watch(runner):
+    """
+    Keep watching the input directory, and process each new pdf on its own once it has been fully written.
+    :param runner: The BatchRunner
+    """
+    from watcher import Watcher
+
+    config = runner.config
+    watcher = Watcher(config.directory, config.output_filename, runner.suffixes, config.watch_interval,
+                      runner.scan_pdfs)
+
+    if config.merge:
+        print("Merging is not available in watch mode, each PDF is processed on its own.")
+
+    print(f"Watching {config.directory} for new PDFs. Press Ctrl+C to stop.")
+    try:
+        for pdfs in watcher.watch():
+            for pdf in pdfs:
+                process_pdfs(runner, [pdf], False)
+                # A pdf another station was processing is checked again, in case that station stops
+                watcher.retry(runner.busy)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
+def serve(config):
+    """
+    Keep running as a crop server on localhost, until stopped.
+    :param config: The Config
+    """
+    from server import CropServer
+
+    server = CropServer(config)
+    print(f"Serving at {server.url}. POST a PDF to /crop to crop it. Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped serving.")
+    finally:
+        server.server_close()
 
 
 if __name__ == '__main__':
@@ -18,63 +139,23 @@ if __name__ == '__main__':
         print(ex)
         sys.exit(1)
 
-    # start timer to determine how long the batch process takes
-    start_time = time.time()
-
     if config.verbose:
         print("-----------------------------------------------")
         print("                 PDF BATCH CROP                ")
         print("-----------------------------------------------")
 
-    pdfs = []
-
-    # Get all PDFs from the input directory, except the processed pdf
-    file_list = functions.get_all_pdfs(config.directory, config.output_filename)
-    for file in file_list:
-        pdf = Pdf(file, config.filter, config.bounding_box, config.rotate)
-        pdfs.append(pdf)
-
-    # Get singular PDF file
-    if config.input_filename:
-        pdf = Pdf(config.input_filename, config.filter, config.bounding_box, config.rotate)
-        pdfs.append(pdf)
-
-    if len(pdfs) != 0:
-        # create PDF merger that will contain processed the PDFs
-        pdf_merger = PdfMerger()
-
-        # Process the pdfs, then merge (if option enabled) and archive.
-        merged_pages = 0
-        input_pages = 0
-        for pdf in pdfs:
-            new_pdf_file = pdf.processed_file(config.suffix)
-            input_pages += pdf.pages
-
-            if config.verbose:
-                print(f"Converting: {pdf.filename}")
-
-            if config.merge:
-                pdf.merge(pdf_merger, new_pdf_file)
-                merged_pages += pdf.new_pages
-
-            if config.archive:
-                archived_file = pdf.archive(config.archived_directory, config.directory, config.archive_by_month)
-                if config.verbose:
-                    print(f"Archived To: {archived_file}")
-
-            if config.verbose:
-                print(f"Processed: Input has {pdf.pages} page{functions.plural(pdf.pages)}, "
-                      f"output has {pdf.new_pages} page{functions.plural(pdf.new_pages)}.\n")
-
-        # Write the pdf merger to a new PDF file.
-        if config.merge:
-            merge_filepath = config.directory + config.output_filename
-            pdf_merger.write(open(merge_filepath, "wb"))
-            if config.verbose:
-                print(f"Merged: {len(pdfs)} PDF file{functions.plural(len(pdfs))} to a {merged_pages} "
-                      f"page PDF in {merge_filepath}")
-
-        print(f"Success! {len(pdfs)} PDF file{functions.plural(len(pdfs))} (totalling {input_pages} "
-              f"page{functions.plural(input_pages)}) in {round(time.time() - start_time,2)} seconds.")
-    else:
-        print("There are no PDFs to process.")
+    if config.serve:
+        serve(config)
+        sys.exit(0)
+
+    from batch_runner import BatchRunner
+
+    runner = BatchRunner(config)
+
+    if config.watch:
+        watch(runner)
+        sys.exit(0)
+
+    # Process the PDFs in the input directory as they are found, except the processed pdfs, and the singular PDF file
+    if process_pdfs(runner):
+        sys.exit(1)
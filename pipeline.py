@@ -0,0 +1,165 @@
+#!/usr/bin/python
+import queue
+import threading
+
+from metrics import metrics
+
+
+class _ReadError:
+    """An exception raised while finding the items of a Pipeline, passed on to be raised once the items before it
+    are written."""
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class _WriteError:
+    """An exception raised while writing an item of a Pipeline, passed on to be raised in place of its result."""
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class Pipeline:
+    """This class runs items through three stages at once: a read stage on its own thread, a process stage on the
+    calling thread, and a write stage on its own thread. While one item is processed, the next items are read and
+    the items before it are written, so the processing stage doesn't wait for the disk or a synced folder.
+
+    The stages are joined by bounded queues, so reading never gets more than depth items ahead, and memory stays
+    the same however many items there are. Results are yielded in the same order as the items.
+
+    The depth of each queue is sampled as the process stage takes an item and hands it on, and the time it waits
+    on each queue is timed. A read queue that is usually empty means reading is the slowest stage, and a write
+    queue that is usually full means writing is."""
+
+    # Sent down a queue after the last item.
+    _END = object()
+
+    # Seconds between checks for the pipeline being stopped, while a stage waits on a full queue.
+    STOP_INTERVAL = 0.1
+
+    def __init__(self, read, process, write, depth):
+        """
+        :param read: A function reading an item, run on the read thread. It shouldn't raise exceptions.
+        :param process: A function processing what was read, run on the calling thread
+        :param write: A function writing what was processed and returning the result, run on the write thread.
+        It shouldn't raise exceptions, but one that does is raised by run in place of the item's result.
+        :param depth: The most items waiting in each queue
+        """
+        self.read = read
+        self.process = process
+        self.write = write
+        self.depth = depth
+
+    def run(self, items):
+        """
+        Run items through the pipeline.
+        :param items: A list or generator of items. A generator is run on the read thread.
+        :return: A generator of the results of the write stage, one per item, in the same order as the items.
+        An exception raised by a generator of items is raised once the items before it are written, and an
+        exception raised while writing an item is raised in place of its result.
+        """
+        read_queue = queue.Queue(self.depth)
+        write_queue = queue.Queue(self.depth)
+        written_queue = queue.Queue()
+        stopped = threading.Event()
+        error = None
+
+        threading.Thread(target=self._read_all, args=(items, read_queue, stopped), name="pipeline-read",
+                         daemon=True).start()
+        threading.Thread(target=self._write_all, args=(write_queue, written_queue), name="pipeline-write",
+                         daemon=True).start()
+
+        try:
+            while True:
+                with metrics.time("pipeline_wait_read"):
+                    item = read_queue.get()
+                metrics.add_depth("read", read_queue.qsize())
+                if item is self._END:
+                    break
+                if isinstance(item, _ReadError):
+                    error = item.exception
+                    break
+
+                processed = self.process(item)
+                with metrics.time("pipeline_wait_write"):
+                    write_queue.put(processed)
+                metrics.add_depth("write", write_queue.qsize())
+
+                yield from self._written(written_queue, False)
+        finally:
+            # Items already processed are still written if the pipeline is stopped early
+            stopped.set()
+            write_queue.put(self._END)
+
+        yield from self._written(written_queue, True)
+        # Items found before the error are finished first
+        if error is not None:
+            raise error
+
+    def _read_all(self, items, read_queue, stopped):
+        """
+        The read stage: read every item, until the pipeline is stopped.
+        :param items: A list or generator of items
+        :param read_queue: The queue to the process stage
+        :param stopped: An Event set when the pipeline is stopped
+        """
+        try:
+            for item in items:
+                if not self._put(read_queue, self.read(item), stopped):
+                    return
+        except Exception as ex:
+            self._put(read_queue, _ReadError(ex), stopped)
+            return
+        self._put(read_queue, self._END, stopped)
+
+    def _write_all(self, write_queue, written_queue):
+        """
+        The write stage: write every processed item, until the last one.
+        :param write_queue: The queue from the process stage
+        :param written_queue: The queue of results
+        """
+        try:
+            while True:
+                item = write_queue.get()
+                if item is self._END:
+                    break
+                # The process stage waits on a full write queue, so items are still taken after one fails
+                try:
+                    written_queue.put(self.write(item))
+                except Exception as ex:
+                    written_queue.put(_WriteError(ex))
+        finally:
+            written_queue.put(self._END)
+
+    def _put(self, item_queue, item, stopped):
+        """
+        Add an item to a full queue once there is room, unless the pipeline is stopped first.
+        :param item_queue: The queue
+        :param item: The item
+        :param stopped: An Event set when the pipeline is stopped
+        :return: True if the item was added, False if the pipeline was stopped
+        """
+        while not stopped.is_set():
+            try:
+                item_queue.put(item, timeout=self.STOP_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _written(self, written_queue, wait):
+        """
+        Gets the results of the write stage.
+        :param written_queue: The queue of results
+        :param wait: Wait for every result, until the last one. Otherwise only results already written are returned.
+        :return: A generator of results
+        """
+        while True:
+            try:
+                result = written_queue.get(block=wait)
+            except queue.Empty:
+                return
+            if result is self._END:
+                return
+            if isinstance(result, _WriteError):
+                raise result.exception
+            yield result
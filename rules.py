@@ -0,0 +1,178 @@
+#!/usr/bin/python
+import fnmatch
+import os
+import re
+
+from metrics import metrics
+from pattern_set import PatternSet
+
+
+class Profile:
+    """This class is a crop profile: which pages it applies to, and how they are cropped. A page matches a profile
+    when it meets every condition the profile has, so a profile without conditions matches every page."""
+
+    # How far, in points, a page's size can be from the page size of a profile and still match.
+    PAGE_SIZE_TOLERANCE = 1.0
+
+    def __init__(self, name, texts=(), regex="", page_size=None, filenames=(), bounding_box=None, rotate=None,
+                 skip=False):
+        """
+        :param name: The name of the profile, ie: ups
+        :param texts: (Optional) A list of texts. A page matches if any of them appear in it.
+        :param regex: (Optional) A regular expression that must be found in the text of a page
+        :param page_size: (Optional) The (width, height) of a page in points, in either orientation
+        :param filenames: (Optional) A list of globs. A pdf matches if its filename matches any of them.
+        :param bounding_box: (Optional) The bounding box used for cropping. If None, the default bounding box is used.
+        :param rotate: (Optional) Rotate Portrait to Landscape. If None, the default rotate setting is used.
+        :param skip: Leave matching pages out, like pages containing the filter text
+        """
+        self.name = name
+        self.texts = [text for text in texts if text]
+        self.regex = regex
+        self.pattern = re.compile(regex) if regex else None
+        self.page_size = page_size
+        self.filenames = list(filenames)
+        self.bounding_box = bounding_box
+        self.rotate = rotate
+        self.skip = skip
+
+    def __str__(self):
+        return self.name
+
+    def settings(self):
+        """
+        Gets the settings of the profile, ie: for the manifest fingerprint.
+        :return: A dictionary of the settings
+        """
+        return {"name": self.name, "texts": self.texts, "regex": self.regex, "page_size": self.page_size,
+                "filenames": self.filenames, "bounding_box": self.bounding_box, "rotate": self.rotate,
+                "skip": self.skip}
+
+    def matches_filename(self, filename):
+        """
+        Checks if a pdf's filename matches the profile.
+        :param filename: The filename of the pdf
+        :return: True if the profile has no filename globs, or the filename matches one of them
+        """
+        if not self.filenames:
+            return True
+        name = os.path.basename(filename)
+        return any(fnmatch.fnmatchcase(name, glob_pattern) for glob_pattern in self.filenames)
+
+    def matches_page_size(self, page):
+        """
+        Checks if a page's size matches the profile.
+        :param page: A page
+        :return: True if the profile has no page size, or the page is that size in either orientation
+        """
+        if self.page_size is None:
+            return True
+        size = sorted((abs(float(page.mediabox.width)), abs(float(page.mediabox.height))))
+        return all(abs(actual - expected) <= self.PAGE_SIZE_TOLERANCE
+                   for actual, expected in zip(size, sorted(self.page_size)))
+
+
+class RuleEngine:
+    """This class chooses the crop profile of each page. Profiles are tried in order, and the first one that
+    matches is used. A page that matches no profile is cropped with the default settings.
+
+    The texts of every profile are compiled once into a single PatternSet, so the text of a page is searched once
+    however many profiles there are. Like the PageFilter, the strings drawn on the page are searched first, and
+    the text is only extracted when they can't decide."""
+
+    def __init__(self, profiles):
+        """
+        :param profiles: A list of Profile, in the order they are tried
+        """
+        self.profiles = list(profiles)
+        self.patterns = PatternSet([text for profile in self.profiles for text in profile.texts])
+
+        # Text extraction adds whitespace between the strings drawn on a page, so texts are also looked for
+        # without whitespace in all the strings joined together.
+        self._unstripped = {}
+        for text in self.patterns.patterns:
+            self._unstripped.setdefault("".join(text.split()), []).append(text)
+        self.stripped_patterns = PatternSet(self._unstripped)
+
+        # The drawn strings are only the same as the extracted text for ascii characters.
+        self.scannable = all(text.isascii() for text in self.patterns.patterns)
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def settings(self):
+        """
+        Gets the settings of every profile, ie: for the manifest fingerprint.
+        :return: A list of dictionaries of settings
+        """
+        return [profile.settings() for profile in self.profiles]
+
+    def file_profiles(self, filename):
+        """
+        Gets the profiles that can match the pages of a pdf, so filename globs are only checked once per pdf.
+        :param filename: The filename of the pdf
+        :return: A list of Profile
+        """
+        return [profile for profile in self.profiles if profile.matches_filename(filename)]
+
+    def classify(self, page, profiles, page_text):
+        """
+        Chooses the profile of a page.
+        :param page: A page
+        :param profiles: The profiles that can match, from file_profiles
+        :param page_text: The PageText of the page
+        :return: The first Profile that matches the page, or None if none do
+        """
+        found = None
+        for profile in profiles:
+            if not profile.matches_page_size(page):
+                continue
+
+            if profile.texts:
+                if found is None:
+                    found = self._find_texts(page_text)
+                present, undecided = found
+                if not present.intersection(profile.texts):
+                    if not undecided.intersection(profile.texts):
+                        continue
+                    found = (self._extracted_texts(page_text), set())
+                    if not found[0].intersection(profile.texts):
+                        continue
+
+            if profile.pattern is not None:
+                text = "" if page_text.shown == [] else page_text.extracted
+                if profile.pattern.search(text) is None:
+                    continue
+
+            metrics.count("pages_profile_" + profile.name)
+            return profile
+
+        return None
+
+    def _find_texts(self, page_text):
+        """
+        Finds which texts appear in a page from the strings drawn on it, extracting the text if they can't be read.
+        A text inside a single string appears in the page, and a text that isn't in all the strings joined
+        together, ignoring whitespace, doesn't. Any other text might appear, and needs the text extracted.
+        :param page_text: The PageText of the page
+        :return: A set of the texts that appear in the page, and a set of the texts that might
+        """
+        strings = page_text.shown
+        if strings is None or not self.scannable:
+            return self._extracted_texts(page_text), set()
+
+        metrics.count("pages_rules_scanned")
+        present = self.patterns.find("\n".join(strings))
+        undecided = set()
+        for stripped in self.stripped_patterns.find("".join("".join(strings).split())):
+            undecided.update(self._unstripped[stripped])
+        return present, undecided - present
+
+    def _extracted_texts(self, page_text):
+        """
+        Finds which texts appear in the extracted text of a page.
+        :param page_text: The PageText of the page
+        :return: A set of the texts that appear in the page
+        """
+        metrics.count("pages_rules_extracted")
+        return self.patterns.find(page_text.extracted)
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+from PyPDF2 import PageObject, PdfWriter
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+import os
+import random
+
+
+# 8.5" x 11" in points
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+
+FILTER_TEXT = "Commercial Invoice"
+
+# The bounding box of the label on a label page, in the order of the bounding box argument
+LABEL_BOUNDING_BOX = [30.0, 345.0, 520.0, 770.0]
+
+# Printing instructions below the label on a full label sheet
+INSTRUCTIONS = ["Printing Instructions:",
+                "1. Use the Print button on this page to print your label to your laser or inkjet printer.",
+                "2. Fold the printed page along the horizontal line.",
+                "3. Place label in shipping pouch and affix it to your shipment so that the barcode portion of the",
+                "   label can be read and scanned.",
+                "Warning: Use only the printed original label for shipping. Using a photocopy of this label for",
+                "shipping purposes is fraudulent and could result in additional billing charges.",
+                "Limit of liability: Unless you declare a higher value, our liability for each package is limited",
+                "to the declared value or actual damages, whichever is less."]
+
+
+def _stream(data, compress=False, **entries):
+    """
+    Create a stream object.
+    :param data: The stream data
+    :param compress: Compress the data with FlateDecode
+    :param entries: Entries of the stream dictionary, without the leading /
+    :return: A stream object
+    """
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    if compress:
+        stream = stream.flate_encode()
+    for key, value in entries.items():
+        stream[NameObject("/" + key)] = value
+    return stream
+
+
+def _embedded_font():
+    """
+    Create an embedded TrueType font. Every label uses the same font, like every label from a carrier does.
+    The font program is random data, which is never rendered, but is copied like a real one.
+    :return: A font dictionary
+    """
+    font_program = random.Random("LabelSans").randbytes(24 * 1024)
+    descriptor = DictionaryObject({
+        NameObject("/Type"): NameObject("/FontDescriptor"),
+        NameObject("/FontName"): NameObject("/LabelSans"),
+        NameObject("/Flags"): NumberObject(32),
+        NameObject("/FontBBox"): ArrayObject([NumberObject(-100), NumberObject(-200), NumberObject(1000),
+                                              NumberObject(900)]),
+        NameObject("/ItalicAngle"): NumberObject(0),
+        NameObject("/Ascent"): NumberObject(900),
+        NameObject("/Descent"): NumberObject(-200),
+        NameObject("/CapHeight"): NumberObject(700),
+        NameObject("/StemV"): NumberObject(80),
+        NameObject("/FontFile2"): _stream(font_program, True, Length1=NumberObject(len(font_program))),
+    })
+    return DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/TrueType"),
+        NameObject("/BaseFont"): NameObject("/LabelSans"),
+        NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+        NameObject("/FirstChar"): NumberObject(32),
+        NameObject("/LastChar"): NumberObject(126),
+        NameObject("/Widths"): ArrayObject([NumberObject(556)] * 95),
+        NameObject("/FontDescriptor"): descriptor,
+    })
+
+
+def _standard_font():
+    """
+    Create a standard, not embedded, font.
+    :return: A font dictionary
+    """
+    return DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    })
+
+
+def _image(width, height, pixels):
+    """
+    Create a greyscale image.
+    :param width: The width in pixels
+    :param height: The height in pixels
+    :param pixels: width * height bytes of pixel data
+    :return: An image XObject
+    """
+    return _stream(pixels, True, Type=NameObject("/XObject"), Subtype=NameObject("/Image"),
+                   Width=NumberObject(width), Height=NumberObject(height), ColorSpace=NameObject("/DeviceGray"),
+                   BitsPerComponent=NumberObject(8))
+
+
+def _logo():
+    """
+    Create the carrier logo, which is the same on every label.
+    :return: An image XObject
+    """
+    rng = random.Random("logo")
+    return _image(120, 60, bytes(rng.choice((0, 96, 255)) for _ in range(120 * 60)))
+
+
+def _advert():
+    """
+    Create the advertisement printed below the label on a full label sheet, which is the same on every sheet.
+    :return: An image XObject
+    """
+    rng = random.Random("advert")
+    return _image(400, 150, rng.randbytes(400 * 150))
+
+
+def _barcode(rng):
+    """
+    Create a barcode, which is different on every label.
+    :param rng: A random.Random
+    :return: An image XObject
+    """
+    bars = bytes(rng.choice((0, 255)) for _ in range(300))
+    return _image(300, 40, bars * 40)
+
+
+def _text(lines):
+    """
+    Create content stream operations that show lines of text.
+    :param lines: A list of (font, size, x, y, text)
+    :return: The content stream operations
+    """
+    operations = []
+    for font, size, x, y, text in lines:
+        text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        operations.append(f"BT /{font} {size} Tf {x} {y} Td ({text}) Tj ET")
+    return "\n".join(operations)
+
+
+def _label_page(rng, number, sheet=False):
+    """
+    Create a shipping label page. The label is drawn in the top left quarter of the page.
+    :param rng: A random.Random
+    :param number: The label number
+    :param sheet: Also draw what carriers print below the label on a full sheet: a fold line, printing instructions
+    and an advertisement
+    :return: A page
+    """
+    tracking = "".join(rng.choice("0123456789") for _ in range(16))
+    lines = [
+        ("F1", 14, 40, 740, "PRIORITY"),
+        ("F2", 10, 40, 720, f"Ship To: Customer {number}"),
+        ("F2", 10, 40, 706, f"{rng.randint(1, 9999)} Main Street"),
+        ("F2", 10, 40, 692, f"Springfield ON K{rng.randint(1, 9)}A {rng.randint(1, 9)}B{rng.randint(1, 9)}"),
+        ("F2", 8, 40, 560, f"Tracking {tracking}"),
+        ("F1", 8, 40, 548, f"Reference {number:06d}"),
+    ]
+    content = (f"q 120 0 0 60 200 700 cm /Logo Do Q\n"
+               f"q 300 0 0 40 40 580 cm /Barcode Do Q\n"
+               f"0 0 0 RG 1 w 30 530 m 330 530 l S\n"
+               f"{_text(lines)}")
+    xobjects = {"/Logo": _logo(), "/Barcode": _barcode(rng)}
+    if sheet:
+        instructions = [("F2", 9, 40, 360 - row * 12, line) for row, line in enumerate(INSTRUCTIONS)]
+        content += (f"\n[4 4] 0 d 0 396 m 612 396 l S [] 0 d\n"
+                    f"{_text(instructions)}\n"
+                    f"q 400 0 0 150 106 40 cm /Advert Do Q")
+        xobjects["/Advert"] = _advert()
+    return _page(content, xobjects)
+
+
+def _invoice_page(rng, number):
+    """
+    Create a commercial invoice page, which is filtered out when cropping.
+    :param rng: A random.Random
+    :param number: The label number
+    :return: A page
+    """
+    lines = [("F1", 16, 40, 740, FILTER_TEXT), ("F2", 10, 40, 712, f"Invoice for order {number:06d}")]
+    for row in range(rng.randint(3, 12)):
+        lines.append(("F2", 9, 40, 680 - row * 14,
+                      f"Item {row + 1}  Qty {rng.randint(1, 5)}  Value {rng.randint(1, 500)}.{rng.randint(0, 99):02d}"))
+    return _page(_text(lines), {"/Logo": _logo()})
+
+
+def _page(content, xobjects):
+    """
+    Create an 8.5" x 11" page.
+    :param content: The content stream operations
+    :param xobjects: A dictionary of XObjects used by the page
+    :return: A page
+    """
+    page = PageObject.create_blank_page(None, PAGE_WIDTH, PAGE_HEIGHT)
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/Font"): DictionaryObject({NameObject("/F1"): _standard_font(),
+                                               NameObject("/F2"): _embedded_font()}),
+        NameObject("/XObject"): DictionaryObject({NameObject(name): xobject for name, xobject in xobjects.items()}),
+    })
+    page[NameObject("/Contents")] = _stream(content.encode("latin-1"), True)
+    return page
+
+
+def make_label_pdf(filename, seed, pages=None, invoice_pages=None, sheets=False):
+    """
+    Create a label-like pdf: shipping label pages, some followed by a commercial invoice page.
+    The same filename and seed always create the same pdf.
+    :param filename: The filename of the new pdf
+    :param seed: The random seed
+    :param pages: (Optional) The number of label pages. Random from 1 to 3 if not given.
+    :param invoice_pages: (Optional) The number of commercial invoice pages. Random from 0 to 1 if not given.
+    :param sheets: (Optional) Print each label on a full sheet, with instructions and an advertisement below it
+    :return: The total number of pages
+    """
+    rng = random.Random(seed)
+    pages = rng.randint(1, 3) if pages is None else pages
+    invoice_pages = rng.randint(0, 1) if invoice_pages is None else invoice_pages
+
+    writer = PdfWriter()
+    for number in range(pages):
+        writer.add_page(_label_page(rng, seed * 10 + number, sheets))
+    for number in range(invoice_pages):
+        writer.add_page(_invoice_page(rng, seed * 10 + number))
+
+    with open(filename, "wb") as output_stream:
+        writer.write(output_stream)
+
+    return pages + invoice_pages
+
+
+def make_batch(directory, count, seed=0, sheets=False):
+    """
+    Create a batch of label-like pdfs in a directory.
+    :param directory: The directory to create the pdfs in
+    :param count: The number of pdfs
+    :param seed: The random seed of the first pdf
+    :param sheets: (Optional) Print each label on a full sheet, with instructions and an advertisement below it
+    :return: A list of the pdf filenames and the total number of pages
+    """
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    total_pages = 0
+    for number in range(count):
+        filename = os.path.join(directory, f"label-{seed + number:05d}.pdf")
+        total_pages += make_label_pdf(filename, seed + number, sheets=sheets)
+        filenames.append(filename)
+    return filenames, total_pages
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import urllib.parse
+
+import batch
+import text_cache
+from metrics import metrics
+
+
+class CropServer(HTTPServer):
+    """This class is a crop server on localhost. It keeps the PDF library loaded, so other programs can crop a
+    label by sending it in a request, without starting a new process for every label.
+
+    POST /crop with the pdf as the request body returns the cropped pdf, with the X-Pages and X-New-Pages
+    headers. GET /health returns the server's metrics as JSON. Requests are handled one at a time.
+
+    Pdfs are cropped with the settings of the Config, and nothing is written to the input directory except the
+    page filter cache."""
+
+    # The largest pdf accepted, so a bad request can't use up the server's memory.
+    MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, config, port=None):
+        """
+        :param config: The Config with the crop settings
+        :param port: (Optional) The port to listen on. Defaults to the serve port of the Config, 0 for any free port.
+        """
+        self.config = config
+        self.cache_filename = text_cache.cache_filename(config.directory, config.text_cache) if config.filter else ""
+        super().__init__(("127.0.0.1", config.serve_port if port is None else port), CropRequestHandler)
+
+    @property
+    def url(self):
+        """
+        Gets the URL of the server
+        :return: The URL of the server, ie: http://127.0.0.1:8765
+        """
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def crop(self, data, name=None):
+        """
+        Crop a pdf held in memory with the settings of the Config.
+        :param data: The bytes of the pdf
+        :param name: (Optional) A name for the pdf, ie: the filename it was uploaded as
+        :return: A PdfResult with the cropped pdf as its data
+        """
+        config = self.config
+        result = batch.process_bytes(data, config.filter, config.bounding_box, config.rotate, self.cache_filename,
+                                     name, config.rules, config.hard_crop)
+        metrics.add_file(result.filename, result.pages, result.new_pages, result.seconds, result.error)
+        metrics.count("files_failed" if result.error else "files_processed")
+        return result
+
+
+class CropRequestHandler(BaseHTTPRequestHandler):
+    """This class handles the requests of a CropServer."""
+    server_version = "PdfBatchCrop"
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path != "/health":
+            self.send_error(404)
+            return
+        self.send_body(200, json.dumps(metrics.report()).encode(), "application/json")
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/crop":
+            self.send_error(404)
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            self.send_error(411)
+            return
+        if length > self.server.MAX_BYTES:
+            self.send_error(413)
+            return
+
+        name = urllib.parse.parse_qs(url.query).get("name", [None])[0]
+        result = self.server.crop(self.rfile.read(length), name and os.path.basename(name))
+        if not result.ok:
+            self.send_body(400, json.dumps({"error": result.error}).encode(), "application/json")
+            return
+
+        self.send_body(200, result.data, "application/pdf",
+                       {"X-Pages": result.pages, "X-New-Pages": result.new_pages})
+
+    def send_body(self, status, body, content_type, headers=None):
+        """
+        Send a response.
+        :param status: The HTTP status code
+        :param body: The bytes of the response body
+        :param content_type: The content type of the body
+        :param headers: (Optional) A dictionary of extra headers
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests are only logged in verbose mode
+        if self.server.config.verbose:
+            super().log_message(format, *args)
@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import unittest
+
+from archiver import Archiver
+
+
+class TestArchiver(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name + "/"
+        self.journal = self.path + ".archive.jsonl"
+        self.filenames = []
+        for filename in ["a.pdf", "b.pdf", "acme/c.pdf"]:
+            os.makedirs(os.path.dirname(self.path + filename), exist_ok=True)
+            with open(self.path + filename, "wb") as pdf_file:
+                pdf_file.write(filename.encode())
+            self.filenames.append(self.path + filename)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_archive(self):
+        """ Test that a batch is moved into the archive, keeping subdirectories, and the journal is removed """
+        archiver = Archiver(self.path, "Archived", True, self.journal)
+        results = archiver.archive(self.filenames)
+
+        month = os.path.basename(os.path.dirname(results[self.filenames[0]]))
+        self.assertEqual(self.path + f"Archived/{month}/acme/c.pdf", results[self.filenames[2]])
+        for filename in self.filenames:
+            self.assertFalse(os.path.exists(filename))
+            self.assertTrue(os.path.exists(results[filename]))
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_archive_across_filesystems(self):
+        """ Test that moves that can't be renamed are copied, and a missing pdf doesn't stop the batch """
+        archiver = Archiver(self.path, "Archived", False, self.journal)
+        archiver._is_same_device = lambda source, target: False
+        results = archiver.archive(self.filenames + [self.path + "missing.pdf"])
+
+        self.assertIsInstance(results[self.path + "missing.pdf"], OSError)
+        with open(results[self.filenames[1]], "rb") as pdf_file:
+            self.assertEqual(b"b.pdf", pdf_file.read())
+        self.assertFalse(os.path.exists(self.filenames[1]))
+
+    def crash(self):
+        """ Leave a journal as if the program stopped after moving the first pdf, while copying the second """
+        archiver = Archiver(self.path, "Archived", False, self.journal)
+        moves = [(filename, archiver.target(filename)) for filename in self.filenames]
+        archiver._write_journal(moves)
+        os.makedirs(self.path + "Archived/acme")
+        os.replace(*moves[0])
+        with open(moves[1][1], "wb") as pdf_file:
+            pdf_file.write(b"b.p")
+        return archiver, moves
+
+    def test_roll_forward(self):
+        """ Test that an interrupted batch is finished, including a partly copied pdf """
+        archiver, moves = self.crash()
+        self.assertEqual(2, archiver.recover())
+
+        for source, target in moves:
+            self.assertFalse(os.path.exists(source))
+            self.assertTrue(os.path.exists(target))
+        with open(moves[1][1], "rb") as pdf_file:
+            self.assertEqual(b"b.pdf", pdf_file.read())
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_roll_back(self):
+        """ Test that an interrupted batch is undone, and a partly copied pdf is removed """
+        archiver, moves = self.crash()
+        self.assertEqual(1, archiver.recover(roll_forward=False))
+
+        for source, target in moves:
+            self.assertTrue(os.path.exists(source))
+            self.assertFalse(os.path.exists(target))
+        self.assertEqual(0, archiver.recover())
+
+    def test_journal_is_written_first(self):
+        """ Test that every move of a batch is in the journal before the first move """
+        archiver = Archiver(self.path, "Archived", False, self.journal)
+        journaled = []
+
+        def move(source, target, move):
+            with open(self.journal) as journal:
+                journaled.extend(json.loads(line)["source"] for line in journal)
+            return target
+        archiver._move = move
+        archiver.archive(self.filenames)
+
+        self.assertEqual(self.filenames, journaled[:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
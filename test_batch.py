@@ -0,0 +1,226 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from PyPDF2 import PdfReader, PdfWriter
+
+import batch
+import sample_pdfs
+from merged_pdf import MergedPdf
+from metrics import metrics
+from pdf import Pdf
+
+
+BOUNDING_BOX = [470.0, 748.0, 542.0, 140.0]
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "bulk.pdf")
+
+        # Label pages with a commercial invoice after every fifth label
+        rng = random.Random(0)
+        writer = PdfWriter()
+        for number in range(40):
+            writer.add_page(sample_pdfs._label_page(rng, number))
+            if number % 5 == 0:
+                writer.add_page(sample_pdfs._invoice_page(rng, number))
+        with open(self.filename, "wb") as output_stream:
+            writer.write(output_stream)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_pages_in_range(self):
+        """ Test that walking the page tree finds the same pages as reading every page """
+        pages = PdfReader(self.filename).pages
+        with Pdf(self.filename, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False) as pdf:
+            for page_range in [(0, 48), (0, 1), (13, 29), (47, 48)]:
+                with self.subTest(page_range=page_range):
+                    expected = [page.indirect_reference.idnum for page in pages[page_range[0]:page_range[1]]]
+                    found = [page.indirect_reference.idnum for page in pdf.pages_in_range(page_range)]
+                    self.assertEqual(expected, found)
+
+    def test_shard_ranges(self):
+        """ Test that a pdf is only split when there are fewer pdfs than workers, into one shard per worker """
+        self.assertEqual({self.filename: [(0, 16), (16, 32), (32, 48)]},
+                         batch.shard_ranges([self.filename], 3, 10))
+        self.assertEqual({}, batch.shard_ranges([self.filename], 3, 30))
+        self.assertEqual({}, batch.shard_ranges([self.filename, self.filename], 2, 10))
+
+    def test_sharded_filter(self):
+        """ Test that checking the filter text in shards gives the same pages, in the same order """
+        results = []
+        for workers in (1, 3):
+            result, = batch.process_all([self.filename], sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False,
+                                        f"crop{workers}", workers, shard_pages=10)
+            self.assertTrue(result.ok, result.error)
+            self.assertEqual((48, 40), (result.pages, result.new_pages))
+            results.append([page.extract_text() for page in PdfReader(result.new_filename).pages])
+
+        self.assertEqual(results[0], results[1])
+
+    def test_sharded_with_small_pdfs(self):
+        """ Test that small pdfs are processed in worker processes alongside a sharded pdf, in order """
+        small = sample_pdfs.make_batch(os.path.join(self.directory.name, "small"), 2)[0]
+        filenames = [small[0], self.filename, small[1]]
+        with mock.patch("batch.process_pdf", wraps=batch.process_pdf) as process_pdf:
+            results = list(batch.process_all(filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False, "crop", 4,
+                                             shard_pages=10))
+
+        # Nothing is processed in this process
+        process_pdf.assert_not_called()
+        self.assertEqual(filenames, [result.filename for result in results])
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual((48, 40), (results[1].pages, results[1].new_pages))
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filenames, _ = sample_pdfs.make_batch(self.directory.name, 12)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_generator(self):
+        """ Test that pdfs from a generator are processed in order, without reading the whole generator first """
+        found = []
+
+        def scan():
+            for filename in self.filenames:
+                found.append(filename)
+                yield filename
+
+        for workers in (1, 2):
+            found.clear()
+            with self.subTest(workers=workers):
+                results = batch.process_all(scan(), sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False, "crop", workers)
+                first = next(results)
+                self.assertLess(len(found), len(self.filenames))
+                self.assertEqual(self.filenames, [first.filename] + [result.filename for result in results])
+
+
+class TestInputModes(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filenames, _ = sample_pdfs.make_batch(self.directory.name, 3)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_input_modes(self):
+        """ Test that every input mode gives the same pages, and an unknown mode fails the pdf """
+        expected = None
+        for input_mode in ("auto", "buffered", "mmap", "read"):
+            with self.subTest(input_mode=input_mode):
+                results = list(batch.process_all(self.filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False,
+                                                 input_mode, input_mode=input_mode))
+                self.assertTrue(all(result.ok for result in results))
+                pages = [[page.cropbox for page in PdfReader(result.new_filename).pages] for result in results]
+                if expected is None:
+                    expected = pages
+                self.assertEqual(expected, pages)
+
+        result, = batch.process_all(self.filenames[:1], None, BOUNDING_BOX, False, "crop", input_mode="tape")
+        self.assertIn("Invalid input mode", result.error)
+
+
+class TestProcessPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filenames, _ = sample_pdfs.make_batch(self.directory.name, 6)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def fake_process_pdf(slow=(), crash=()):
+        """ Wrap process_pdf, so worker processes take longer on some pdfs and die on others """
+        process_pdf = batch.process_pdf
+
+        def fake(filename, *arguments, **keywords):
+            if filename in slow:
+                time.sleep(0.5)
+            if filename in crash:
+                os._exit(1)
+            return process_pdf(filename, *arguments, **keywords)
+        return fake
+
+    def test_worker_results(self):
+        """ Test that pdfs processed in workers are merged in order, and their metrics are added to this process's """
+        metrics.reset()
+        merged_pdf = MergedPdf(os.path.join(self.directory.name, "merged.pdf"))
+        results = list(batch.process_all(self.filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False, "crop", 3,
+                                         merged_pdf, write_files=False))
+
+        self.assertTrue(all(result.ok and result.new_filename is None for result in results))
+        self.assertTrue(all(result.data is None and result.metrics is None for result in results))
+        self.assertEqual(sum(result.pages for result in results), metrics.counters["pages_read"])
+        merged_pdf.write()
+        expected = []
+        for filename in self.filenames:
+            with Pdf(filename, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False) as pdf:
+                expected += [page.extract_text() for page in pdf.processed_pages()]
+        self.assertEqual(expected, [page.extract_text() for page in PdfReader(merged_pdf.filename).pages])
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == "fork", "workers only see the fake when forked")
+    def test_results_in_order(self):
+        """ Test that results are in filename order, even when the first pdf finishes last """
+        with mock.patch("batch.process_pdf", self.fake_process_pdf(slow=self.filenames[:1])):
+            results = list(batch.process_all(self.filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False,
+                                              "crop", 3))
+
+        self.assertEqual(self.filenames, [result.filename for result in results])
+        self.assertTrue(all(result.ok for result in results))
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == "fork", "workers only see the fake when forked")
+    def test_crashed_worker(self):
+        """ Test that a pdf that crashes its worker process only fails itself """
+        crash = self.filenames[2]
+        with mock.patch("batch.process_pdf", self.fake_process_pdf(crash=[crash])):
+            results = list(batch.process_all(self.filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False,
+                                              "crop", 2))
+
+        self.assertEqual(self.filenames, [result.filename for result in results])
+        self.assertEqual([crash], [result.filename for result in results if not result.ok])
+        self.assertIn("crashed", results[2].error)
+        for result in results:
+            if result.ok:
+                self.assertTrue(os.path.exists(result.new_filename))
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == "fork", "workers only see the fake when forked")
+    def test_crashed_while_result_handled(self):
+        """ Test that a worker dying while a result is being handled doesn't stop more pdfs being sent to the pool """
+        crash = self.filenames[1]
+        results = []
+        with mock.patch("batch.process_pdf", self.fake_process_pdf(slow=[crash], crash=[crash])):
+            for result in batch.process_all(self.filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False,
+                                            "crop", 2):
+                results.append(result)
+                if len(results) == 1:
+                    # The pool breaks before more pdfs are sent to it
+                    time.sleep(1)
+
+        self.assertEqual(self.filenames, [result.filename for result in results])
+        self.assertEqual([crash], [result.filename for result in results if not result.ok])
+
+    def test_corrupt_pdf(self):
+        """ Test that a corrupt pdf only fails itself """
+        corrupt = os.path.join(self.directory.name, "corrupt.pdf")
+        with open(corrupt, "wb") as corrupt_file:
+            corrupt_file.write(b"%PDF-1.4\nnot really a pdf")
+        filenames = self.filenames[:2] + [corrupt] + self.filenames[2:]
+
+        results = list(batch.process_all(filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False, "crop", 2))
+        self.assertEqual(filenames, [result.filename for result in results])
+        self.assertEqual([corrupt], [result.filename for result in results if not result.ok])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from PyPDF2 import PdfReader
+
+import benchmark
+import sample_pdfs
+from batch_runner import BatchRunner
+from config import Config
+from metrics import metrics
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestBatchRunner(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_directory = os.path.join(self.directory.name, "labels")
+        self.filenames, _ = sample_pdfs.make_batch(self.input_directory, 3)
+
+        # A config.ini somewhere other than the working directory
+        self.config_filename = os.path.join(self.directory.name, "settings.ini")
+        shutil.copy(os.path.join(SCRIPT_DIRECTORY, "config.ini"), self.config_filename)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def config(self, *argv):
+        return Config(["-d", self.input_directory, "-w", "1", "--manifest", "manifest.jsonl", *argv],
+                      self.config_filename)
+
+    def test_config_arguments(self):
+        """ Test that a config takes its arguments from the caller instead of the command line """
+        config = self.config("-m", "-f", "Invoice")
+        self.assertEqual(self.input_directory + "/", config.directory)
+        self.assertTrue(config.merge)
+        self.assertEqual("Invoice", config.filter)
+        with self.assertRaises(ValueError):
+            Config(["-d", self.input_directory], os.path.join(self.directory.name, "missing.ini"))
+
+    def test_config_file_cached(self):
+        """ Test that config.ini is only parsed again once it changes """
+        parsed = Config.read_config_file(self.config_filename)
+        self.assertIs(parsed, Config.read_config_file(self.config_filename))
+
+        with open(self.config_filename, "a") as config_file:
+            config_file.write("\n[PROFILE ups]\ntext = UPS\n")
+        self.assertIsNot(parsed, Config.read_config_file(self.config_filename))
+        self.assertEqual(["ups"], [profile.name for profile in self.config().profiles])
+
+    def test_run(self):
+        """ Test that a run yields a result for every pdf in order, merges them, and skips them next time """
+        runner = BatchRunner(self.config("-m", "-a"))
+        results = list(runner.run())
+
+        self.assertEqual(self.filenames, [result.filename for result in results])
+        self.assertTrue(all(result.ok and result.archived_filename for result in results))
+        self.assertEqual(3, runner.processed)
+        self.assertEqual(sum(result.new_pages for result in results),
+                         len(PdfReader(runner.merge_filepath).pages))
+
+        # Archived pdfs aren't in the input directory, so there is nothing left to do
+        runner = BatchRunner(self.config("-m", "-a"))
+        self.assertEqual([], list(runner.run()))
+        self.assertEqual(0, runner.processed)
+
+    def test_merge_without_cropped_files(self):
+        """ Test that merging without keeping the cropped pdfs merges every page without writing them """
+        runner = BatchRunner(self.config("-m", "-k", "--manifest", "kept.jsonl"))
+        list(runner.run())
+        cropped = [os.path.join(self.input_directory, name) for name in os.listdir(self.input_directory)
+                   if name.endswith(f"-{runner.config.suffix}.pdf")]
+        self.assertEqual(len(self.filenames), len(cropped))
+        cropped_pages = sum(len(PdfReader(filename).pages) for filename in cropped)
+        for filename in cropped:
+            os.remove(filename)
+
+        for workers in ("1", "2"):
+            with self.subTest(workers=workers):
+                runner = BatchRunner(self.config("-m", "-w", workers, "--manifest", f"merged-{workers}.jsonl"))
+                results = list(runner.run())
+
+                self.assertEqual(self.filenames, [result.filename for result in results])
+                self.assertTrue(all(result.ok and result.new_filename is None for result in results))
+                self.assertEqual([], [name for name in os.listdir(self.input_directory)
+                                      if name.endswith(f"-{runner.config.suffix}.pdf")])
+                self.assertEqual(cropped_pages, len(PdfReader(runner.merge_filepath).pages))
+
+    def test_archive_error_retried(self):
+        """ Test that a pdf that couldn't be archived isn't recorded as done, so the next run archives it """
+        runner = BatchRunner(self.config("-a"))
+        move = runner.archiver._move
+        runner.archiver._move = lambda source, target, replace: (
+            PermissionError(source) if source == self.filenames[0] else move(source, target, replace))
+        results = list(runner.run())
+
+        self.assertIsNone(results[0].archived_filename)
+        self.assertEqual([self.filenames[0]], list(runner.archive_errors))
+        self.assertTrue(os.path.exists(self.filenames[0]))
+
+        runner = BatchRunner(self.config("-a"))
+        results = list(runner.run())
+        self.assertEqual([self.filenames[0]], [result.filename for result in results])
+        self.assertTrue(results[0].archived_filename)
+        self.assertFalse(os.path.exists(self.filenames[0]))
+
+    def test_deduplicated_metrics(self):
+        """ Test that resources shared in the merged pdf are counted once in the metrics """
+        metrics.reset()
+        runner = BatchRunner(self.config("-m"))
+        list(runner.run())
+
+        self.assertGreater(runner.merged_pdf.deduplicated, 0)
+        self.assertEqual(runner.merged_pdf.deduplicated, metrics.counters["resources_deduplicated"])
+        self.assertEqual(runner.merged_pdf.bytes_saved, metrics.counters["bytes_deduplicated"])
+
+    def test_manifest_skips_done_pdfs(self):
+        """ Test that pdfs processed by an earlier runner are skipped """
+        list(BatchRunner(self.config()).run())
+        runner = BatchRunner(self.config())
+        self.assertEqual([], list(runner.new_pdfs(self.filenames)))
+        self.assertEqual(3, runner.skipped)
+
+
+class TestStartup(unittest.TestCase):
+    # The most time cropping a single pdf may spend importing modules. It takes about 100 to 150 ms, with PyPDF2
+    # most of that, so this only catches something big being imported again before it is needed.
+    IMPORT_BUDGET_MS = 400
+
+    # Modules only imported when they are used
+    LAZY_MODULES = ("server", "watcher", "http.server", "concurrent.futures.process", "multiprocessing")
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_directory = os.path.join(self.directory.name, "empty")
+        os.mkdir(self.input_directory)
+        self.filename = os.path.join(self.directory.name, "label.pdf")
+        sample_pdfs.make_label_pdf(self.filename, 0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def imports(self, *argv):
+        """ Run pdf_batch_crop.py with python -X importtime, returning the modules imported and the time taken """
+        process = subprocess.run([sys.executable, "-X", "importtime", os.path.join(SCRIPT_DIRECTORY,
+                                                                                   "pdf_batch_crop.py"), *argv],
+                                 cwd=SCRIPT_DIRECTORY, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        modules = {line.rsplit("|", 1)[1].strip() for line in process.stderr.splitlines()
+                   if line.startswith("import time:") and "|" in line}
+        return process.returncode, modules, benchmark.import_ms(process.stderr)
+
+    def test_single_pdf(self):
+        """ Test that cropping a single pdf only imports what it needs, within the import budget """
+        returncode, modules, import_ms = self.imports("-d", self.input_directory, "-i", self.filename, "-w", "1",
+                                                      "-f", sample_pdfs.FILTER_TEXT)
+        self.assertEqual(0, returncode)
+        self.assertTrue(os.path.exists(self.filename.replace(".pdf", "-crop.pdf")))
+        self.assertEqual([], [module for module in self.LAZY_MODULES if module in modules])
+        self.assertLess(import_ms, self.IMPORT_BUDGET_MS)
+
+    def test_invalid_config(self):
+        """ Test that invalid settings are reported before the pdf library is imported """
+        returncode, modules, _ = self.imports("-d", os.path.join(self.directory.name, "missing"))
+        self.assertEqual(1, returncode)
+        self.assertNotIn("PyPDF2", modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
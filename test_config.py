@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+
+from config import Config
+
+# The config.ini shipped before the PERFORMANCE section and the newer toggles were added
+BASELINE_CONFIG = """[DEFAULTS]
+input_filename =
+output_filename = pdf_crop_merge.pdf
+filter = Commercial Invoice
+suffix = crop
+directory = {directory}
+archived_directory = Archived
+
+[COORDINATES]
+lower_left_x = 470.0
+lower_left_y = 542.0
+upper_right_x = 748.0
+upper_right_y = 140.0
+
+[TOGGLES]
+verbose = False
+merge = False
+rotate = False
+archive_by_month = False
+archive = False
+"""
+
+
+class TestConfigFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.config_filename = os.path.join(self.directory.name, "settings.ini")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_config(self, extra=""):
+        with open(self.config_filename, "w") as config_file:
+            config_file.write(BASELINE_CONFIG.format(directory=self.directory.name) + extra)
+
+    def test_baseline_config(self):
+        """ Test that a config.ini without the newer sections and keys loads with the default values """
+        self.write_config()
+        config = Config([], self.config_filename)
+
+        self.assertEqual(self.directory.name + "/", config.directory)
+        self.assertEqual([470.0, 748.0, 542.0, 140.0], config.bounding_box)
+        self.assertEqual(os.cpu_count() or 1, config.workers)
+        self.assertEqual(200, config.shard_pages)
+        self.assertEqual("auto", config.input_mode)
+        self.assertEqual("", config.text_cache)
+        self.assertEqual("off", config.duplicates)
+        self.assertEqual("", config.duplicate_index)
+        self.assertEqual(4, config.pipeline_depth)
+        self.assertEqual(60, config.lease_seconds)
+        self.assertEqual([], config.include)
+        for toggle in ("keep_cropped", "recursive", "watch", "serve", "hard_crop", "coordinate"):
+            self.assertIs(False, getattr(config, toggle), toggle)
+
+    def test_partial_performance_section(self):
+        """ Test that a PERFORMANCE section holding only some keys uses the default values for the rest """
+        self.write_config("\n[PERFORMANCE]\nworkers = 3\n")
+        config = Config([], self.config_filename)
+
+        self.assertEqual(3, config.workers)
+        self.assertEqual(200, config.shard_pages)
+        self.assertEqual(0, config.merge_max_pages)
+        self.assertEqual(8765, config.serve_port)
+
+        # Command line arguments are still used over the defaults
+        config = Config(["--shard_pages", "50", "--recursive"], self.config_filename)
+        self.assertEqual(50, config.shard_pages)
+        self.assertIs(True, config.recursive)
+
+
+if __name__ == '__main__':
+    unittest.main()
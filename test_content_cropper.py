@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ContentStream, DictionaryObject, NameObject, NumberObject
+
+import batch
+import sample_pdfs
+from content_cropper import ContentCropper
+from metrics import metrics
+from test_page_filter import font, make_page, stream
+
+# The top left of the page
+BOUNDING_BOX = [0.0, 300.0, 400.0, 792.0]
+
+
+def image():
+    """ Create a 1 x 1 image XObject """
+    return stream(b"\x00", Type=NameObject("/XObject"), Subtype=NameObject("/Image"), Width=NumberObject(1),
+                  Height=NumberObject(1), ColorSpace=NameObject("/DeviceGray"), BitsPerComponent=NumberObject(8))
+
+
+def operators(page):
+    """ Gets the operators of a page's content stream """
+    return [operator.decode() for _, operator in ContentStream(page['/Contents'], page.pdf).operations]
+
+
+class TestContentCropper(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.cropper = ContentCropper(BOUNDING_BOX)
+
+    def test_images(self):
+        """ Test that images outside the box are removed with the state saved around them, and their resources """
+        page = make_page(b"q 100 0 0 100 50 500 cm /In Do Q q 0 0 m 1 1 l S q 100 0 0 100 400 100 cm /Out Do Q Q",
+                         xobjects={"/In": image(), "/Out": image()})
+        self.assertEqual(2, self.cropper.crop(page))
+        self.assertEqual(["q", "cm", "Do", "Q"], operators(page))
+        self.assertEqual(["/In"], list(page['/Resources']['/XObject']))
+        self.assertEqual([], list(page['/Resources']['/Font']))
+        self.assertEqual(2, metrics.counters["operations_hard_cropped"])
+        self.assertEqual(2, metrics.counters["resources_hard_cropped"])
+
+    def test_paths(self):
+        """ Test that paths are removed only when their line width can't reach the box, and clips are kept """
+        page = make_page(b"1 w 10 500 m 100 600 l S 400 100 m 500 200 l S 303 500 m 303 600 l S "
+                         b"400 100 100 100 re W n 10 w 315 500 m 315 600 l S")
+        self.assertEqual(1, self.cropper.crop(page))
+        self.assertEqual(["w", "m", "l", "S", "m", "l", "S", "re", "W", "n", "w", "m", "l", "S"], operators(page))
+
+    def test_graphics_state_line_width(self):
+        """ Test that a line width set with gs pads paths, and paths after a gs without a known width are kept """
+        graphics_states = {"/Wide": DictionaryObject({NameObject("/LW"): NumberObject(10)}),
+                           "/Alpha": DictionaryObject({NameObject("/CA"): NumberObject(1)})}
+        page = make_page(b"/Wide gs 315 500 m 315 600 l S /Alpha gs 315 500 m 315 600 l S "
+                         b"1 w 320 500 m 320 600 l S /Missing gs 400 500 m 400 600 l S",
+                         graphics_states=graphics_states)
+        self.assertEqual(1, self.cropper.crop(page))
+        self.assertEqual(["gs", "m", "l", "S", "gs", "m", "l", "S", "w", "gs", "m", "l", "S"], operators(page))
+
+    def test_text(self):
+        """ Test that lines of text outside the box are removed, keeping the state and line positions """
+        page = make_page(b"BT /F1 4 Tf 14 TL 20 700 Td (Inside) Tj 400 0 Td (Outside) Tj (Outside) ' "
+                         b"1 2 (Outside) \" ET")
+        self.assertEqual(3, self.cropper.crop(page))
+        self.assertEqual(["BT", "Tf", "TL", "Td", "Tj", "Td", "T*", "Tw", "Tc", "T*", "ET"], operators(page))
+        self.assertEqual(["/F1"], list(page['/Resources']['/Font']))
+
+        # Text in fonts without glyph widths, and text used for clipping, is kept
+        type3 = {"/F1": font(Subtype=NameObject("/Type3"))}
+        for content, fonts in ((b"BT /F1 4 Tf 400 100 Td (Outside) Tj ET", type3),
+                               (b"BT /F1 4 Tf 7 Tr 400 100 Td (Outside) Tj ET", None),
+                               (b"BT /F2 4 Tf 400 100 Td (Outside) Tj ET", None)):
+            with self.subTest(content=content):
+                self.assertEqual(0, self.cropper.crop(make_page(content, fonts)))
+
+    def test_unchanged(self):
+        """ Test that a page with nothing outside the box is left as it is """
+        page = make_page(b"BT /F1 12 Tf 20 700 Td (Inside) Tj ET 10 500 m 100 600 l S")
+        contents = page.raw_get('/Contents')
+        self.assertEqual(0, self.cropper.crop(page))
+        self.assertIs(contents, page.raw_get('/Contents'))
+        self.assertNotIn("operations_hard_cropped", metrics.counters)
+
+    def test_process(self):
+        """ Test that hard cropping full label sheets keeps the label, and makes the cropped pdfs smaller """
+        with tempfile.TemporaryDirectory() as directory:
+            filenames, _ = sample_pdfs.make_batch(directory, 3, sheets=True)
+            sizes = {}
+            for hard_crop in (False, True):
+                results = list(batch.process_all(filenames, sample_pdfs.FILTER_TEXT, sample_pdfs.LABEL_BOUNDING_BOX,
+                                                 False, f"crop{hard_crop}", hard_crop=hard_crop))
+                self.assertTrue(all(result.ok for result in results))
+                sizes[hard_crop] = sum(os.path.getsize(result.new_filename) for result in results)
+
+                for result in results:
+                    for page in PdfReader(result.new_filename).pages:
+                        text = page.extract_text()
+                        self.assertIn("SHIP TO", text.upper())
+                        self.assertEqual(not hard_crop, sample_pdfs.INSTRUCTIONS[0] in text)
+
+            self.assertLess(sizes[True], sizes[False] / 2)
+            self.assertGreater(metrics.counters["operations_hard_cropped"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import sample_pdfs
+from batch_runner import BatchRunner
+from config import Config
+from duplicate_index import DuplicateIndex
+from manifest import Manifest
+from metrics import metrics
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def record_in_worker(filename, key):
+    """ Record a hash from a worker process, returning the id of the connection it was recorded through """
+    index = DuplicateIndex.open(filename)
+    return id(index.connection), index.file_original(key, "worker.pdf")
+
+
+class TestDuplicateIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = DuplicateIndex.open(os.path.join(self.directory.name, "duplicates.sqlite"), 2)
+
+    def tearDown(self):
+        self.index.close()
+        self.directory.cleanup()
+
+    def test_original(self):
+        """ Test that a hash is only a duplicate when it is seen again from another filename """
+        self.assertIsNone(self.index.file_original("a", "first.pdf", record=False))
+        self.assertIsNone(self.index.file_original("a", "second.pdf", record=False))
+        self.assertIsNone(self.index.file_original("a", "first.pdf"))
+        self.assertIsNone(self.index.file_original("a", "first.pdf"))
+        self.assertEqual("first.pdf", self.index.file_original("a", "second.pdf"))
+        # Files and pages are kept apart
+        self.assertIsNone(self.index.page_original("a", "second.pdf"))
+        self.assertEqual("second.pdf", self.index.page_original("a", "first.pdf"))
+
+    def test_evict(self):
+        """ Test that the least recently seen hashes are evicted """
+        for key in ("a", "b", "c"):
+            self.index.page_original(key, "first.pdf")
+        self.index.page_original("a", "first.pdf")
+        self.assertEqual(1, self.index.evict())
+        self.assertEqual(2, len(self.index))
+        self.assertIsNone(self.index.page_original("b", "second.pdf"))
+        self.assertEqual("first.pdf", self.index.page_original("a", "second.pdf"))
+
+    def test_workers(self):
+        """ Test that worker processes forked after the index was opened connect to it again """
+        self.index.file_original("a", "first.pdf")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(record_in_worker, self.index.filename, key) for key in ("a", "b", "c")]
+            results = [future.result() for future in futures]
+
+        self.assertNotIn(id(self.index.connection), [connection for connection, _ in results])
+        self.assertEqual(["first.pdf", None, None], [original for _, original in results])
+        self.assertEqual("worker.pdf", self.index.file_original("b", "second.pdf"))
+
+
+class TestDuplicates(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_directory = os.path.join(self.directory.name, "labels")
+        self.filenames, _ = sample_pdfs.make_batch(self.input_directory, 3)
+
+        self.config_filename = os.path.join(self.directory.name, "settings.ini")
+        shutil.copy(os.path.join(SCRIPT_DIRECTORY, "config.ini"), self.config_filename)
+
+    def tearDown(self):
+        index_filename = os.path.join(self.input_directory, ".pdf_batch_crop_duplicates.sqlite")
+        DuplicateIndex.open(index_filename).close()
+        self.directory.cleanup()
+
+    def run_batch(self, duplicates, workers=1):
+        runner = BatchRunner(Config(["-d", self.input_directory, "-w", str(workers), "-m", "-a",
+                                     "--duplicates", duplicates], self.config_filename))
+        return runner, list(runner.run())
+
+    def export_again(self, name):
+        """ Copy the first pdf, which has been archived, back into the input directory under another filename """
+        archived = os.path.join(self.input_directory, "Archived", os.path.basename(self.filenames[0]))
+        filename = os.path.join(self.input_directory, name)
+        shutil.copy(archived, filename)
+        return filename
+
+    def test_report(self):
+        """ Test that a pdf exported again is processed, and reported with the pdf it is the same as """
+        _, results = self.run_batch("report")
+        first_pages = results[0].new_pages
+
+        copy = self.export_again("copy.pdf")
+        runner, results = self.run_batch("report")
+        self.assertEqual([copy], [result.filename for result in results])
+        self.assertEqual([(copy, self.filenames[0])], runner.duplicates)
+        self.assertEqual(first_pages, results[0].new_pages)
+        self.assertEqual(first_pages, runner.duplicate_pages)
+        self.assertEqual(1, metrics.counters["files_duplicate"])
+
+    def test_report_workers(self):
+        """ Test that pdfs processed in worker processes are recorded and reported like in this process """
+        self.run_batch("report", workers=2)
+        copy = self.export_again("copy.pdf")
+        runner, results = self.run_batch("report", workers=2)
+        self.assertEqual([copy], [result.filename for result in results])
+        self.assertEqual([(copy, self.filenames[0])], runner.duplicates)
+
+    def test_skip(self):
+        """ Test that a pdf exported again is left out, and its pages aren't merged again """
+        self.run_batch("skip")
+        copy = self.export_again("copy.pdf")
+        runner, results = self.run_batch("skip")
+        self.assertEqual([], results)
+        self.assertEqual([(copy, self.filenames[0])], runner.duplicates)
+        self.assertTrue(os.path.exists(copy))
+
+    def test_failed_not_original(self):
+        """ Test that a pdf that fails isn't recorded, so a later copy of it isn't taken for a duplicate """
+        with mock.patch("pdf.Pdf.processed_pages", side_effect=OSError("No space left on device")):
+            _, results = self.run_batch("report")
+        self.assertFalse(any(result.ok for result in results))
+        index = DuplicateIndex.open(os.path.join(self.input_directory, ".pdf_batch_crop_duplicates.sqlite"))
+        file_hash = Manifest.file_hash(self.filenames[0])
+        self.assertIsNone(index.file_original(file_hash, "copy.pdf", record=False))
+
+        runner, results = self.run_batch("report")
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual([], runner.duplicates)
+        self.assertEqual(self.filenames[0], index.file_original(file_hash, "copy.pdf", record=False))
+
+    def test_off(self):
+        """ Test that duplicates aren't looked for when they are off """
+        self.run_batch("off")
+        self.export_again("copy.pdf")
+        runner, results = self.run_batch("off")
+        self.assertEqual(1, len(results))
+        self.assertEqual([], runner.duplicates)
+        self.assertFalse(os.path.exists(os.path.join(self.input_directory, ".pdf_batch_crop_duplicates.sqlite")))
+
+
+if __name__ == '__main__':
+    unittest.main()
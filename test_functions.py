@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+import functions
+
+
+class TestScanPdfs(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name + "/"
+        for filename in ["b.pdf", "a.pdf", "a-crop.pdf", "notes.txt", ".hidden.pdf", "pdf_crop_merge.pdf",
+                         "pdf_crop_merge-001.pdf", "acme/label.pdf", "acme/old/label.pdf", "zeta/label.pdf",
+                         "Archived/a.pdf", "Archived/2024-01/b.pdf"]:
+            os.makedirs(os.path.dirname(self.path + filename), exist_ok=True)
+            with open(self.path + filename, "wb") as pdf_file:
+                pdf_file.write(b"%PDF-1.4")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def scan(self, **options):
+        pdfs = functions.scan_pdfs(self.path, "pdf_crop_merge.pdf", "crop",
+                                   excluded_directories=[self.path + "Archived"], **options)
+        return [os.path.relpath(pdf, self.path) for pdf in pdfs]
+
+    def test_flat(self):
+        """ Test that only the pdfs directly in the directory are found, in order, without outputs or hidden files """
+        self.assertEqual(["a.pdf", "b.pdf"], self.scan())
+        self.assertEqual([self.path + "a-crop.pdf", self.path + "a.pdf", self.path + "b.pdf"],
+                         functions.get_all_pdfs(self.path, "pdf_crop_merge.pdf"))
+
+    def test_recursive(self):
+        """ Test that subdirectories are searched in order, except the archive """
+        self.assertEqual(["a.pdf", "acme/label.pdf", "acme/old/label.pdf", "b.pdf", "zeta/label.pdf"],
+                         self.scan(recursive=True))
+
+    def test_globs(self):
+        """ Test that include globs choose pdfs, and exclude globs leave out pdfs and whole subdirectories """
+        self.assertEqual(["acme/label.pdf", "acme/old/label.pdf"], self.scan(recursive=True, include=["acme/*"]))
+        self.assertEqual(["a.pdf", "acme/label.pdf", "b.pdf"], self.scan(recursive=True, exclude=["old", "zeta/*"]))
+        self.assertEqual(["b.pdf", "zeta/label.pdf"], self.scan(recursive=True, include=["b.pdf", "zeta/*"],
+                                                                 exclude=["acme"]))
+
+    def test_streaming(self):
+        """ Test that pdfs are yielded before the rest of the directory tree is searched """
+        pdfs = functions.scan_pdfs(self.path, "pdf_crop_merge.pdf", "crop", recursive=True,
+                                   excluded_directories=[self.path + "Archived"])
+        self.assertEqual(self.path + "a.pdf", next(pdfs))
+
+        # A subdirectory isn't listed until the pdfs before it have been handed out
+        with open(self.path + "acme/another.pdf", "wb") as pdf_file:
+            pdf_file.write(b"%PDF-1.4")
+        self.assertEqual(["acme/another.pdf", "acme/label.pdf", "acme/old/label.pdf", "b.pdf", "zeta/label.pdf"],
+                         [os.path.relpath(pdf, self.path) for pdf in pdfs])
+
+if __name__ == '__main__':
+    unittest.main()
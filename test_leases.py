@@ -0,0 +1,248 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from PyPDF2 import PdfReader
+
+import sample_pdfs
+from batch_runner import BatchRunner
+from config import Config
+from leases import Leases
+from metrics import metrics
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestLeases(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "label.pdf")
+        claim_seconds = mock.patch.object(Leases, "CLAIM_SECONDS", 0.1)
+        claim_seconds.start()
+        self.addCleanup(claim_seconds.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def expire(self, leases):
+        """ Make every lease held look like it was last renewed two lease times ago """
+        expired = time.time() - 2 * leases.lease_seconds
+        for lease_filename in leases.held.values():
+            os.utime(lease_filename, (expired, expired))
+
+    @staticmethod
+    def stale(leases, first):
+        """ Make a station's first look at the leases of a pdf out of date, and later looks up to date """
+        read = leases._leases
+        looks = []
+
+        def look(filename):
+            looks.append(filename)
+            return first if len(looks) == 1 else read(filename)
+        return look
+
+    def test_claim(self):
+        """ Test that only one station can hold a pdf until it is released """
+        first, second = Leases(self.directory.name, "first", 60), Leases(self.directory.name, "second", 60)
+        self.assertTrue(first.claim(self.filename))
+        self.assertTrue(first.claim(self.filename))
+        self.assertFalse(second.claim(self.filename))
+        self.assertEqual(1, metrics.counters["leases_busy"])
+
+        # Only the station holding a lease can release it
+        second.release(self.filename)
+        self.assertFalse(second.claim(self.filename))
+        first.release(self.filename)
+        self.assertTrue(second.claim(self.filename))
+        self.assertEqual([], [name for name in os.listdir(first.directory) if not name.endswith(".lease")])
+
+    def test_takeover(self):
+        """ Test that an expired lease is taken over by one station, and the station that held it notices """
+        stopped = Leases(self.directory.name, "stopped", 60)
+        stations = [Leases(self.directory.name, f"station{number}", 60) for number in range(3)]
+        self.assertTrue(stopped.claim(self.filename))
+        self.assertEqual([False, False, False], [station.claim(self.filename) for station in stations])
+
+        self.expire(stopped)
+        self.assertEqual([True, False, False], [station.claim(self.filename) for station in stations])
+        self.assertEqual(1, metrics.counters["leases_taken_over"])
+
+        stopped.renew()
+        self.assertEqual(0, len(stopped))
+        self.assertEqual(1, metrics.counters["leases_lost"])
+        stopped.release(self.filename)
+        self.assertFalse(stations[1].claim(self.filename))
+
+    def test_three_way_race(self):
+        """ Test that when three stations claim a pdf at once, new or expired, exactly one of them holds it """
+        stations = [Leases(self.directory.name, f"station{number}", 60) for number in range(3)]
+        for number in range(30):
+            filename = os.path.join(self.directory.name, f"label-{number}.pdf")
+            if number % 2:
+                stopped = Leases(self.directory.name, "stopped", 60)
+                stopped.claim(filename)
+                self.expire(stopped)
+
+            barrier = threading.Barrier(len(stations))
+            claimed = [None] * len(stations)
+
+            def claim(index):
+                barrier.wait()
+                claimed[index] = stations[index].claim(filename)
+
+            threads = [threading.Thread(target=claim, args=(index,)) for index in range(len(stations))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            with self.subTest(number=number):
+                self.assertEqual(1, claimed.count(True), claimed)
+                holder = stations[claimed.index(True)]
+                for station in stations:
+                    station.renew()
+                self.assertEqual([holder], [station for station in stations if filename in station.held])
+                holder.release(filename)
+        self.assertEqual([], os.listdir(stations[0].directory))
+
+    def test_stale_claim(self):
+        """ Test that a station that found no lease, and creates one after another station took the pdf over,
+        doesn't hold it """
+        stopped = Leases(self.directory.name, "stopped", 60)
+        late, taker = Leases(self.directory.name, "late", 60), Leases(self.directory.name, "taker", 60)
+        stopped.claim(self.filename)
+        self.expire(stopped)
+
+        # The late station looked before the stopped station claimed the pdf, and creates its lease only now
+        self.assertTrue(taker.claim(self.filename))
+        with mock.patch.object(late, "_leases", side_effect=self.stale(late, {})):
+            self.assertFalse(late.claim(self.filename))
+        self.assertNotIn(late.lease_filename(self.filename, 0), late.held.values())
+        self.assertEqual([stopped.owner, taker.owner], [
+            Leases._owner(Leases._read(os.path.join(late.directory, name))[0])
+            for name in sorted(os.listdir(late.directory))])
+
+    def test_takeover_while_claimed(self):
+        """ Test that a station taking over an expired lease backs off from a new lease created meanwhile """
+        stopped = Leases(self.directory.name, "stopped", 60)
+        station, taker = Leases(self.directory.name, "station", 60), Leases(self.directory.name, "taker", 60)
+        stopped.claim(self.filename)
+        self.expire(stopped)
+        expired = taker._leases(self.filename)
+
+        # The stopped station's lease was removed, and another station claimed the pdf after the taker looked
+        stopped.release(self.filename)
+        self.assertTrue(station.claim(self.filename))
+        with mock.patch.object(taker, "_leases", side_effect=self.stale(taker, expired)):
+            self.assertFalse(taker.claim(self.filename))
+        station.renew()
+        self.assertIn(self.filename, station.held)
+
+    def test_renew_while_claimed(self):
+        """ Test that a station keeps its lease while another station creates a later generation and removes it
+        again, and that releasing it removes every generation """
+        station, other = Leases(self.directory.name, "station", 60), Leases(self.directory.name, "other", 60)
+        self.assertTrue(station.claim(self.filename))
+        self.expire(station)
+        self.assertTrue(other.claim(self.filename))
+        os.utime(station.held[self.filename])
+        claiming = other.held[self.filename]
+
+        # The other station would find the renewed lease and back off while the station checks its lease again
+        with mock.patch("leases.time.sleep", side_effect=lambda seconds: os.remove(claiming)):
+            station.renew()
+        self.assertIn(self.filename, station.held)
+        self.assertNotIn("leases_lost", metrics.counters)
+        station.release(self.filename)
+        self.assertEqual([], os.listdir(station.directory))
+
+    def test_renew(self):
+        """ Test that a renewed lease isn't taken over """
+        station, other = Leases(self.directory.name, "station", 60), Leases(self.directory.name, "other", 60)
+        station.claim(self.filename)
+        self.expire(station)
+        station.renew()
+        self.assertFalse(other.claim(self.filename))
+
+
+class TestCoordinatedStations(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_directory = os.path.join(self.directory.name, "labels")
+        self.filenames, _ = sample_pdfs.make_batch(self.input_directory, 24)
+
+        self.config_filename = os.path.join(self.directory.name, "settings.ini")
+        shutil.copy(os.path.join(SCRIPT_DIRECTORY, "config.ini"), self.config_filename)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_config(self):
+        """ Test that coordinated mode needs archive on """
+        with self.assertRaises(ValueError):
+            Config(["-d", self.input_directory, "--coordinate"], self.config_filename)
+        config = Config(["-d", self.input_directory, "--coordinate", "-a", "--station", "packing 1"],
+                        self.config_filename)
+        self.assertEqual("packing_1", config.station)
+        self.assertEqual(self.input_directory + "/pdf_crop_merge-packing_1.pdf", BatchRunner(config).merge_filepath)
+
+    def test_busy(self):
+        """ Test that a runner leaves pdfs held by another station, and takes them over once their leases expire """
+        other = Leases(self.input_directory + "/", "other", 60)
+        other.claim(self.filenames[0])
+
+        config = Config(["-d", self.input_directory, "-w", "1", "--coordinate", "-a", "--station", "packing"],
+                        self.config_filename)
+        runner = BatchRunner(config)
+        self.assertEqual(self.filenames[1:], [result.filename for result in runner.run()])
+        self.assertEqual([self.filenames[0]], runner.busy)
+
+        expired = time.time() - 120
+        os.utime(other.held[self.filenames[0]], (expired, expired))
+        self.assertEqual(self.filenames[:1], [result.filename for result in runner.run()])
+        self.assertEqual([], runner.busy)
+        self.assertEqual([], os.listdir(other.directory))
+
+    def test_stations(self):
+        """ Test that stations run at once on one directory process every pdf exactly once """
+        expected_pages = 0
+        for filename in self.filenames:
+            pages = PdfReader(filename).pages
+            expected_pages += sum(1 for page in pages if sample_pdfs.FILTER_TEXT not in page.extract_text())
+
+        stations = [subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIRECTORY, "pdf_batch_crop.py"),
+                                      "-d", self.input_directory, "-w", "1", "-v", "-m", "-a", "--coordinate",
+                                      "--station", f"station{number}"],
+                                     cwd=SCRIPT_DIRECTORY, stdout=subprocess.PIPE, text=True)
+                    for number in range(3)]
+        converted = []
+        for station in stations:
+            output, _ = station.communicate(timeout=120)
+            self.assertEqual(0, station.returncode, output)
+            converted.extend(line[len("Converting: "):] for line in output.splitlines()
+                             if line.startswith("Converting: "))
+
+        self.assertEqual(sorted(self.filenames), sorted(converted))
+        merged_pages = 0
+        for number in range(3):
+            merged_filename = os.path.join(self.input_directory, f"pdf_crop_merge-station{number}.pdf")
+            if os.path.exists(merged_filename):
+                merged_pages += len(PdfReader(merged_filename).pages)
+        self.assertEqual(expected_pages, merged_pages)
+
+        for filename in self.filenames:
+            self.assertFalse(os.path.exists(filename))
+            archived = os.path.join(self.input_directory, "Archived", os.path.basename(filename))
+            self.assertTrue(os.path.exists(archived))
+        self.assertEqual([], os.listdir(os.path.join(self.input_directory, Leases.DIRECTORY)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from manifest import Manifest
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal = os.path.join(self.directory.name, "manifest.jsonl")
+        self.pdf = os.path.join(self.directory.name, "label.pdf")
+        with open(self.pdf, "wb") as pdf:
+            pdf.write(b"%PDF-1.4 label")
+        self.fingerprint = Manifest.config_fingerprint([1.0, 2.0, 3.0, 4.0], "Commercial Invoice", False, "crop")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def process(self, manifest):
+        """ Record the pdf as processed """
+        manifest.started(self.pdf)
+        manifest.done(self.pdf, manifest.snapshot(self.pdf), self.pdf.replace(".pdf", "-crop.pdf"))
+        manifest.close()
+
+    def test_unchanged_pdf_is_done(self):
+        """ Test that a processed pdf is skipped on the next run """
+        self.process(Manifest(self.journal, self.fingerprint))
+
+        self.assertTrue(Manifest(self.journal, self.fingerprint).is_done(self.pdf), 'not skipped')
+
+    def test_interrupted_pdf_is_not_done(self):
+        """ Test that a pdf that was started but never finished is processed again """
+        manifest = Manifest(self.journal, self.fingerprint)
+        manifest.started(self.pdf)
+        manifest.close()
+
+        self.assertFalse(Manifest(self.journal, self.fingerprint).is_done(self.pdf), 'skipped')
+
+    def test_changed_settings_are_not_done(self):
+        """ Test that a pdf is processed again when the crop settings change """
+        self.process(Manifest(self.journal, self.fingerprint))
+        fingerprint = Manifest.config_fingerprint([1.0, 2.0, 3.0, 4.0], "Commercial Invoice", True, "crop")
+
+        self.assertFalse(Manifest(self.journal, fingerprint).is_done(self.pdf), 'skipped')
+
+    def test_changed_pdf_is_not_done(self):
+        """ Test that a pdf is processed again when its contents change, but not when it is only touched """
+        self.process(Manifest(self.journal, self.fingerprint))
+        stat = os.stat(self.pdf)
+        os.utime(self.pdf, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        self.assertTrue(Manifest(self.journal, self.fingerprint).is_done(self.pdf), 'not skipped')
+
+        with open(self.pdf, "wb") as pdf:
+            pdf.write(b"%PDF-1.4 other")
+
+        self.assertFalse(Manifest(self.journal, self.fingerprint).is_done(self.pdf), 'skipped')
+
+    def test_compact(self):
+        """ Test that old records are removed from the journal """
+        for _ in range(5):
+            self.process(Manifest(self.journal, self.fingerprint))
+
+        manifest = Manifest(self.journal, self.fingerprint)
+        manifest.close()
+        with open(self.journal) as journal:
+            self.assertEqual(1, len(journal.readlines()), 'does not match')
+        self.assertTrue(manifest.is_done(self.pdf), 'not skipped')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from PyPDF2 import PdfReader, PdfWriter
+
+import functions
+import sample_pdfs
+from merged_pdf import MergedPdf
+
+
+class TestMergedPdf(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "pdf_crop_merge.pdf")
+        self.labels = []
+        for seed in range(4):
+            label = os.path.join(self.directory.name, f"label-{seed}.pdf")
+            sample_pdfs.make_label_pdf(label, seed, pages=3, invoice_pages=0)
+            self.labels.append(label)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def merge(self, merged_pdf):
+        """ Merge every label into a merged pdf """
+        for label in self.labels:
+            merged_pdf.add_pages(list(PdfReader(label).pages))
+        merged_pdf.write()
+        return [len(PdfReader(volume).pages) for volume in merged_pdf.volumes]
+
+    def test_unsplit(self):
+        """ Test that without limits, a single merged pdf is written """
+        merged_pdf = MergedPdf(self.filename)
+        self.assertEqual([], self.merge(merged_pdf))
+        self.assertEqual(12, len(PdfReader(self.filename).pages))
+
+    def test_split_by_pages(self):
+        """ Test that volumes have at most the page limit """
+        merged_pdf = MergedPdf(self.filename, max_pages=5)
+        self.assertEqual([5, 5, 2], self.merge(merged_pdf))
+        self.assertEqual(self.filename.replace(".pdf", "-003.pdf"), merged_pdf.volumes[-1])
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_split_by_size(self):
+        """ Test that volumes stay under the size limit, and keep the pages of each pdf together """
+        size = MergedPdf.measure(list(PdfReader(self.labels[0]).pages))
+        merged_pdf = MergedPdf(self.filename, max_bytes=size // 2)
+        # The pages are never written an extra time just to find their size
+        with mock.patch.object(MergedPdf, "measure", side_effect=AssertionError("measured")):
+            self.assertEqual([9, 3], self.merge(merged_pdf))
+        for volume in merged_pdf.volumes:
+            self.assertLessEqual(os.path.getsize(volume), size // 2, 'volume too big')
+
+    def test_estimate(self):
+        """ Test that the estimated size of pages is close to their size written on their own as a pdf """
+        for label in self.labels:
+            pages = list(PdfReader(label).pages)
+            merged_pdf = MergedPdf()
+            merged_pdf._page_resources(pages)
+            self.assertAlmostEqual(MergedPdf.measure(pages), merged_pdf.estimate(pages), delta=100)
+
+    def test_split_by_size_shared(self):
+        """ Test that resources already in a volume don't count against its size, so volumes are nearly full """
+        for seed in range(4, 20):
+            label = os.path.join(self.directory.name, f"label-{seed}.pdf")
+            sample_pdfs.make_label_pdf(label, seed, pages=3, invoice_pages=0)
+            self.labels.append(label)
+
+        # Every label on its own is as big as the limit, mostly from the font and logo
+        size = MergedPdf.measure(list(PdfReader(self.labels[0]).pages))
+        merged_pdf = MergedPdf(self.filename, max_bytes=size)
+        pages = self.merge(merged_pdf)
+        self.assertEqual(60, sum(pages))
+        self.assertTrue(all(volume_pages % 3 == 0 for volume_pages in pages))
+        for volume in merged_pdf.volumes:
+            self.assertLessEqual(os.path.getsize(volume), size, 'volume too big')
+        for volume in merged_pdf.volumes[:-1]:
+            self.assertGreater(os.path.getsize(volume), size * 0.8, 'volume far under the limit')
+
+    def test_shared_resources_are_stored_once(self):
+        """ Test that the same font and logo in every label are stored once, and each barcode is kept """
+        merged_pdf = MergedPdf(self.filename)
+        self.merge(merged_pdf)
+
+        merged = PdfReader(self.filename)
+        images = set()
+        fonts = set()
+        for page in merged.pages:
+            xobjects = page['/Resources']['/XObject']
+            images.update(xobjects.raw_get(name).idnum for name in xobjects)
+            fonts.add(page['/Resources']['/Font']['/F2']['/FontDescriptor'].raw_get('/FontFile2').idnum)
+
+        # One logo, and a barcode for each of the 12 labels
+        self.assertEqual(13, len(images))
+        self.assertEqual(1, len(fonts))
+        # Every page of a label has its own copy of the logo and the font
+        self.assertEqual(2 * 11, merged_pdf.deduplicated)
+        self.assertGreater(merged_pdf.bytes_saved, 0)
+
+    def test_writer_translations(self):
+        """ Test the PyPDF2 writer internals that resources are shared through, so an upgrade that changes them
+        fails here instead of silently copying every resource again """
+        first, second = PdfReader(self.labels[0]).pages[0], PdfReader(self.labels[1]).pages[0]
+        name = next(iter(first['/Resources']['/XObject']))
+        writer = PdfWriter()
+        writer.add_page(first)
+        source = first['/Resources']['/XObject'].raw_get(name)
+        copied = writer._id_translated[id(first.pdf)][source.idnum]
+
+        # A translation added for another reader's object makes the writer use the copy instead
+        writer._id_translated.setdefault(id(second.pdf), {})[second['/Resources']['/XObject'].raw_get(name).idnum] = \
+            copied
+        page = writer.add_page(second)
+        self.assertEqual(copied, page['/Resources']['/XObject'].raw_get(name).idnum)
+
+    def test_leftover_volumes_are_removed(self):
+        """ Test that volumes from an earlier, bigger batch are removed, and never treated as input """
+        self.merge(MergedPdf(self.filename, max_pages=2))
+        self.merge(MergedPdf(self.filename, max_pages=5))
+
+        pdfs = functions.get_all_pdfs(self.directory.name + "/", "pdf_crop_merge.pdf")
+        self.assertEqual(sorted(self.labels), pdfs)
+        self.assertFalse(os.path.exists(self.filename.replace(".pdf", "-004.pdf")))
+
+
+if __name__ == '__main__':
+    unittest.main()
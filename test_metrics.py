@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+import unittest
+
+from metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.metrics = Metrics()
+        self.metrics.add_time("filter", 0.5)
+        self.metrics.add_time("filter", 1.5)
+        self.metrics.count("pages_filtered", 3)
+        self.metrics.add_file("label.pdf", 4, 3, 2.0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_worker_metrics_are_merged(self):
+        """ Test that metrics sent back by a worker process add to the main process's metrics """
+        worker = Metrics()
+        worker.add_time("filter", 1.0)
+        worker.add_time("write", 0.25)
+        worker.count("pages_filtered")
+        self.metrics.merge(worker.snapshot())
+
+        report = self.metrics.report()
+        self.assertEqual({"seconds": 3.0, "calls": 3, "average_seconds": 1.0}, report["stages"]["filter"])
+        self.assertEqual(0.25, report["stages"]["write"]["seconds"])
+        self.assertEqual(4, report["counters"]["pages_filtered"])
+
+    def test_json_report(self):
+        """ Test that the JSON report has the stages, counters and files """
+        filename = os.path.join(self.directory.name, "metrics.json")
+        self.metrics.write_json(filename)
+
+        with open(filename) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(2, report["stages"]["filter"]["calls"])
+        self.assertEqual(3, report["counters"]["pages_filtered"])
+        self.assertEqual("label.pdf", report["files"][0]["file"])
+
+    def test_recent_files(self):
+        """ Test that only the most recent files are kept, so a long running program doesn't keep every file """
+        for number in range(Metrics.RECENT_FILES + 5):
+            self.metrics.add_file(f"label-{number}.pdf", 1, 1, 0.1)
+
+        files = self.metrics.report()["files"]
+        self.assertEqual(Metrics.RECENT_FILES, len(files))
+        self.assertEqual("label-5.pdf", files[0]["file"])
+        self.assertEqual(f"label-{Metrics.RECENT_FILES + 4}.pdf", files[-1]["file"])
+
+    def test_prometheus_textfile(self):
+        """ Test that every Prometheus sample has a type, and no temporary file is left behind """
+        filename = os.path.join(self.directory.name, "pdf_batch_crop.prom")
+        self.metrics.write_prometheus(filename)
+
+        with open(filename) as metrics_file:
+            lines = metrics_file.read().splitlines()
+        self.assertIn('pdf_batch_crop_stage_seconds_total{stage="filter"} 2.0', lines)
+        self.assertIn('pdf_batch_crop_pages_filtered_total 3', lines)
+        self.assertIn('# TYPE pdf_batch_crop_pages_filtered_total counter', lines)
+        typed = {line.split()[2] for line in lines if line.startswith("# TYPE")}
+        for line in lines:
+            if line.startswith("# TYPE") and line.endswith(" counter"):
+                self.assertTrue(line.split()[2].endswith("_total"), line)
+        for line in lines:
+            if not line.startswith("#"):
+                self.assertIn(line.split("{")[0].split()[0], typed, 'untyped sample')
+        self.assertEqual(["pdf_batch_crop.prom"], os.listdir(self.directory.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+
+from PyPDF2 import PdfReader
+
+import batch
+import functions
+import sample_pdfs
+from config import Config
+from metrics import metrics
+from output import Output
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BOUNDING_BOX = [470.0, 748.0, 542.0, 140.0]
+
+
+class TestOutputs(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_directory = os.path.join(self.directory.name, "labels")
+        self.filenames, self.total_pages = sample_pdfs.make_batch(self.input_directory, 4)
+
+        self.pages = {}
+        for filename in self.filenames:
+            texts = [page.extract_text() for page in PdfReader(filename).pages]
+            self.pages[filename] = (sum(1 for text in texts if sample_pdfs.FILTER_TEXT not in text),
+                                    sum(1 for text in texts if sample_pdfs.FILTER_TEXT in text))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_outputs(self):
+        """ Test that every output of a pdf gets its pages, cropped its own way, from a single parse """
+        outputs = [Output("invoices", "invoice", "filtered"),
+                   Output("customs", "", "filtered", [0.0, 300.0, 0.0, 200.0]),
+                   Output("original", "original", "all")]
+        metrics.reset()
+        results = list(batch.process_all(self.filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False, "crop",
+                                         outputs=outputs))
+        self.assertLessEqual(metrics.stages.get("extract_text", {"calls": 0})["calls"], self.total_pages)
+        self.assertEqual(self.total_pages, metrics.counters["pages_read"])
+
+        for result in results:
+            self.assertTrue(result.ok, result.error)
+            kept, filtered = self.pages[result.filename]
+            self.assertEqual(kept, result.new_pages)
+            for page in PdfReader(result.new_filename).pages:
+                self.assertEqual([470, 542, 748, 140], [float(position) for position in page.cropbox])
+
+            original = PdfReader(result.outputs["original"]).pages
+            self.assertEqual(kept + filtered, len(original))
+            for page in original:
+                self.assertEqual([0, 0, 612, 792], [float(position) for position in page.cropbox])
+
+            if not filtered:
+                self.assertEqual(["original"], list(result.outputs))
+                continue
+            self.assertEqual(result.filename.replace(".pdf", "-invoice.pdf"), result.outputs["invoices"])
+            invoices = PdfReader(result.outputs["invoices"]).pages
+            self.assertEqual(filtered, len(invoices))
+            self.assertTrue(all(sample_pdfs.FILTER_TEXT in page.extract_text() for page in invoices))
+            for page in PdfReader(result.outputs["customs"]).pages:
+                self.assertEqual([0, 0, 300, 200], [float(position) for position in page.cropbox])
+
+        # Outputs aren't found as new pdfs to process
+        found = list(functions.scan_pdfs(self.input_directory + "/", "merged.pdf",
+                                         ["crop"] + [output.suffix for output in outputs]))
+        self.assertEqual(self.filenames, found)
+
+    def test_config(self):
+        """ Test that outputs are read from config.ini, and invalid outputs raise an exception """
+        config_filename = os.path.join(self.directory.name, "settings.ini")
+
+        def config(outputs):
+            with open(os.path.join(SCRIPT_DIRECTORY, "config.ini")) as config_file:
+                settings = config_file.read()
+            with open(config_filename, "w") as config_file:
+                config_file.write(settings + "\n" + outputs + "\n")
+            return Config(["-d", self.input_directory], config_filename)
+
+        invoices, customs = config("[OUTPUT invoices]\nsuffix = invoice\npages = filtered\n"
+                                   "[OUTPUT customs]\npages = filtered\nbounding_box = 0 300 0 200\n"
+                                   "rotate = yes").outputs
+        self.assertEqual(("invoice", "filtered", None, False),
+                         (invoices.suffix, invoices.pages, invoices.bounding_box, invoices.rotate))
+        self.assertEqual(("customs", [0.0, 300.0, 0.0, 200.0], True),
+                         (customs.suffix, customs.bounding_box, customs.rotate))
+
+        for outputs in ("[OUTPUT invoices]\npages = some", "[OUTPUT invoices]\nsuffix = crop",
+                        "[OUTPUT invoices]\n[OUTPUT other]\nsuffix = invoices", "[OUTPUT in voices]"):
+            with self.subTest(outputs=outputs):
+                with self.assertRaises(ValueError):
+                    config(outputs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import io
+import re
+import unittest
+
+from PyPDF2 import PageObject, PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+from page_filter import PageFilter
+
+
+def font(base_font="/Helvetica", **entries):
+    """ Create a font dictionary """
+    font_dictionary = DictionaryObject({NameObject("/Type"): NameObject("/Font"),
+                                        NameObject("/Subtype"): NameObject("/Type1"),
+                                        NameObject("/BaseFont"): NameObject(base_font)})
+    for key, value in entries.items():
+        font_dictionary[NameObject("/" + key)] = value
+    return font_dictionary
+
+
+def stream(data, **entries):
+    """ Create a stream object """
+    stream_object = DecodedStreamObject()
+    stream_object.set_data(data)
+    for key, value in entries.items():
+        stream_object[NameObject("/" + key)] = value
+    return stream_object
+
+
+def make_page(content, fonts=None, xobjects=None, graphics_states=None):
+    """ Create a page, written to and read back from a pdf, so it is parsed like any input pdf """
+    page = PageObject.create_blank_page(None, 612, 792)
+    resources = DictionaryObject()
+    fonts = {"/F1": font()} if fonts is None else fonts
+    if fonts:
+        resources[NameObject("/Font")] = DictionaryObject({NameObject(k): v for k, v in fonts.items()})
+    if xobjects:
+        resources[NameObject("/XObject")] = DictionaryObject({NameObject(k): v for k, v in xobjects.items()})
+    if graphics_states:
+        resources[NameObject("/ExtGState")] = DictionaryObject({NameObject(k): v
+                                                                for k, v in graphics_states.items()})
+    page[NameObject("/Resources")] = resources
+    page[NameObject("/Contents")] = stream(content)
+
+    writer = PdfWriter()
+    writer.add_page(page)
+    output = io.BytesIO()
+    writer.write(output)
+    return PdfReader(io.BytesIO(output.getvalue())).pages[0]
+
+
+def form(content, fonts=None):
+    """ Create a form XObject """
+    resources = DictionaryObject()
+    if fonts is not False:
+        fonts = {"/F1": font()} if fonts is None else fonts
+        resources[NameObject("/Font")] = DictionaryObject({NameObject(k): v for k, v in fonts.items()})
+    entries = {"Type": NameObject("/XObject"), "Subtype": NameObject("/Form"),
+               "BBox": ArrayObject([NumberObject(0), NumberObject(0), NumberObject(612), NumberObject(792)])}
+    form_stream = stream(content, **entries)
+    if fonts is not False:
+        form_stream[NameObject("/Resources")] = resources
+    return form_stream
+
+
+PAGES = {
+    "single string": (b"BT /F1 12 Tf 72 700 Td (Commercial Invoice) Tj ET", {}),
+    "label": (b"BT /F1 12 Tf 72 700 Td (Ship To: J. Smith) Tj 0 -14 Td (Tracking 1234) Tj ET", {}),
+    "split over lines": (b"BT /F1 12 Tf 72 700 Td (Commercial) Tj 0 -14 Td (Invoice) Tj ET", {}),
+    "split on one line": (b"BT /F1 12 Tf 72 700 Td (Commercial ) Tj 80 0 Td (Invoice) Tj ET", {}),
+    "kerned array": (b"BT /F1 12 Tf 72 700 Td [(Commer) -20 (cial Inv) 10 (oice)] TJ ET", {}),
+    "wide kerned array": (b"BT /F1 12 Tf 72 700 Td [(Commercial) -900 (Invoice)] TJ ET", {}),
+    "hex string": (b"BT /F1 12 Tf 72 700 Td <436F6D6D65726369616C20496E766F696365> Tj ET", {}),
+    "escaped string": (b"BT /F1 12 Tf 72 700 Td (\\(Commercial\\) \\111nvoice \\\\) Tj ET", {}),
+    "quote operator": (b"BT /F1 12 Tf 14 TL 72 700 Td (Page 1) Tj (Commercial Invoice) ' ET", {}),
+    "no text": (b"0 0 m 100 100 l S", {}),
+    "no content": (b"", {}),
+    "marked content": (b"/Span <</ActualText (Commercial Invoice)>> BDC BT /F1 12 Tf 72 700 Td (Label) Tj ET EMC",
+                       {}),
+    "win ansi font": (b"BT /F1 12 Tf 72 700 Td (Commercial Invoice) Tj ET",
+                      {"fonts": {"/F1": font(Encoding=NameObject("/WinAnsiEncoding"))}}),
+    "differences font": (b"BT /F1 12 Tf 72 700 Td (Commercial Invoice) Tj ET",
+                         {"fonts": {"/F1": font(Encoding=DictionaryObject(
+                             {NameObject("/Differences"): ArrayObject()}))}}),
+    "symbol font": (b"BT /F1 12 Tf 72 700 Td (Commercial Invoice) Tj ET",
+                    {"fonts": {"/F1": font("/Symbol")}}),
+    "to unicode font": (b"BT /F1 12 Tf 72 700 Td (Label) Tj ET",
+                        {"fonts": {"/F1": font(ToUnicode=stream(b""))}}),
+    "missing font": (b"BT /F9 12 Tf 72 700 Td (Commercial Invoice) Tj ET", {}),
+    "form": (b"q /Fm1 Do Q",
+             {"xobjects": {"/Fm1": form(b"BT /F1 12 Tf 72 700 Td (Commercial Invoice) Tj ET")}}),
+    "form label": (b"q /Fm1 Do Q BT /F1 12 Tf 72 600 Td (Tracking 1234) Tj ET",
+                   {"xobjects": {"/Fm1": form(b"BT /F1 12 Tf 72 700 Td (Ship To) Tj ET")}}),
+    "form without resources": (b"q /Fm1 Do Q",
+                               {"xobjects": {"/Fm1": form(b"BT /F1 12 Tf 72 700 Td (Commercial Invoice) Tj ET",
+                                                          fonts=False)}}),
+    "inline image": (b"q BI /W 1 /H 1 /BPC 8 /CS /G ID \x00 EI Q BT /F1 12 Tf 72 700 Td (Label) Tj ET", {}),
+}
+
+FILTERS = ["Commercial Invoice", "Invoice", "CommercialInvoice", "Tracking", "Tracking 1234", "Ship To",
+           "Commercial\\s+Invoice", "^$", "Inv.ice", "(Commercial)", "Label"]
+
+
+class TestPageFilter(unittest.TestCase):
+    pages = {name: make_page(content, **options) for name, (content, options) in PAGES.items()}
+
+    def test_matches_text_extraction(self):
+        """ Test that every verdict is the same as searching the extracted text """
+        for filter_text in FILTERS:
+            page_filter = PageFilter(filter_text)
+            for name, page in self.pages.items():
+                with self.subTest(filter_text=filter_text, page=name):
+                    expected = re.search(filter_text, page.extract_text()) is not None
+                    self.assertEqual(expected, page_filter.matches(page), 'does not match')
+
+    def test_scan_decides_simple_pages(self):
+        """ Test that the content stream scan decides plain text filters on simple pages """
+        page_filter = PageFilter("Commercial Invoice")
+        for name in ("single string", "label", "hex string", "quote operator", "no text", "form",
+                     "form label", "win ansi font"):
+            with self.subTest(page=name):
+                self.assertIsNotNone(page_filter.scan(self.pages[name]), 'not decided')
+
+    def test_scan_falls_back(self):
+        """ Test that the content stream scan doesn't decide pages it can't read reliably """
+        page_filter = PageFilter("Commercial Invoice")
+        for name in ("split over lines", "differences font", "symbol font", "to unicode font", "missing font",
+                     "form without resources", "inline image"):
+            with self.subTest(page=name):
+                self.assertIsNone(page_filter.scan(self.pages[name]), 'decided')
+
+    def test_regular_expressions_fall_back(self):
+        """ Test that regular expressions are only decided on pages without text """
+        page_filter = PageFilter("Commercial\\s+Invoice")
+        self.assertIsNone(page_filter.scan(self.pages["single string"]), 'decided')
+        self.assertFalse(page_filter.scan(self.pages["no text"]), 'does not match')
+
+
+if __name__ == '__main__':
+    unittest.main()
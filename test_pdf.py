@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import sample_pdfs
+from pdf import Pdf, ReaderPool
+
+
+class TestReaderPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filenames = []
+        for seed in range(3):
+            filename = os.path.join(self.directory.name, f"label-{seed}.pdf")
+            sample_pdfs.make_label_pdf(filename, seed, pages=1, invoice_pages=0)
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_evicted_files_closed(self):
+        """ Test that once the pool is full, the file of the least recently used reader is closed """
+        pool = ReaderPool(2)
+        streams = {}
+        open_file = ReaderPool.open
+
+        def record(filename, input_mode):
+            streams[filename], size = open_file(filename, input_mode)
+            return streams[filename], size
+
+        with mock.patch.object(ReaderPool, "open", side_effect=record):
+            first = pool.get(self.filenames[0], "buffered")
+            pool.get(self.filenames[1], "buffered")
+            self.assertIs(first, pool.get(self.filenames[0], "buffered"))
+            pool.get(self.filenames[2], "buffered")
+
+        self.assertEqual(2, len(pool))
+        self.assertEqual([False, True, False], [streams[filename].closed for filename in self.filenames])
+        pool.close_all()
+        self.assertEqual(0, len(pool))
+        self.assertTrue(all(stream.closed for stream in streams.values()))
+
+    def test_data_not_pooled(self):
+        """ Test that pdfs held in memory are read from their own data, even when they have the same name """
+        pool = ReaderPool(2)
+        long_label = os.path.join(self.directory.name, "long-label.pdf")
+        sample_pdfs.make_label_pdf(long_label, 0, pages=2, invoice_pages=0)
+        readers = []
+        for filename in (self.filenames[0], long_label, self.filenames[0]):
+            with open(filename, "rb") as file:
+                readers.append(pool.get("upload.pdf", data=file.read()))
+        self.assertEqual([1, 2, 1], [len(reader.pages) for reader in readers])
+        self.assertEqual(0, len(pool))
+
+        # A pdf keeps reading its own data while it is open
+        with open(long_label, "rb") as file:
+            pdf = Pdf("upload.pdf", None, None, False, data=file.read())
+        self.assertIs(pdf.file, pdf.file)
+        self.assertEqual(2, len(pdf.file.pages))
+
+
+if __name__ == '__main__':
+    unittest.main()
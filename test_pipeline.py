@@ -0,0 +1,130 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from PyPDF2 import PdfReader
+
+import batch
+import sample_pdfs
+from merged_pdf import MergedPdf
+from metrics import metrics
+from pipeline import Pipeline
+
+BOUNDING_BOX = [470.0, 748.0, 542.0, 140.0]
+
+
+def slow(function, seconds):
+    """ Wrap a function so it takes at least some time, like waiting on a disk """
+    def wrapped(item):
+        time.sleep(seconds)
+        return function(item)
+    return wrapped
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_order(self):
+        """ Test that every item goes through every stage, with results in the same order as the items """
+        pipeline = Pipeline(lambda item: item + 1, lambda item: item * 2, str, 2)
+        self.assertEqual([str((item + 1) * 2) for item in range(50)], list(pipeline.run(range(50))))
+        self.assertEqual([], list(pipeline.run([])))
+
+        report = metrics.report()
+        self.assertLessEqual(report["queues"]["read"]["max_depth"], 2)
+        self.assertEqual(50, report["queues"]["write"]["samples"])
+        self.assertIn("pipeline_wait_read", report["stages"])
+
+    def test_overlap(self):
+        """ Test that reading and writing overlap with processing """
+        items = list(range(8))
+        pipeline = Pipeline(slow(str, 0.05), slow(int, 0.05), slow(str, 0.05), 2)
+        start_time = time.perf_counter()
+        self.assertEqual([str(item) for item in items], list(pipeline.run(items)))
+        # Each stage takes 0.4 seconds in total, so running them in turn would take 1.2 seconds
+        self.assertLess(time.perf_counter() - start_time, 0.9)
+
+    def test_errors(self):
+        """ Test that an error finding the items is raised after the results before it, and threads stop """
+        def items():
+            yield 1
+            yield 2
+            raise OSError("scan failed")
+
+        results = []
+        with self.assertRaises(OSError):
+            for result in Pipeline(int, int, int, 1).run(items()):
+                results.append(result)
+        self.assertEqual([1, 2], results)
+
+        threads = threading.active_count()
+        results = Pipeline(int, int, int, 1).run(range(1000))
+        self.assertEqual(0, next(results))
+        results.close()
+        time.sleep(Pipeline.STOP_INTERVAL * 3)
+        self.assertLessEqual(threading.active_count(), threads)
+
+    def test_write_errors(self):
+        """ Test that an error writing an item is raised in place of its result, instead of stopping the writer """
+        def write(item):
+            if item == 3:
+                raise ValueError("write failed")
+            return item
+
+        results = []
+        errors = []
+
+        def run():
+            try:
+                results.extend(Pipeline(int, int, write, 1).run(range(10)))
+            except ValueError as ex:
+                errors.append(ex)
+
+        # The pipeline used to wait forever for the writer, so it is run where the test can give up on it
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), 'pipeline never finished')
+        self.assertEqual([0, 1, 2], results)
+        self.assertEqual(1, len(errors))
+
+
+class TestPipelinedBatch(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        self.filenames, self.total_pages = sample_pdfs.make_batch(self.directory.name, 6)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_process_all(self):
+        """ Test that the pipeline crops, merges and writes the same as processing each pdf in turn """
+        filenames = self.filenames + [os.path.join(self.directory.name, "missing.pdf")]
+        merged_pdf = MergedPdf()
+        results = list(batch.process_all(filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False, "crop",
+                                         merged_pdf=merged_pdf, pipeline_depth=2))
+        self.assertEqual(filenames, [result.filename for result in results])
+        self.assertFalse(results[-1].ok)
+
+        expected = list(batch.process_all(self.filenames, sample_pdfs.FILTER_TEXT, BOUNDING_BOX, False, "expected"))
+        for result, expected_result in zip(results, expected):
+            self.assertTrue(result.ok, result.error)
+            self.assertEqual(expected_result.new_pages, result.new_pages)
+            self.assertEqual(result.new_pages, len(PdfReader(result.new_filename).pages))
+        self.assertEqual(sum(result.new_pages for result in expected), merged_pdf.pages)
+        self.assertEqual(len(self.filenames), metrics.stages["write_file"]["calls"])
+
+    def test_write_error(self):
+        """ Test that any error writing a pdf fails only that pdf """
+        new_filename = os.path.join(self.directory.name, "label-crop.pdf")
+        result = batch._write_processed_pdf((batch.PdfResult(self.filenames[0], new_filename), "not bytes"))
+        self.assertFalse(result.ok)
+        self.assertIsNone(result.new_filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
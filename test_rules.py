@@ -0,0 +1,143 @@
+import os
+import random
+import tempfile
+import unittest
+
+from PyPDF2 import PdfReader
+
+import batch
+import sample_pdfs
+from config import Config
+from metrics import metrics
+from page_filter import PageText
+from pattern_set import PatternSet
+from rules import Profile, RuleEngine
+from test_page_filter import make_page
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BOUNDING_BOX = [470.0, 748.0, 542.0, 140.0]
+
+
+class TestPatternSet(unittest.TestCase):
+    def test_find(self):
+        """ Test that the automaton finds the same patterns as looking for each one, including overlapping patterns """
+        rng = random.Random(0)
+        words = ["".join(rng.choice("ABCDE") for _ in range(rng.randint(1, 6))) for _ in range(200)]
+        words += ["he", "she", "his", "hers"]
+        automaton = PatternSet(words)
+        self.assertIsNotNone(automaton._goto)
+
+        for _ in range(50):
+            text = "".join(rng.choice("ABCDE shr") for _ in range(rng.randint(0, 80)))
+            with self.subTest(text=text):
+                self.assertEqual({word for word in words if word in text}, automaton.find(text))
+
+        few = PatternSet(["he", "she", "", "he"])
+        self.assertIsNone(few._goto)
+        self.assertEqual(["he", "she"], few.patterns)
+        self.assertEqual({"he", "she"}, few.find("ushers"))
+
+
+class TestRuleEngine(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def classify(self, engine, page, filename="label.pdf"):
+        profile = engine.classify(page, engine.file_profiles(filename), PageText(page))
+        return profile and profile.name
+
+    def test_classify(self):
+        """ Test that the first profile whose conditions all match is chosen """
+        engine = RuleEngine([Profile("fedex", ["FedEx", "FDX"], filenames=["fedex-*.pdf"]),
+                             Profile("ups", ["UPS", "1Z"]),
+                             Profile("large", page_size=(612, 792), regex=r"Order \d+"),
+                             Profile("letter", page_size=(792, 612))])
+
+        self.assertEqual("ups", self.classify(engine, make_page(b"BT /F1 12 Tf (FedEx via UPS) Tj ET")))
+        self.assertEqual("fedex", self.classify(engine, make_page(b"BT /F1 12 Tf (FedEx via UPS) Tj ET"),
+                                                "/labels/fedex-1.pdf"))
+        self.assertEqual("large", self.classify(engine, make_page(b"BT /F1 12 Tf (Order 1234) Tj ET")))
+        self.assertEqual("letter", self.classify(engine, make_page(b"BT /F1 12 Tf (Order) Tj ET")))
+        self.assertEqual("letter", self.classify(engine, make_page(b"")))
+
+        engine = RuleEngine([Profile("ups", ["UPS"])])
+        self.assertIsNone(self.classify(engine, make_page(b"BT /F1 12 Tf (USPS) Tj ET")))
+
+    def test_text_extraction(self):
+        """ Test that the text is only extracted when the drawn strings can't decide """
+        engine = RuleEngine([Profile("invoice", ["Commercial Invoice"])])
+
+        self.assertEqual("invoice", self.classify(engine, make_page(b"BT /F1 12 Tf (Commercial Invoice) Tj ET")))
+        self.assertIsNone(self.classify(engine, make_page(b"BT /F1 12 Tf (Packing Slip) Tj ET")))
+        self.assertNotIn("pages_rules_extracted", metrics.counters)
+
+        # The text is split across two strings, so it depends on the whitespace text extraction adds
+        page = make_page(b"BT /F1 12 Tf (Commercial ) Tj (Invoice) Tj ET")
+        self.assertEqual("invoice", self.classify(engine, page))
+        self.assertEqual(1, metrics.counters["pages_rules_extracted"])
+        self.assertEqual(2, metrics.counters["pages_profile_invoice"])
+
+
+class TestProfiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_directory = os.path.join(self.directory.name, "labels")
+        self.filenames, self.total_pages = sample_pdfs.make_batch(self.input_directory, 4)
+
+        self.config_filename = os.path.join(self.directory.name, "settings.ini")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def config(self, profiles):
+        with open(os.path.join(SCRIPT_DIRECTORY, "config.ini")) as config_file:
+            settings = config_file.read()
+        with open(self.config_filename, "w") as config_file:
+            config_file.write(settings + profiles)
+        return Config(["-d", self.input_directory, "-f", ""], self.config_filename)
+
+    def test_config(self):
+        """ Test that profiles are read from config.ini in order, and invalid profiles raise an exception """
+        config = self.config("\n[PROFILE invoice]\ntext =\n    Commercial Invoice\n    Pro Forma\nskip = yes\n"
+                             "\n[PROFILE label_00001]\nfilename = label-00001.pdf, other.pdf\n"
+                             "bounding_box = 0 100 0 200\nrotate = True\npage_size = 612x792\n")
+        invoice, label = config.profiles
+        self.assertEqual(["Commercial Invoice", "Pro Forma"], invoice.texts)
+        self.assertTrue(invoice.skip)
+        self.assertIsNone(invoice.bounding_box)
+        self.assertEqual(["label-00001.pdf", "other.pdf"], label.filenames)
+        self.assertEqual([0.0, 100.0, 0.0, 200.0], label.bounding_box)
+        self.assertEqual((612.0, 792.0), label.page_size)
+        self.assertEqual(2, len(config.rules))
+
+        for profiles in ("[PROFILE ups]\nbounding_box = 1 2 3", "[PROFILE ups]\npage_size = letter",
+                         "[PROFILE ups]\nrotate = sometimes", "[PROFILE ups]\nregex = (", "[PROFILE u-p-s]",
+                         "[PROFILE ups]\n[PROFILE  ups]"):
+            with self.subTest(profiles=profiles):
+                with self.assertRaises(ValueError):
+                    self.config("\n" + profiles + "\n")
+
+    def test_process(self):
+        """ Test that each page is cropped with its profile, in a single pass over the pdfs """
+        config = self.config("\n[PROFILE invoice]\ntext = Commercial Invoice\nskip = yes\n"
+                             "\n[PROFILE label_00001]\nfilename = label-00001.pdf\nbounding_box = 0 100 0 200\n")
+        expected_pages = {}
+        for filename in self.filenames:
+            pages = PdfReader(filename).pages
+            expected_pages[filename] = sum(1 for page in pages if sample_pdfs.FILTER_TEXT not in page.extract_text())
+        self.assertLess(sum(expected_pages.values()), self.total_pages)
+
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                results = list(batch.process_all(self.filenames, "", BOUNDING_BOX, False, f"crop{workers}", workers,
+                                                 rules=config.rules))
+                for result in results:
+                    self.assertTrue(result.ok, result.error)
+                    self.assertEqual(expected_pages[result.filename], result.new_pages)
+                    box = [0, 0, 100, 200] if result.filename.endswith("label-00001.pdf") else [470, 542, 748, 140]
+                    for page in PdfReader(result.new_filename).pages:
+                        self.assertEqual(box, [float(position) for position in page.cropbox])
+
+
+if __name__ == '__main__':
+    unittest.main()
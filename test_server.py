@@ -0,0 +1,75 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from PyPDF2 import PdfReader
+
+import sample_pdfs
+from config import Config
+from metrics import metrics
+from server import CropServer
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestCropServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        config_filename = os.path.join(self.directory.name, "config.ini")
+        shutil.copy(os.path.join(SCRIPT_DIRECTORY, "config.ini"), config_filename)
+        config = Config(["-d", self.directory.name, "-f", sample_pdfs.FILTER_TEXT], config_filename)
+
+        metrics.reset()
+        self.server = CropServer(config, port=0)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def post(self, path, data):
+        request = urllib.request.Request(self.server.url + path, data=data, method="POST")
+        return urllib.request.urlopen(request)
+
+    def test_crop(self):
+        """ Test that a pdf sent to the server comes back cropped, without the filtered page """
+        filename = os.path.join(self.directory.name, "label.pdf")
+        sample_pdfs.make_label_pdf(filename, 0, pages=2, invoice_pages=1)
+        with open(filename, "rb") as pdf_file:
+            response = self.post("/crop?name=label.pdf", pdf_file.read())
+
+        self.assertEqual("application/pdf", response.headers["Content-Type"])
+        self.assertEqual(("3", "2"), (response.headers["X-Pages"], response.headers["X-New-Pages"]))
+        pages = PdfReader(io.BytesIO(response.read())).pages
+        self.assertEqual(2, len(pages))
+        self.assertEqual([470, 542, 748, 140], [round(value) for value in pages[0].cropbox])
+
+        # No cropped pdf is written to the directory
+        self.assertEqual(["label.pdf"], [name for name in os.listdir(self.directory.name) if name.endswith(".pdf")])
+
+    def test_errors(self):
+        """ Test that a pdf that can't be read, and an unknown path, are reported """
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.post("/crop", b"not a pdf")
+        self.assertEqual(400, context.exception.code)
+        self.assertIn("error", json.load(context.exception))
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.post("/print", b"")
+        self.assertEqual(404, context.exception.code)
+
+        health = json.load(urllib.request.urlopen(self.server.url + "/health"))
+        self.assertEqual(1, health["counters"]["files_failed"])
+
+
+if __name__ == '__main__':
+    unittest.main()
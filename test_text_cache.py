@@ -0,0 +1,100 @@
+import concurrent.futures
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from text_cache import TextCache
+
+
+def set_in_worker(filename, key):
+    """ Cache a verdict from a worker process, returning the id of the connection it was cached through """
+    cache = TextCache.open(filename)
+    cache.set(key, True)
+    return id(cache.connection)
+
+
+class TestTextCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = TextCache.open(os.path.join(self.directory.name, "cache.sqlite"), 2, 1)
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+    def test_get(self):
+        """ Test that a cached verdict is a hit, and a verdict that isn't cached is a miss """
+        key = TextCache.key("page", "Commercial Invoice")
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, True)
+        self.assertIs(True, self.cache.get(key))
+        self.cache.set(key, False)
+        self.assertIs(False, self.cache.get(key))
+        self.assertEqual((2, 1), (self.cache.hits, self.cache.misses))
+
+    def test_used_written_in_batches(self):
+        """ Test that a hit doesn't write to the cache, and when verdicts were used is written once flushed """
+        with mock.patch("time.time", return_value=1000.0):
+            self.cache.set("a", True)
+        changes = self.cache.connection.total_changes
+        with mock.patch("time.time", return_value=2000.0):
+            self.assertIs(True, self.cache.get("a"))
+        self.assertEqual(changes, self.cache.connection.total_changes)
+
+        self.cache.flush()
+        self.assertEqual((2000.0,), self.cache.connection.execute("SELECT used FROM verdicts").fetchone())
+        self.assertEqual({}, self.cache.used)
+
+    def test_threads(self):
+        """ Test that the cache can be used from a thread other than the one that opened it """
+        self.cache.set("a", True)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            self.assertEqual([True, None], list(executor.map(self.cache.get, ["a", "b"])))
+
+    def test_key(self):
+        """ Test that the key includes the filter text, so changing the filter doesn't reuse old verdicts """
+        self.cache.set(TextCache.key("page", "Commercial Invoice"), True)
+        self.assertNotEqual(TextCache.key("page", "Commercial Invoice"), TextCache.key("page", "Packing Slip"))
+        self.assertIsNone(self.cache.get(TextCache.key("page", "Packing Slip")))
+        self.assertNotEqual(TextCache.key("page", "Invoice"), TextCache.key("page\nInvoice", ""))
+
+    def test_evict_entries(self):
+        """ Test that the least recently used verdicts are evicted once there are more than max_entries """
+        now = time.time()
+        for offset, key in enumerate(("a", "b", "c")):
+            with mock.patch("time.time", return_value=now + offset):
+                self.cache.set(key, True)
+        with mock.patch("time.time", return_value=now + 3):
+            self.cache.get("a")
+
+        self.assertEqual(1, self.cache.evict())
+        self.assertEqual(2, len(self.cache))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIs(True, self.cache.get("a"))
+
+    def test_evict_days(self):
+        """ Test that verdicts unused for more than max_days are evicted """
+        with mock.patch("time.time", return_value=time.time() - 2 * 86400):
+            self.cache.set("old", True)
+        self.cache.set("new", True)
+
+        self.assertEqual(1, self.cache.evict())
+        self.assertIsNone(self.cache.get("old"))
+        self.assertIs(True, self.cache.get("new"))
+
+    def test_workers(self):
+        """ Test that worker processes forked after the cache was opened connect to it again """
+        self.cache.set("a", False)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(set_in_worker, self.cache.filename, key) for key in ("b", "c")]
+            connections = [future.result() for future in futures]
+
+        self.assertNotIn(id(self.cache.connection), connections)
+        self.assertEqual(3, len(self.cache))
+        self.assertIs(True, self.cache.get("b"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from watcher import Watcher
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        # The size and modified time of each pdf in the fake directory
+        self.files = {}
+        self.watcher = Watcher("/labels/", "pdf_crop_merge.pdf", ["crop"], 2, scan=lambda: sorted(self.files))
+        patcher = mock.patch("watcher.os.stat", side_effect=self.stat)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stat(self, filename):
+        if filename not in self.files:
+            raise FileNotFoundError(filename)
+        size, mtime = self.files[filename]
+        return os.stat_result((0o100644, 0, 0, 1, 0, 0, size, 0, 0, 0, 0, 0, 0, mtime))
+
+    def test_growing_file_waits(self):
+        """ Test that a pdf still being written isn't handed out until it stops changing """
+        self.files["/labels/a.pdf"] = (100, 1)
+        self.assertEqual([], self.watcher.poll())
+        self.files["/labels/a.pdf"] = (200, 2)
+        self.assertEqual([], self.watcher.poll())
+        self.files["/labels/a.pdf"] = (300, 3)
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual(["/labels/a.pdf"], self.watcher.poll())
+
+    def test_empty_file_waits(self):
+        """ Test that a pdf that has been created but not written to yet isn't handed out """
+        self.files["/labels/a.pdf"] = (0, 1)
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual([], self.watcher.poll())
+
+    def test_stable_file_once(self):
+        """ Test that a pdf that has stopped changing is handed out once, and processed pdfs are left out """
+        self.files["/labels/a.pdf"] = (100, 1)
+        self.files["/labels/a-crop.pdf"] = (50, 1)
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual(["/labels/a.pdf"], self.watcher.poll())
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual([], self.watcher.poll())
+
+    def test_failed_file_retried(self):
+        """ Test that a pdf that failed is handed out again once it is written again, or when retried """
+        self.files["/labels/a.pdf"] = (100, 1)
+        self.watcher.poll()
+        self.assertEqual(["/labels/a.pdf"], self.watcher.poll())
+
+        # The pdf failed and is left in place, until it is replaced with a fixed one
+        self.assertEqual([], self.watcher.poll())
+        self.files["/labels/a.pdf"] = (120, 2)
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual(["/labels/a.pdf"], self.watcher.poll())
+
+        # A pdf another station was processing is handed out again once it is still unchanged
+        self.watcher.retry(["/labels/a.pdf"])
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual(["/labels/a.pdf"], self.watcher.poll())
+
+    def test_removed_file_forgotten(self):
+        """ Test that a pdf archived and then added again is handed out again """
+        self.files["/labels/a.pdf"] = (100, 1)
+        self.watcher.poll()
+        self.assertEqual(["/labels/a.pdf"], self.watcher.poll())
+        del self.files["/labels/a.pdf"]
+        self.assertEqual([], self.watcher.poll())
+
+        self.files["/labels/a.pdf"] = (100, 1)
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual(["/labels/a.pdf"], self.watcher.poll())
+
+    def test_watch(self):
+        """ Test that watch waits the interval between polls, and only yields when there are new pdfs """
+        self.files["/labels/a.pdf"] = (100, 1)
+        with mock.patch("watcher.time.sleep") as sleep:
+            self.assertEqual(["/labels/a.pdf"], next(self.watcher.watch()))
+        sleep.assert_called_once_with(2)
+
+
+
+class TestWatcherDirectory(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name + "/"
+        self.watcher = Watcher(self.path, "pdf_crop_merge.pdf", ["crop"], 2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, data, mtime):
+        with open(self.path + name, "ab") as pdf_file:
+            pdf_file.write(data)
+        os.utime(self.path + name, (mtime, mtime))
+
+    def test_directory(self):
+        """ Test that pdfs in a real directory are handed out once written, leaving out processed and merged pdfs """
+        self.write("a.pdf", b"%PDF-1.4\n", 1)
+        self.write("a-crop.pdf", b"%PDF-1.4\n", 1)
+        self.write("pdf_crop_merge.pdf", b"%PDF-1.4\n", 1)
+        self.assertEqual([], self.watcher.poll())
+        self.write("a.pdf", b"%%EOF\n", 2)
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual([self.path + "a.pdf"], self.watcher.poll())
+        self.assertEqual([], self.watcher.poll())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class TextCache:
+    """This class represents an on disk cache of page filter verdicts, so the text of a page is only
+    extracted once no matter how many runs or files it appears in. Entries are keyed by a hash of the
+    page's content and resources plus the filter text, and evicted by age and by count.
+
+    When each verdict was last used is only written in batches, so a cache hit doesn't write to the cache."""
+
+    # Verdicts used since the last write, before when they were used is written
+    FLUSH_ENTRIES = 1000
+
+    # One cache connection per cache file, per process, keyed by process id and filename. A worker forked after
+    # the cache was opened inherits the parent's connection, which sqlite must not use in another process, so the
+    # worker connects again instead. The inherited connection is never closed, since workers exit without
+    # cleaning up.
+    _opened = {}
+
+    def __init__(self, filename, max_entries=100000, max_days=30):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.max_days = max_days
+        self.hits = 0
+        self.misses = 0
+        # When each verdict used since the last write was used, keyed by cache key
+        self.used = {}
+
+        # The pipeline reads and processes pdfs on their own threads, and the server handles each request on one.
+        self._lock = threading.Lock()
+        # Several worker processes share the cache, so wait on locks rather than failing.
+        self.connection = sqlite3.connect(filename, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS verdicts "
+                                "(key TEXT PRIMARY KEY, verdict INTEGER NOT NULL, used REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS verdicts_used ON verdicts (used)")
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    @classmethod
+    def open(cls, filename, max_entries=100000, max_days=30):
+        """
+        Gets the cache for a filename, connecting to it the first time it is used in this process.
+        :param filename: The filename of the cache
+        :param max_entries: The most verdicts kept in the cache
+        :param max_days: Verdicts unused for this many days are removed
+        :return: A TextCache
+        """
+        key = (os.getpid(), filename)
+        cache = cls._opened.get(key)
+        if cache is None:
+            cache = cls(filename, max_entries, max_days)
+            cls._opened[key] = cache
+        else:
+            cache.max_entries = max_entries
+            cache.max_days = max_days
+        return cache
+
+    @staticmethod
+    def key(page_hash, filter_text):
+        """
+        Gets the cache key of a page and filter text.
+        :param page_hash: The hash of a page, from Pdf.page_hash
+        :param filter_text: The filter text
+        :return: The cache key
+        """
+        return hashlib.sha256(f"{page_hash}\n{filter_text}".encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Gets a cached filter verdict.
+        :param key: The cache key
+        :return: True if the page is filtered, False if it isn't, and None if it isn't cached.
+        """
+        with self._lock:
+            row = self.connection.execute("SELECT verdict FROM verdicts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.used[key] = time.time()
+            if len(self.used) >= self.FLUSH_ENTRIES:
+                self._flush()
+        return bool(row[0])
+
+    def set(self, key, verdict):
+        """
+        Cache a filter verdict.
+        :param key: The cache key
+        :param verdict: True if the page is filtered, False if it isn't.
+        """
+        with self._lock:
+            self.used.pop(key, None)
+            self.connection.execute("INSERT OR REPLACE INTO verdicts (key, verdict, used) VALUES (?, ?, ?)",
+                                    (key, int(verdict), time.time()))
+
+    def flush(self):
+        """
+        Write when each verdict used since the last write was used.
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        """
+        Write when each verdict used since the last write was used, in a single transaction. The lock must be held.
+        """
+        if not self.used:
+            return
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("UPDATE verdicts SET used = ? WHERE key = ?",
+                                        [(used, key) for key, used in self.used.items()])
+        self.used = {}
+
+    @classmethod
+    def flush_all(cls):
+        """
+        Write when each verdict was used, for every cache opened in this process, ie: before a worker process
+        sends back its result, since worker processes exit without closing their caches.
+        """
+        for (pid, _), cache in list(cls._opened.items()):
+            if pid == os.getpid():
+                cache.flush()
+
+    def evict(self):
+        """
+        Remove verdicts that are too old, then the least recently used verdicts until the cache is small enough.
+        :return: The number of verdicts removed
+        """
+        with self._lock:
+            self._flush()
+            removed = self.connection.execute("DELETE FROM verdicts WHERE used < ?",
+                                              (time.time() - self.max_days * 86400,)).rowcount
+            removed += self.connection.execute("DELETE FROM verdicts WHERE key IN "
+                                               "(SELECT key FROM verdicts ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                                               (self.max_entries,)).rowcount
+        return removed
+
+    def close(self):
+        """
+        Close the cache, writing when the verdicts were used first.
+        """
+        with self._lock:
+            self._flush()
+            self.connection.close()
+        self._opened.pop((os.getpid(), self.filename), None)
+
+
+def cache_filename(directory, filename):
+    """
+    Gets the absolute filename of a cache kept in the input directory.
+    :param directory: The input directory
+    :param filename: The filename of the cache, relative to the input directory. If blank, there is no cache.
+    :return: The absolute filename of the cache, or "" if there is no cache.
+    """
+    if not filename:
+        return ""
+    return os.path.join(directory, filename)
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+import os
+import time
+
+import functions
+
+
+class Watcher:
+    """This class watches a directory for new pdfs. A pdf is only ready to be processed once it has been
+    fully written, which is when its size and modified time are the same for two polls in a row."""
+    def __init__(self, directory, output_filename, suffix, interval, scan=None):
+        """
+        :param scan: (Optional) A function that finds the pdfs to watch, ie: BatchRunner.scan_pdfs.
+        Defaults to the pdfs directly in the directory.
+        """
+        self.directory = directory
+        self.output_filename = output_filename
+        self.suffix = suffix
+        self.interval = interval
+        self.scan = scan or (lambda: functions.get_all_pdfs(self.directory, self.output_filename))
+
+        # The last seen size and modified time of pdfs that are still being written, and of pdfs already handed out.
+        self.pending = {}
+        self.ready = {}
+
+    def poll(self):
+        """
+        Check the directory once for pdfs that are ready to be processed.
+        :return: A list of pdf filenames that are new or changed, and have been fully written.
+        """
+        new_pdfs = []
+        found = set()
+
+        for filename in self.scan():
+            if functions.is_processed_pdf(filename, self.suffix):
+                continue
+
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+
+            found.add(filename)
+            state = (stat.st_size, stat.st_mtime_ns)
+
+            if self.ready.get(filename) == state:
+                continue
+
+            if self.pending.get(filename) == state and stat.st_size > 0:
+                del self.pending[filename]
+                self.ready[filename] = state
+                new_pdfs.append(filename)
+            else:
+                self.pending[filename] = state
+
+        # Forget pdfs that have been archived or deleted
+        for tracked in (self.pending, self.ready):
+            for filename in [filename for filename in tracked if filename not in found]:
+                del tracked[filename]
+
+        return new_pdfs
+
+    def retry(self, filenames):
+        """
+        Hand out pdfs again once they are unchanged for two polls, ie: pdfs another station was processing.
+        :param filenames: A list of pdf filenames already handed out
+        """
+        for filename in filenames:
+            self.ready.pop(filename, None)
+
+    def watch(self):
+        """
+        Keep checking the directory for pdfs that are ready to be processed.
+        :return: A never ending generator of lists of pdf filenames
+        """
+        while True:
+            new_pdfs = self.poll()
+            if new_pdfs:
+                yield new_pdfs
+            time.sleep(self.interval)